@@ -1,32 +1,76 @@
+from datetime import date
 from typing import Any
-import json
 from fastapi import FastAPI, Form, Request, Query
 from functools import partial
+from contextlib import asynccontextmanager
 from fastapi.responses import Response,HTMLResponse
-from fastapi.encoders import jsonable_encoder
 from fastapi import HTTPException
 from fastapi.templating import Jinja2Templates
 # from fastapi.staticfiles import StaticFiles
 # from fastapi.responses import RedirectResponse
 # import uuid
-from app.services.file_handler import download_and_clean_csv, file_storage
+from app.services.file_handler import (
+    batch_stats, batch_storage, charset_from_content_type, close_async_client, fail_interrupted_jobs, file_storage,
+    register_batch, register_upload, run_append_job, run_batch_job, run_body_upload, run_upload_job, JOB_DONE,
+    JOB_FAILED,
+)
+from app.services.multipart_stream import open_multipart_file
+from app.services.jobs import upload_queue, shutdown_process_pool, QueueFullError
 # No longer need this import as processing_stats.py is removed
 # from app.services.processing_stats import compute_processing_stats 
-from app.services.metrics_calculator import generate_metrics
+from app.services.metrics_calculator import GROUPBY_PERIODS, generate_metrics, metrics_from_aggregates
+from app.services.response_cache import metrics_cache, make_etag, http_date, is_not_modified
+from app.services.json_render import NegotiateJSONMiddleware, negotiated, render_json, compress
+from app.services import telemetry
 
-# 1. Define a PrettyJSONResponse that always indents with 4 spaces
+# 1. Define a PrettyJSONResponse that indents with 4 spaces unless compact output was negotiated
 class PrettyJSONResponse(Response):
     media_type = "application/json"
 
+    def __init__(self, content: Any, *args, **kwargs):
+        self.format, self.accepted_encoding = negotiated.get()
+        self.content_encoding = None
+        super().__init__(content, *args, **kwargs)
+        self.headers.update(encoding_headers(self.content_encoding))
+
     def render(self, content: Any) -> bytes:
-        # Convert Pydantic models, datetimes, etc. to JSON-serializable types
-        encoded = jsonable_encoder(content)
-        # Dump with indentation
-        pretty = json.dumps(encoded, indent=4, ensure_ascii=False)
-        return pretty.encode("utf-8")
+        # Pretty: jsonable_encoder + indented json.dumps; compact: fast serializer, maybe compressed
+        body, self.content_encoding = compress(render_json(content, self.format), self.accepted_encoding)
+        return body
+
+def encoding_headers(content_encoding: str | None) -> dict:
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if content_encoding:
+        headers["Content-Encoding"] = content_encoding
+    return headers
+
+# Cached metrics bodies go as soon as their file leaves storage
+file_storage.on_discard(metrics_cache.invalidate)
+file_storage.on_evict(lambda file_id, reason: telemetry.storage_evictions.labels(reason=reason).inc())
+
+# Storage and cache gauges are read when /metrics is scraped
+def collect_storage_metrics():
+    stats = file_storage.stats()
+    telemetry.storage_entries.set(stats["entries"])
+    telemetry.storage_bytes.set(stats["bytes"])
+    telemetry.response_cache_bytes.set(metrics_cache.stats()["bytes"])
+
+telemetry.on_collect(collect_storage_metrics)
+
+# Fail uploads a restart interrupted on startup; release pooled download connections on shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    fail_interrupted_jobs()
+    yield
+    await close_async_client()
+    upload_queue.shutdown(cleanup=close_async_client)
+    shutdown_process_pool()
+    telemetry.mark_process_dead()
 
 # 2. Create FastAPI app using our PrettyJSONResponse as the default
-app = FastAPI(default_response_class=PrettyJSONResponse)
+app = FastAPI(default_response_class=PrettyJSONResponse, lifespan=lifespan)
+app.add_middleware(NegotiateJSONMiddleware)
+app.add_middleware(telemetry.TelemetryMiddleware)
 
 templates = Jinja2Templates(directory="app/templates")
 
@@ -35,16 +79,96 @@ templates = Jinja2Templates(directory="app/templates")
 async def get_form(request: Request):
     return templates.TemplateResponse("form.html", {"request": request})
 
+# Prometheus scrape endpoint (all worker processes with PROMETHEUS_MULTIPROC_DIR)
+@app.get("/metrics", include_in_schema=False)
+async def get_telemetry():
+    return Response(telemetry.render(), media_type=telemetry.CONTENT_TYPE_LATEST)
+
 # Handle form submission
-@app.post("/upload")
-async def upload_csv_url(csv_url: str = Form(...)):
+@app.post("/upload", status_code=202)
+async def upload_csv_url(csv_url: str = Form(...), file_id: str | None = Form(None)):
+    if not csv_url.lower().startswith(("http://", "https://")):
+        raise HTTPException(status_code=400, detail="Invalid URL: only http(s) URLs are supported.")
+
+    # Append mode: only the rows the processed file does not hold yet are added to it
+    if file_id is not None:
+        entry = file_storage.get(file_id)
+        if entry is None:
+            if file_storage.is_expired(file_id):
+                raise HTTPException(status_code=410, detail="File ID has expired.")
+            raise HTTPException(status_code=404, detail="File ID does not exist.")
+        if entry.get("status", JOB_DONE) != JOB_DONE or entry.get("data") is None:
+            raise HTTPException(status_code=409, detail="File is not processed yet; only processed files can be appended to.")
+        try:
+            upload_queue.submit(partial(run_append_job, file_id, csv_url))
+        except QueueFullError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        return {"message": "File accepted for appending", "file_id": file_id, "status": "queued"}
+
+    # Register the file_id right away; download and cleaning run in the background
+    file_id = register_upload()
+    try:
+        upload_queue.submit(partial(run_upload_job, file_id, csv_url))
+    except QueueFullError as e:
+        file_storage.pop(file_id, None)
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"message": "File accepted for processing", "file_id": file_id, "status": "queued"}
+
+# Batch upload: one file_id per URL, processed in parallel across worker processes
+BATCH_MAX_FILES = 500
+
+@app.post("/upload/batch", status_code=202)
+async def upload_csv_batch(csv_url: list[str] = Form(...)):
+    if len(csv_url) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Too many files: at most {BATCH_MAX_FILES} per batch.")
+    for url in csv_url:
+        if not url.lower().startswith(("http://", "https://")):
+            raise HTTPException(status_code=400, detail=f"Invalid URL: only http(s) URLs are supported ({url}).")
+
+    batch_id, file_ids = register_batch(csv_url)
     try:
-        file_id, df_cleaned, summary = download_and_clean_csv(csv_url)
-        # file_storage is already populated by download_and_clean_csv()
-        return {"message": "File processed successfully", "file_id": file_id}
+        upload_queue.submit(partial(run_batch_job, batch_id))
+    except QueueFullError as e:
+        for file_id in file_ids:
+            file_storage.pop(file_id, None)
+        batch_storage.pop(batch_id, None)
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"message": "Batch accepted for processing", "batch_id": batch_id, "file_ids": file_ids, "status": "queued"}
+
+@app.get("/api/v1/order-items/batches/{batch_id}/processing-stats")
+async def get_batch_processing_stats(batch_id: str):
+    if len(batch_id) < 10:
+        raise HTTPException(status_code=400, detail="Invalid batch ID format.")
+    stats = batch_stats(batch_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Batch ID does not exist.")
+    return stats
+
+# Direct upload: the CSV is the request body (raw, or the "file" field of a multipart form)
+@app.post("/upload/file", status_code=201)
+async def upload_csv_file(request: Request):
+    content_type = request.headers.get("content-type", "")
+    file_id = register_upload()
+    try:
+        if content_type.lower().startswith("multipart/form-data"):
+            charset, body = await open_multipart_file(request.stream(), content_type)
+        else:
+            charset, body = charset_from_content_type(content_type), request.stream()
+        summary = await run_body_upload(file_id, body, charset)
     except ValueError as e:
+        file_storage.pop(file_id, None)
         raise HTTPException(status_code=400, detail=str(e))
 
+    return {
+        "message":     "File processed",
+        "file_id":     file_id,
+        "status":      JOB_DONE,
+        "uploaded_at": summary["uploaded_at"],
+        "durations":   summary["durations"],
+        "rows":        summary["rows"],
+        "outcome":     summary["outcome"],
+    }
+
 @app.get("/api/v1/order-items/uploads/{file_id}/processing-stats")
 async def get_processing_stats(file_id: str):
     # Validate ID format
@@ -53,44 +177,105 @@ async def get_processing_stats(file_id: str):
 
     entry = file_storage.get(file_id)
     if entry is None:
+        if file_storage.is_expired(file_id):
+            raise HTTPException(status_code=410, detail="File ID has expired.")
         raise HTTPException(status_code=404, detail="File ID does not exist.")
 
+    # Jobs that are still running (or failed) have no summary yet
+    status = entry.get("status", JOB_DONE)
+    if status != JOB_DONE:
+        response = {"status": status}
+        if status == JOB_FAILED:
+            response["error"] = entry.get("error")
+        return response
+
     # The full processing stats are now directly available in the stored summary
     # No need to call compute_processing_stats anymore
     stats = entry["summary"]
-    return {
+    response = {
+        "status":      status,
         "uploaded_at": stats["uploaded_at"],
         "durations":   stats["durations"],
         "rows":        stats["rows"],
         "outcome":     stats["outcome"],
     }
+    # Files appended to also report the latest append on its own
+    if "last_append" in stats:
+        response["appends"] = stats.get("appends", 0)
+        response["last_append"] = stats["last_append"]
+    return response
 
 
 @app.get("/api/v1/order-items/uploads/{file_id}/metrics")
-async def get_metrics(file_id: str, groupby: str = Query(...)):
+async def get_metrics(request: Request, file_id: str, groupby: str = Query(...),
+                      date_from: date | None = Query(None, alias="from"),
+                      date_to: date | None = Query(None, alias="to")):
     # Validate ID format
     if len(file_id) < 10:
         raise HTTPException(400, "Invalid file ID format.")
+    # Query parameters are checked before any conditional request can be answered with a 304
+    if groupby not in GROUPBY_PERIODS:
+        raise HTTPException(400, "Invalid groupby value")
+    if date_from is not None and date_to is not None and date_from > date_to:
+        raise HTTPException(400, "Invalid date range: 'from' is after 'to'.")
 
     entry = file_storage.get(file_id)
     if entry is None:
+        if file_storage.is_expired(file_id):
+            raise HTTPException(410, "File ID has expired.")
         raise HTTPException(404, "File ID does not exist.")
 
+    if entry.get("status") == JOB_FAILED:
+        raise HTTPException(400, f"File processing failed: {entry.get('error')}")
+
     df = entry["data"]
     if df is None:
         raise HTTPException(409, "File is still being processed.")
 
+    # Processed data is immutable per revision: serve cached bytes or a 304
+    cache_key = (file_id, entry.get("revision") or entry["summary"]["uploaded_at"], groupby, date_from, date_to,
+                 *negotiated.get())
+    # Vary as on the 200: the body depends on the negotiated format and encoding
+    headers = {
+        "ETag": make_etag(cache_key),
+        "Last-Modified": http_date(entry["summary"]["uploaded_at"]),
+        "Cache-Control": "no-cache",
+        **encoding_headers(None),
+    }
+    if is_not_modified(request.headers, headers["ETag"], headers["Last-Modified"]):
+        return Response(status_code=304, headers=headers)
+    cached = metrics_cache.get(cache_key)
+    telemetry.response_cache_lookups.labels(result="miss" if cached is None else "hit").inc()
+    if cached is not None:
+        body, content_encoding = cached
+        return Response(body, media_type=PrettyJSONResponse.media_type,
+                        headers={**headers, **encoding_headers(content_encoding)})
+
+    # Prefer the frame typed at ingest; it skips the per-request coercion
+    typed = entry.get("typed")
+    if typed is not None:
+        df = typed
+
     # Compute metrics (now returns start/end)
     try:
-        grand_totals, metrics_list, start_date, end_date = generate_metrics(df.copy(), groupby)
+        if entry.get("daily") is not None:
+            # Roll up the per-day aggregates built at upload; cost is independent of row count
+            # (and only the days from `from` to `to` are read)
+            grand_totals, metrics_list, start_date, end_date = metrics_from_aggregates(
+                entry["daily"], entry["daily_skus"], groupby, date_from, date_to
+            )
+        else:
+            grand_totals, metrics_list, start_date, end_date = generate_metrics(df, groupby, date_from, date_to)
     except ValueError as e:
         raise HTTPException(400, str(e))
 
-    return {
+    response = PrettyJSONResponse({
         "group_by":     groupby,
         "start_date":   start_date,
         "end_date":     end_date,
         "uploaded_at": entry["summary"]["uploaded_at"],
         "grand_totals": grand_totals,
         "metrics":      metrics_list
-    }
\ No newline at end of file
+    }, headers=headers)
+    metrics_cache.put(cache_key, response.body, response.content_encoding)
+    return response
\ No newline at end of file
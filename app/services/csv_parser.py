@@ -0,0 +1,322 @@
+import csv
+import io
+import itertools
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+
+# Parsing engine: "arrow" (bulk, native) or "python" (csv module, reference)
+CSV_PARSER_ENGINE = os.getenv("CSV_PARSER_ENGINE", "arrow")
+
+# Bytes handed to the arrow parser per block; must exceed the longest record
+ARROW_BLOCK_BYTES = int(os.getenv("CSV_ARROW_BLOCK_BYTES", str(4 << 20)))
+
+# Characters of a partition for parallel parsing (0 disables partitioning)
+CSV_PARTITION_BYTES = int(os.getenv("CSV_PARTITION_BYTES", str(32 << 20)))
+
+# Line terminators csv understands: "\r\n", "\n" or a lone "\r"
+_LINE_END = re.compile(r'\r\n?|\n')
+
+
+class ParseCounts:
+    """Row counters kept by the parsing engines while batches are produced."""
+
+    def __init__(self):
+        self.total = 0       # Every record after the header
+        self.blank = 0       # All fields empty/whitespace
+        self.structural = 0  # Wrong field count or unparseable
+
+
+class TextStream:
+    """
+    Iterates over the lines (terminators kept) of a stream of text chunks
+    without ever joining the whole stream, so csv.reader can consume it
+    lazily. `rest()` hands back whatever has not been read as raw chunks.
+    """
+
+    def __init__(self, text_chunks):
+        self._chunks = iter(text_chunks)
+        self._buffer = ''
+        self._pos = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        while True:
+            match = _LINE_END.search(self._buffer, self._pos)
+            # A "\r" ending the buffer may be the first half of a "\r\n" split across chunks
+            if match and not (match.end() == len(self._buffer) and match.group() == '\r'):
+                line = self._buffer[self._pos:match.end()]
+                self._pos = match.end()
+                return line
+            text = next(self._chunks, None)
+            if text is None:
+                if self._pos >= len(self._buffer):
+                    raise StopIteration
+                line = self._buffer[self._pos:]
+                self._buffer, self._pos = '', 0
+                return line
+            self._buffer = self._buffer[self._pos:] + text
+            self._pos = 0
+
+    def rest(self):
+        """Yields the unread text, the current buffer first, then the remaining chunks."""
+        buffered = self._buffer[self._pos:]
+        self._buffer, self._pos = '', 0
+        if buffered:
+            yield buffered
+        yield from self._chunks
+
+
+class _ByteStream(io.RawIOBase):
+    """Read-only file object over an iterator of byte chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        while not self._buffer:
+            self._buffer = next(self._chunks, None)
+            if self._buffer is None:
+                self._buffer = b''
+                return 0
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def _is_blank(fields) -> bool:
+    return not any(field.strip() for field in fields)
+
+
+def iter_python_batches(stream: TextStream, columns: list[str], delimiter: str, chunksize: int, counts: ParseCounts):
+    """
+    Reference engine: parses the records left in `stream` with csv.reader,
+    one row at a time, yielding DataFrames of up to `chunksize` rows that are
+    structurally correct and not blank.
+    """
+    reader = csv.reader(stream, delimiter=delimiter)
+    expected_cols = len(columns)
+    batch_rows = []
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            break
+        except csv.Error:
+            counts.total += 1
+            counts.structural += 1
+            continue
+        counts.total += 1
+
+        # Check for blank row first (all fields are empty/whitespace)
+        if _is_blank(row):
+            counts.blank += 1
+            continue
+
+        # Check for structural malformation (incorrect number of fields)
+        if len(row) != expected_cols:
+            counts.structural += 1
+            continue
+
+        batch_rows.append(row)
+        if len(batch_rows) >= chunksize:
+            yield pd.DataFrame(batch_rows, columns=columns)
+            batch_rows = []
+
+    if batch_rows:
+        yield pd.DataFrame(batch_rows, columns=columns)
+
+
+def iter_arrow_batches(stream: TextStream, columns: list[str], delimiter: str, chunksize: int,
+                       counts: ParseCounts):
+    """
+    Bulk engine: hands the records left in `stream` to pyarrow's native,
+    multithreaded CSV reader. Rows with the wrong field count go through the
+    invalid-row callback (classified blank or structural exactly like the
+    reference engine); blank rows of the right width are dropped with a
+    vectorized mask. Yields the rows of each parsed block in DataFrames of
+    at most `chunksize` rows.
+    """
+    def on_invalid_row(row) -> str:
+        counts.total += 1
+        # Rare path: re-parse the offending text to classify it like csv.reader would
+        try:
+            fields = next(csv.reader([row.text], delimiter=delimiter), [])
+        except csv.Error:
+            fields = ['?']
+        if _is_blank(fields):
+            counts.blank += 1
+        else:
+            counts.structural += 1
+        return 'skip'
+
+    chunks = (text for text in stream.rest() if text)
+    first = next(chunks, None)
+    if first is None:
+        return # Header only: pyarrow rejects empty input
+
+    source = io.BufferedReader(
+        _ByteStream(text.encode('utf-8') for text in itertools.chain([first], chunks)), ARROW_BLOCK_BYTES
+    )
+    try:
+        reader = pa_csv.open_csv(
+            source,
+            read_options=pa_csv.ReadOptions(column_names=columns, block_size=ARROW_BLOCK_BYTES),
+            parse_options=pa_csv.ParseOptions(
+                delimiter=delimiter,
+                newlines_in_values=True,
+                ignore_empty_lines=False,
+                invalid_row_handler=on_invalid_row,
+            ),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={name: pa.string() for name in columns},
+                strings_can_be_null=False,
+                quoted_strings_can_be_null=False,
+            ),
+        )
+        for batch in reader:
+            if not batch.num_rows:
+                continue
+            blank = None
+            for column in batch.columns:
+                empty = pc.equal(pc.utf8_length(pc.utf8_trim_whitespace(column)), 0)
+                blank = empty if blank is None else pc.and_(blank, empty)
+            n_blank = pc.sum(blank).as_py() or 0
+            counts.total += batch.num_rows
+            counts.blank += n_blank
+            if n_blank:
+                batch = batch.filter(pc.invert(blank))
+            # Zero-copy slices: only the conversion to pandas is done per chunk
+            for start in range(0, batch.num_rows, chunksize):
+                yield batch.slice(start, chunksize).to_pandas()
+    except pa.ArrowInvalid as e:
+        raise ValueError(f"Could not parse CSV: {e}")
+
+
+def iter_batches(stream: TextStream, columns: list[str], delimiter: str = ',', chunksize: int = 100_000,
+                 counts: ParseCounts | None = None, engine: str = CSV_PARSER_ENGINE):
+    """
+    Yields DataFrame batches of the structurally correct, non-blank records
+    left in `stream` (the header already consumed), updating `counts`.
+    """
+    counts = counts if counts is not None else ParseCounts()
+    if engine == "arrow" and columns:
+        return iter_arrow_batches(stream, columns, delimiter, chunksize, counts)
+    if engine in ("arrow", "python"):
+        return iter_python_batches(stream, columns, delimiter, chunksize, counts)
+    raise ValueError(f"Unknown CSV parser engine: {engine}")
+
+
+_QUOTE, _CR, _LF = ord('"'), ord('\r'), ord('\n')
+
+
+def _record_ends(data: np.ndarray, start: int, stop: int, odd: bool, delimiter: str) -> tuple[np.ndarray, bool] | None:
+    """
+    Offsets just past the line breaks at positions start..stop-1 of `data`
+    (a UTF-8 buffer starting at a record boundary) that end a record, and
+    whether the quote count up to `stop` is odd, given that it is `odd` up
+    to `start`. A line break is "\n", or a "\r" not followed by "\n" (so a
+    "\r" whose next byte is not in `data` yet is not one). It ends a record
+    unless preceded by an odd number of quotes, which only holds if quotes
+    are used as in RFC 4180: each quote opening a field follows a delimiter
+    or line break, each closing one precedes them (doubled quotes aside).
+    Returns None when some quote does not, as records then cannot be told
+    apart without fully parsing.
+    """
+    segment = data[start:stop]
+    following = data[start + 1:stop + 1]
+    breaks = segment == _LF
+    breaks[:len(following)] |= (segment[:len(following)] == _CR) & (following != _LF)
+    breaks = np.flatnonzero(breaks) + start
+    quotes = np.flatnonzero(segment == _QUOTE) + start
+    if not len(quotes):
+        return (breaks + 1, odd) if not odd else (np.empty(0, dtype=np.intp), odd)
+    if len(delimiter.encode()) != 1:
+        return None
+
+    edges = np.array([ord(delimiter), _CR, _LF, _QUOTE], dtype=np.uint8)
+    before = np.isin(data[np.maximum(quotes - 1, 0)], edges) | (quotes == 0)
+    after = np.isin(data[np.minimum(quotes + 1, len(data) - 1)], edges) | (quotes == len(data) - 1)
+    opening = (np.arange(len(quotes)) + odd) % 2 == 0
+    if not (np.all(before[opening]) and np.all(after[~opening])):
+        return None
+    # Line breaks preceded by an even number of quotes
+    outside = (np.searchsorted(quotes, breaks) + odd) % 2 == 0
+    return breaks[outside] + 1, bool((len(quotes) + odd) % 2)
+
+
+def find_record_boundary(block: bytes, delimiter: str = ',') -> int | None:
+    """
+    Offset just past the last line break of `block` that ends a record,
+    given that `block` starts at a record boundary; 0 if there is none.
+    None if quoting makes it impossible to tell (see _record_ends).
+    """
+    found = _record_ends(np.frombuffer(block, dtype=np.uint8), 0, len(block), False, delimiter)
+    if found is None:
+        return None
+    ends, _ = found
+    return int(ends[-1]) if len(ends) else 0
+
+
+class PartitionStream:
+    """
+    Regroups a stream of text chunks, starting at a record boundary, into
+    UTF-8 blocks of about `size` bytes (more for records longer than that)
+    that each end on a record boundary, so every block can be parsed on
+    its own. Each byte is scanned about once however the input is chunked.
+    If quoting makes a boundary impossible to place without parsing,
+    iteration stops early; `rest()` then hands back the remaining text,
+    to be parsed as one stream.
+    """
+
+    def __init__(self, text_chunks, size: int = CSV_PARTITION_BYTES, delimiter: str = ','):
+        self._chunks = iter(text_chunks)
+        self._size = size
+        self._delimiter = delimiter
+        self._buffer = bytearray()
+
+    def __iter__(self):
+        buffer, size = self._buffer, self._size
+        scanned, odd = 0, False  # Scan state of the block at the start of `buffer`
+        for text in self._chunks:
+            buffer += text.encode('utf-8')
+            while len(buffer) > size:
+                # The last record end within `size` bytes, else the first one after them, scanned
+                # `size` bytes at a time. The byte after a line break must be known ("\r\n").
+                stop = size if scanned < size else min(scanned + size, len(buffer) - 1)
+                if stop <= scanned:
+                    break
+                found = _record_ends(np.frombuffer(buffer, dtype=np.uint8), scanned, stop, odd, self._delimiter)
+                if found is None:
+                    return
+                ends, odd = found
+                scanned = stop
+                if not len(ends):
+                    continue
+                cut = int(ends[-1] if stop == size else ends[0])
+                yield bytes(buffer[:cut])
+                del buffer[:cut]
+                scanned, odd = 0, False
+        if buffer:
+            yield bytes(buffer)
+            buffer.clear()
+
+    def rest(self):
+        """Yields the text not handed out as blocks, the buffered records first."""
+        if self._buffer:
+            buffered = self._buffer.decode('utf-8')
+            self._buffer.clear()
+            yield buffered
+        yield from self._chunks
@@ -0,0 +1,164 @@
+import itertools
+import os
+import struct
+import zlib
+
+from app.services.timing import StageTimer
+
+# Optional: zstd-compressed input needs the zstandard package
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+_ZstdError = zstandard.ZstdError if zstandard is not None else zlib.error
+
+# Upper bound on the bytes one inflate step may produce, so a highly
+# compressed chunk is expanded a slice at a time rather than all at once
+DECOMPRESS_CHUNK_BYTES = int(os.getenv("CSV_DECOMPRESS_CHUNK_BYTES", str(4 << 20)))
+
+GZIP = "gzip"
+ZSTD = "zstd"
+ZIP = "zip"
+
+# Magic bytes at the start of each supported container
+_MAGIC = [(b"\x1f\x8b", GZIP), (b"\x28\xb5\x2f\xfd", ZSTD), (b"PK\x03\x04", ZIP)]
+_MAGIC_BYTES = max(len(magic) for magic, _ in _MAGIC)
+
+_ZIP_LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+_ZIP_STORED, _ZIP_DEFLATED = 0, 8
+_ZLIB_DECOMPRESS = type(zlib.decompressobj())
+
+
+def detect_compression(sample: bytes) -> str | None:
+    """The compression format a body starts with ("gzip", "zstd", "zip"), or None."""
+    for magic, compression in _MAGIC:
+        if sample.startswith(magic):
+            return compression
+    return None
+
+
+class Decompressor:
+    """
+    Iterates over a stream of byte chunks, decompressing it on the fly if it
+    is gzip (any number of members), zstd (any number of frames) or zip
+    (first file member, stored or deflated). The format is recognised from
+    the magic bytes; Content-Encoding is already undone by the HTTP clients
+    and file extensions are not trusted over the content. Uncompressed
+    input passes through untouched. Only one chunk of compressed and at
+    most DECOMPRESS_CHUNK_BYTES of decompressed data are held at a time.
+    `compression` is the detected format and `nbytes` the bytes produced.
+    """
+
+    def __init__(self, byte_chunks, timer: StageTimer | None = None):
+        self._chunks = iter(byte_chunks)
+        self._timer = timer or StageTimer()
+        self.compression = None
+        self.nbytes = 0
+
+    def __iter__(self):
+        head = b""
+        for chunk in self._chunks:
+            head += chunk
+            if len(head) >= _MAGIC_BYTES:
+                break
+        self.compression = detect_compression(head)
+        if self.compression is None:
+            source = self._rest
+        elif self.compression == ZIP:
+            source = self._unzip
+        else:
+            source = self._decompress_frames
+        for data in source(head):
+            if data:
+                self.nbytes += len(data)
+                yield data
+
+    def _rest(self, head: bytes):
+        if head:
+            yield head
+        yield from self._chunks
+
+    def _new_decoder(self):
+        if self.compression == GZIP:
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if zstandard is None:
+            raise ValueError("zstd-compressed input needs the zstandard package.")
+        return zstandard.ZstdDecompressor().decompressobj()
+
+    def _inflate(self, decoder, data: bytes):
+        """
+        Yields the output of feeding `data` to `decoder`. zlib output is
+        produced in slices of DECOMPRESS_CHUNK_BYTES; each step is timed as
+        "decompress", the consumer's time in between is not.
+        """
+        bounded = isinstance(decoder, _ZLIB_DECOMPRESS)
+        while data:
+            with self._timer.stage("decompress"):
+                try:
+                    if bounded:
+                        piece = decoder.decompress(data, DECOMPRESS_CHUNK_BYTES)
+                        data = decoder.unconsumed_tail
+                    else:
+                        piece, data = decoder.decompress(data), b""
+                except (zlib.error, _ZstdError) as e:
+                    raise ValueError(f"Could not decompress input: {e}")
+            yield piece
+
+    def _decompress_frames(self, head: bytes):
+        decoder = self._new_decoder()
+        for chunk in self._rest(head):
+            while chunk:
+                yield from self._inflate(decoder, chunk)
+                chunk = decoder.unused_data if decoder.eof else b""
+                if chunk:
+                    # Concatenated gzip members / zstd frames
+                    decoder = self._new_decoder()
+        if not decoder.eof:
+            raise ValueError("Compressed input is truncated.")
+
+    def _unzip(self, head: bytes):
+        chunks = self._rest(head)
+        buffer = b""
+
+        def fill(size: int, error: str) -> None:
+            nonlocal buffer
+            while len(buffer) < size:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    raise ValueError(error)
+                buffer += chunk
+
+        # Skip directory entries until the first file member
+        while True:
+            fill(_ZIP_LOCAL_HEADER.size, "Zip archive holds no file.")
+            (signature, _, flags, method, _, _, _, compressed_size, _,
+             name_length, extra_length) = _ZIP_LOCAL_HEADER.unpack_from(buffer)
+            if signature != b"PK\x03\x04":
+                raise ValueError("Zip archive holds no file.")
+            header_length = _ZIP_LOCAL_HEADER.size + name_length + extra_length
+            fill(header_length, "Zip archive is truncated.")
+            name = buffer[_ZIP_LOCAL_HEADER.size:_ZIP_LOCAL_HEADER.size + name_length]
+            buffer = buffer[header_length:]
+            if not name.endswith(b"/"):
+                break
+            buffer = buffer[compressed_size:]
+
+        member = itertools.chain([buffer], chunks)
+        if method == _ZIP_DEFLATED:
+            decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            for chunk in member:
+                yield from self._inflate(decoder, chunk)
+                if decoder.eof:
+                    return
+            raise ValueError("Zip archive is truncated.")
+        if method == _ZIP_STORED and not flags & 0x08:
+            remaining = compressed_size
+            if not remaining:
+                return
+            for chunk in member:
+                yield chunk[:remaining]
+                remaining -= min(len(chunk), remaining)
+                if not remaining:
+                    return
+            raise ValueError("Zip archive is truncated.")
+        raise ValueError(f"Unsupported zip compression method: {method}")
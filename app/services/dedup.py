@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+
+class DedupIndex:
+    """
+    Streaming duplicate detection on a row key of one or more columns.
+    Row batches are fed in order with `add()`, which flags every row whose
+    key appeared before (in an earlier batch or earlier in the same one),
+    so only first occurrences are kept, as with a set of seen keys.
+
+    Keys are held as 64-bit hashes in a sorted array, next to the position
+    of the row that first had each; lookups are vectorised binary searches.
+    A hash match is confirmed by comparing the keys themselves, read from
+    the batches already added (the index keeps references to their key
+    columns, which the caller keeps anyway), so a hash collision never
+    counts as a duplicate. The rare colliding keys go to a plain set.
+    """
+
+    def __init__(self, key_cols: list[str]):
+        self.key_cols = list(key_cols)
+        self.rows = 0  # Rows added so far
+        self.duplicated = 0
+        self._hashes = np.empty(0, dtype=np.uint64)  # Sorted
+        self._first_rows = np.empty(0, dtype=np.int64)  # Row of the first occurrence, per hash
+        self._offsets = []  # First row of each added batch
+        self._keys = []  # Key columns (object arrays) of each added batch
+        self._collided = set()  # Keys sharing a hash with an earlier, different key
+
+    def __len__(self) -> int:
+        """Distinct keys seen."""
+        return len(self._hashes) + len(self._collided)
+
+    def _hash(self, keys: list[np.ndarray]) -> np.ndarray:
+        if len(keys) == 1:
+            return pd.util.hash_array(keys[0], categorize=False)
+        return pd.util.hash_pandas_object(
+            pd.DataFrame(dict(enumerate(keys)), copy=False), index=False, categorize=False
+        ).to_numpy()
+
+    def _keys_equal(self, keys: list[np.ndarray], rows: np.ndarray, first_rows: np.ndarray) -> np.ndarray:
+        """Whether the keys at positions `rows` of this batch equal those at global `first_rows`."""
+        equal = np.ones(len(rows), dtype=bool)
+        batches = np.searchsorted(self._offsets, first_rows, side="right") - 1
+        for batch in np.unique(batches):
+            selected = batches == batch
+            at = first_rows[selected] - self._offsets[batch]
+            for stored, column in zip(self._keys[batch], keys):
+                equal[selected] &= stored[at] == column[rows[selected]]
+        return equal
+
+    def add(self, batch: pd.DataFrame) -> np.ndarray:
+        """Adds a batch of rows; returns its duplicate mask (True for rows whose key was seen before)."""
+        keys = [batch[col].to_numpy(dtype=object) for col in self.key_cols]
+        n = len(batch)
+        duplicate = np.zeros(n, dtype=bool)
+        self._offsets.append(self.rows)
+        self._keys.append(keys)
+        if not n:
+            return duplicate
+
+        hashes = self._hash(keys)
+        # Group equal hashes within the batch; the group's first row leads it
+        order = np.argsort(hashes)
+        sorted_hashes = hashes[order]
+        leads = np.ones(n, dtype=bool)
+        leads[1:] = sorted_hashes[1:] != sorted_hashes[:-1]
+        starts = np.flatnonzero(leads)
+        group_lead = np.repeat(np.minimum.reduceat(order, starts), np.diff(np.append(starts, n)))
+
+        # Hashes already indexed point at their first row; new ones at the group's first row here
+        positions = np.searchsorted(self._hashes, sorted_hashes)
+        found = positions < len(self._hashes)
+        found[found] = self._hashes[positions[found]] == sorted_hashes[found]
+        first_rows = self.rows + group_lead
+        first_rows[found] = self._first_rows[positions[found]]
+
+        candidates = found | (order != group_lead)
+        if candidates.any():
+            rows = order[candidates]
+            equal = self._keys_equal(keys, rows, first_rows[candidates])
+            duplicate[rows[equal]] = True
+            # Hash collisions: a different key behind an indexed hash
+            for row in np.sort(rows[~equal]):
+                key = tuple(column[row] for column in keys)
+                if key in self._collided:
+                    duplicate[row] = True
+                else:
+                    self._collided.add(key)
+
+        new = leads & ~found
+        if new.any():
+            self._hashes, self._first_rows = _merge(self._hashes, self._first_rows, positions[new],
+                                                    sorted_hashes[new], first_rows[new])
+        self.rows += n
+        self.duplicated += int(duplicate.sum())
+        return duplicate
+
+
+def _merge(hashes: np.ndarray, rows: np.ndarray, positions: np.ndarray, new_hashes: np.ndarray,
+           new_rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Inserts sorted `new_hashes` (and their rows) at their sorted `positions`, in one pass."""
+    size = len(hashes) + len(new_hashes)
+    at = positions + np.arange(len(new_hashes))
+    old = np.ones(size, dtype=bool)
+    old[at] = False
+    merged_hashes = np.empty(size, dtype=hashes.dtype)
+    merged_rows = np.empty(size, dtype=rows.dtype)
+    merged_hashes[at], merged_hashes[old] = new_hashes, hashes
+    merged_rows[at], merged_rows[old] = new_rows, rows
+    return merged_hashes, merged_rows
@@ -1,95 +1,203 @@
+import numpy as np
 import pandas as pd
 import requests
+import httpx
+import asyncio
+import os
 import uuid
 import csv
+import codecs
+import itertools
+import time
+import weakref
+from collections import deque
+from contextlib import closing
 from datetime import datetime
-from io import StringIO
+from functools import partial
+from typing import Callable
 import re # Added for regex in cleaning
 
-# In-memory storage for processed files
-file_storage = {}
+from app.services.csv_parser import (
+    CSV_PARSER_ENGINE, CSV_PARTITION_BYTES, ParseCounts, PartitionStream, TextStream, iter_batches,
+)
+from app.services.decompress import Decompressor
+from app.services.dedup import DedupIndex
+from app.services.metrics_calculator import (
+    append_typed_frame, build_daily_aggregates, build_typed_frame, merge_daily_aggregates, money_columns,
+)
+from app.services.jobs import WORKER_PROCESSES, get_process_pool, in_worker_process
+from app.services.storage import FILE_STORAGE_DIR, create_storage
+from app.services.telemetry import ingest_files, record_ingest
+from app.services.timing import StageTimer
 
-# --- New/Integrated Analysis Function (moved from previous iterations) ---
-def _perform_detailed_analysis(raw_text: str, delimiter: str = ',') -> tuple[dict, pd.DataFrame]:
+# Storage for processed files: in-memory by default (bounded by memory budget
+# and TTL), or shared across worker processes with FILE_STORAGE_BACKEND=disk
+file_storage = create_storage()
+# Batch records (the file_ids of each batch), kept by the same kind of backend
+batch_storage = create_storage(root=os.path.join(FILE_STORAGE_DIR, "batches"))
+
+# Upload job states, in order; "failed" can follow any non-final state
+JOB_QUEUED = "queued"
+JOB_DOWNLOADING = "downloading"
+JOB_PARSING = "parsing"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# Download settings (seconds / connection counts), overridable via environment
+DOWNLOAD_CONNECT_TIMEOUT = float(os.getenv("CSV_DOWNLOAD_CONNECT_TIMEOUT", "10"))
+DOWNLOAD_READ_TIMEOUT = float(os.getenv("CSV_DOWNLOAD_READ_TIMEOUT", "300"))
+DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("CSV_DOWNLOAD_MAX_CONNECTIONS", "20"))
+DOWNLOAD_MAX_KEEPALIVE = int(os.getenv("CSV_DOWNLOAD_MAX_KEEPALIVE", "10"))
+
+# One pooled AsyncClient per running event loop (clients cannot be shared across loops)
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client() -> httpx.AsyncClient:
     """
-    Performs detailed analysis on the raw text content of a CSV file.
-    Calculates total, blank, malformed (content), encoding errors, duplicates,
-    sanitised, valid, usable, accepted, and rejected rows.
-    Returns the summary dictionary and the cleaned DataFrame.
+    Returns the pooled httpx.AsyncClient for the running event loop,
+    creating it on first use.
     """
-    
-    # Initialize counters
-    total_data_lines_in_file = 0
-    blank_rows = 0
-    lines_with_structural_error = 0 # Lines that csv.reader completely failed on due to wrong field count or csv.Error
-    parsed_df_rows = [] # To store successfully parsed rows (structurally correct, not blank)
-    header = []
-
-    # Define columns for critical checks (for content malformed detection)
-    critical_numeric_cols = ['item_price', 'item_tax']
-    critical_text_cols = ['order_id', 'sku']
-    
-    # Split raw_text into lines, and identify header
-    lines = raw_text.splitlines()
-    if not lines:
-        return {
-            "rows": {
-                "total": 0, "blank": 0, "malformed": 0, "encoding_errors": 0,
-                "duplicated": 0, "sanitised": 0, "valid": 0, "usable": 0
-            },
-            "outcome": {"accepted": 0, "rejected": 0}
-        }, pd.DataFrame() # Return empty DataFrame if no lines
-
-    # Attempt to parse header from the first line
-    temp_header_reader = csv.reader([lines[0]], delimiter=delimiter)
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(DOWNLOAD_READ_TIMEOUT, connect=DOWNLOAD_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=DOWNLOAD_MAX_CONNECTIONS,
+                max_keepalive_connections=DOWNLOAD_MAX_KEEPALIVE,
+            ),
+            follow_redirects=True,
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def close_async_client() -> None:
+    """Closes the pooled client of the running event loop, if any."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+# Bytes requested from the HTTP response per read while streaming
+DOWNLOAD_CHUNK_BYTES = int(os.getenv("CSV_DOWNLOAD_CHUNK_BYTES", str(1 << 20)))
+
+# Bytes sampled from the start of the body to pick its encoding
+ENCODING_SAMPLE_BYTES = int(os.getenv("CSV_ENCODING_SAMPLE_BYTES", str(64 << 10)))
+
+# Byte order marks, longest first (the UTF-32 LE mark starts with the UTF-16 LE one)
+_BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32-le'), (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF8, 'utf-8'), (codecs.BOM_UTF16_LE, 'utf-16-le'), (codecs.BOM_UTF16_BE, 'utf-16-be'),
+]
+_CHARSET_PARAM = re.compile(r';\s*charset\s*=\s*"?([^";\s]+)', re.IGNORECASE)
+
+# Stages reported in the summary's durations, in pipeline order
+PIPELINE_STAGES = ["download", "decompress", "decode", "parse", "validate", "dedupe", "typing", "aggregate"]
+
+# Drop duplicate rows (by the dedupe key) from the stored data; they are counted either way
+DROP_DUPLICATES = os.getenv("CSV_DROP_DUPLICATES", "false").lower() in ("1", "true", "yes")
+
+# Define columns for critical checks (for content malformed detection)
+CRITICAL_NUMERIC_COLS = ['item_price', 'item_tax']
+CRITICAL_TEXT_COLS = ['order_id', 'sku']
+
+
+def _empty_summary(total: int = 0, malformed: int = 0) -> dict:
+    return {
+        "rows": {
+            "total": total, "blank": 0, "malformed": malformed, "encoding_errors": 0,
+            "duplicated": 0, "sanitised": 0, "valid": 0, "usable": 0
+        },
+        "outcome": {"accepted": 0, "rejected": malformed}
+    }
+
+
+def charset_from_content_type(content_type: str | None) -> str | None:
+    """The charset parameter of a Content-Type header, if any."""
+    match = _CHARSET_PARAM.search(content_type or '')
+    return match.group(1) if match else None
+
+
+def _decodes(sample: bytes, encoding: str, final: bool) -> bool:
     try:
-        header = next(temp_header_reader)
-        header = [h.strip() for h in header]
-    except (StopIteration, csv.Error):
-        # If header itself is malformed or file is only header
-        # Treat entire file as having structural errors or unreadable
-        # Return a simplified summary and empty DataFrame
-        return {
-            "rows": {
-                "total": len(lines) - 1 if len(lines) > 0 else 0,
-                "blank": 0, "malformed": (len(lines) -1) if len(lines) > 0 else 0, # All data lines malformed structurally
-                "encoding_errors": 0, "duplicated": 0, "sanitised": 0, "valid": 0, "usable": 0
-            },
-            "outcome": {"accepted": 0, "rejected": (len(lines) -1) if len(lines) > 0 else 0}
-        }, pd.DataFrame(columns=[f'Unnamed: {i}' for i in range(len(header))]) if header else pd.DataFrame()
-
-
-    expected_cols = len(header)
-    data_lines = lines[1:] # All lines after the header
-    total_data_lines_in_file = len(data_lines)
-
-    for line in data_lines:
-        row = []
-        try:
-            # Use csv.reader for each line to handle quoted fields correctly
-            single_line_reader = csv.reader([line], delimiter=delimiter)
-            row = next(single_line_reader)
-
-            # Check for blank row first (all fields are empty/whitespace)
-            if not any(field.strip() for field in row):
-                blank_rows += 1
-                continue 
-            
-            # Check for structural malformation (incorrect number of fields)
-            if len(row) != expected_cols:
-                lines_with_structural_error += 1
-                continue 
-            
-            # If not blank and structurally correct, add to rows for DataFrame
-            parsed_df_rows.append(row)
-            
-        except csv.Error:
-            lines_with_structural_error += 1
-            continue
-        except Exception: # Catch any other unexpected error during single line parsing
-            lines_with_structural_error += 1
-            continue
-            
+        codecs.getincrementaldecoder(encoding)(errors='strict').decode(sample, final)
+        return True
+    except (UnicodeDecodeError, LookupError):
+        return False
+
+
+def detect_encoding(sample: bytes, charset: str | None = None, final: bool = True) -> tuple[str, int]:
+    """
+    Picks the codec of a body from its first bytes, without decoding the
+    whole body: a BOM wins, then a declared `charset` that fits the sample,
+    then UTF-8 if the sample is valid UTF-8, then cp1252 (latin1 as the
+    last resort, since it accepts any byte). `final` is False when the
+    sample may end inside a character. Returns (codec, BOM length to skip).
+    """
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding, len(bom)
+    for encoding in (charset, 'utf-8', 'cp1252'):
+        if encoding and _decodes(sample, encoding, final):
+            return codecs.lookup(encoding).name, 0
+    return 'latin-1', 0
+
+
+class _StreamDecoder:
+    """
+    Incrementally decodes a byte stream with the codec detect_encoding()
+    picks from the first ENCODING_SAMPLE_BYTES (and the declared charset).
+    Bytes that still fail to decode later on become U+FFFD rather than
+    failing the upload; `replaced` counts them.
+    """
+
+    def __init__(self, charset: str | None = None, sample_bytes: int = ENCODING_SAMPLE_BYTES):
+        self.charset = charset
+        self.encoding = None
+        self.replaced = 0
+        self._sample_bytes = sample_bytes
+        self._sample = b''
+        self._decoder = None
+
+    def decode(self, chunk: bytes, final: bool = False) -> str:
+        if self._decoder is None:
+            self._sample += chunk
+            if len(self._sample) < self._sample_bytes and not final:
+                return ''
+            sample = self._sample[:self._sample_bytes]
+            self.encoding, bom_length = detect_encoding(sample, self.charset, final and len(sample) == len(self._sample))
+            self._decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+            chunk, self._sample = self._sample[bom_length:], b''
+        text = self._decoder.decode(chunk, final)
+        self.replaced += text.count('\ufffd')
+        return text
+
+
+def _count_replaced_rows(df: pd.DataFrame) -> int:
+    """Rows holding at least one U+FFFD, i.e. bytes that did not decode."""
+    replaced = np.zeros(len(df), dtype=bool)
+    for col in df.columns:
+        if df[col].dtype == object:
+            replaced |= df[col].str.contains('\ufffd', regex=False, na=False).to_numpy(dtype=bool)
+    return int(replaced.sum())
+
+
+def _iter_text(byte_chunks, decoder: _StreamDecoder, timer: StageTimer | None = None):
+    """Yields decoded text for each byte chunk."""
+    timer = timer or StageTimer()
+    for chunk in byte_chunks:
+        with timer.stage("decode"):
+            text = decoder.decode(chunk)
+        if text:
+            yield text
+    with timer.stage("decode"):
+        tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def _clean_header(header: list[str]) -> list[str]:
     # Clean header for Pandas: avoid empty names, ensure uniqueness
     cleaned_header = []
     seen_names = {}
@@ -107,61 +215,215 @@ def _perform_detailed_analysis(raw_text: str, delimiter: str = ',') -> tuple[dic
         else:
             seen_names[h] = 1
             cleaned_header.append(h)
-            
-    # Create DataFrame from structurally parsed and non-blank rows
-    df = pd.DataFrame(parsed_df_rows, columns=cleaned_header)
-    
-    # --- Calculate metrics based on df ---
-    
-    # sanitised: Rows that were successfully parsed and are not blank.
-    sanitised_rows = len(df) 
-    
-    # Duplicated Rows
-    duplicated_rows = 0
-    key_for_duplicates = 'order_item_id'
-    
-    if key_for_duplicates not in df.columns:
-        # print(f"Warning: '{key_for_duplicates}' not found. Using ['order_id', 'sku'] for duplicate check.")
-        key_for_duplicates = ['order_id', 'sku']
-        for col in key_for_duplicates:
-            if col not in df.columns:
-                # print(f"Error: Required column '{col}' for duplicate check not found. Cannot accurately count duplicates.")
-                duplicated_rows = 0 
-                break
+    return cleaned_header
+
+
+def _duplicate_key(columns: list[str]) -> list[str] | None:
+    """Columns identifying a row for duplicate detection, or None if unavailable."""
+    if 'order_item_id' in columns:
+        return ['order_item_id']
+    # print(f"Warning: 'order_item_id' not found. Using ['order_id', 'sku'] for duplicate check.")
+    if all(col in columns for col in ('order_id', 'sku')):
+        return ['order_id', 'sku']
+    return None
+
+
+# Valid critical text has at least one ASCII character that is not whitespace
+_ASCII_CONTENT = re.compile(r'[\x00-\x08\x0e-\x1b\x21-\x7f]')
+
+
+def _validate_content(df: pd.DataFrame, numeric_cols: list[str]) -> tuple[int, dict]:
+    """
+    Malformed (Content-based): Rows in the DataFrame with critical data issues AFTER cleaning.
+    Fused, copy-free check: each column in `numeric_cols` is parsed once with
+    pd.to_numeric; only values that fail go through the character cleaning
+    (keep digits and dots) to decide validity. Critical text columns need one
+    regex search each. Returns (malformed row count, {column: float64 values}),
+    the parsed values being reused as the typed columns for metrics.
+    """
+    good_content_mask = np.ones(len(df), dtype=bool)
+    numeric = {}
+
+    for col in numeric_cols:
+        values = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        numeric[col] = values
+        if col not in CRITICAL_NUMERIC_COLS:
+            continue
+        # Finite numbers pass; the rest are cleaned like "$1,234" -> "1234" before judging
+        failed = ~np.isfinite(values.to_numpy())
+        if failed.any():
+            cleaned = df[col][failed].astype(str).str.replace(r'[^\d.]', '', regex=True)
+            failed[failed] = pd.to_numeric(cleaned, errors='coerce').isna().to_numpy()
+        good_content_mask &= ~failed
+
+    for col in CRITICAL_TEXT_COLS:
+        if col in df.columns:
+            good_content_mask &= df[col].astype(str).str.contains(_ASCII_CONTENT).to_numpy(dtype=bool)
+
+    return int((~good_content_mask).sum()), numeric
+
+
+def _iter_validated_batches(stream: TextStream, columns: list[str], delimiter: str, chunksize: int,
+                            counts: ParseCounts, engine: str, numeric_cols: list[str], timer: StageTimer):
+    """Yields (batch, malformed row count, numeric columns) for each batch parsed from `stream`."""
+    batches_iter = iter_batches(stream, columns, delimiter, chunksize, counts, engine)
+    for batch in timer.iterate("parse", batches_iter):
+        with timer.stage("validate"):
+            malformed, numeric = _validate_content(batch, numeric_cols)
+        yield batch, malformed, numeric
+
+
+def _analyse_partition(block: bytes, columns: list[str], delimiter: str, chunksize: int, engine: str,
+                       numeric_cols: list[str]) -> tuple[ParseCounts, pd.DataFrame | None, int, dict]:
+    """
+    Parses and validates one partition (UTF-8 records, header excluded) in
+    a worker process. Returns (its row counts, its batches as one DataFrame
+    or None if it has no rows, malformed row count, numeric columns).
+    """
+    counts = ParseCounts()
+    batches = list(iter_batches(TextStream([block.decode('utf-8')]), columns, delimiter, chunksize, counts, engine))
+    if not batches:
+        return counts, None, 0, {}
+    df = pd.concat(batches, ignore_index=True) if len(batches) > 1 else batches[0]
+    malformed, numeric = _validate_content(df, numeric_cols)
+    return counts, df, malformed, numeric
+
+
+def _iter_partition_results(partitions, columns: list[str], delimiter: str, chunksize: int, counts: ParseCounts,
+                            engine: str, numeric_cols: list[str], timer: StageTimer):
+    """
+    Yields (batch, malformed row count, numeric columns) per partition, in
+    input order, like _iter_validated_batches. The partitions are parsed
+    and validated by the worker processes, two per worker in flight at
+    most, so memory stays bounded while reading overlaps with parsing.
+    The wait for the workers is timed as "parse".
+    """
+    pool = get_process_pool()
+    pending = deque()
+
+    def collect():
+        with timer.stage("parse"):
+            part_counts, batch, malformed, numeric = pending.popleft().result()
+        counts.total += part_counts.total
+        counts.blank += part_counts.blank
+        counts.structural += part_counts.structural
+        return batch, malformed, numeric
+
+    try:
+        for block in partitions:
+            pending.append(pool.submit(_analyse_partition, block, columns, delimiter, chunksize, engine,
+                                       numeric_cols))
+            while len(pending) >= 2 * WORKER_PROCESSES or (pending and pending[0].done()):
+                batch, malformed, numeric = collect()
+                if batch is not None:
+                    yield batch, malformed, numeric
+        while pending:
+            batch, malformed, numeric = collect()
+            if batch is not None:
+                yield batch, malformed, numeric
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _analyse_text(text_chunks, delimiter: str = ',', chunksize: int = 100_000, engine: str = CSV_PARSER_ENGINE,
+                  timer: StageTimer | None = None,
+                  dedup: DedupIndex | None = None) -> tuple[dict, pd.DataFrame, dict, np.ndarray]:
+    """
+    Streaming core of the detailed analysis. Consumes an iterable of text
+    chunks; the parsing `engine` turns records into DataFrame batches while
+    the blank/malformed/duplicate counters are kept as they arrive
+    (duplicates through a DedupIndex; pass `dedup` to also count keys it
+    already holds as duplicates). Time is recorded per stage (parse,
+    validate, dedupe) on `timer`.
+    Returns the summary dictionary, the cleaned DataFrame, the money
+    columns already parsed to float64 during validation and the mask of
+    the DataFrame's duplicate rows.
+    """
+    stream = TextStream(text_chunks)
+    timer = timer or StageTimer()
+
+    # Identify header from the first record
+    try:
+        with timer.stage("parse"):
+            header = next(csv.reader(stream, delimiter=delimiter))
+    except StopIteration:
+        return _empty_summary(), pd.DataFrame(), {}, np.zeros(0, dtype=bool) # Return empty DataFrame if no lines
+    except csv.Error:
+        # If header itself is malformed, treat every data line as a structural error
+        with timer.stage("parse"):
+            remaining = sum(1 for _ in stream)
+        return _empty_summary(total=remaining, malformed=remaining), pd.DataFrame(), {}, np.zeros(0, dtype=bool)
+    header = [h.strip() for h in header]
+    cleaned_header = _clean_header(header)
+
+    counts = ParseCounts()
+    malformed_content_rows = 0
+
+    key_cols = _duplicate_key(cleaned_header)
+    if dedup is None:
+        dedup = DedupIndex(key_cols) if key_cols else None
+    elif dedup.key_cols != key_cols:
+        raise ValueError(f"Duplicate key columns differ: expected {dedup.key_cols}, got {key_cols}.")
+    duplicated_before = dedup.duplicated if dedup is not None else 0
+    batches = []
+    duplicate_masks = []
+    # Parsed once here, for both validation and the typed frame
+    numeric_cols = list(dict.fromkeys(
+        [c for c in CRITICAL_NUMERIC_COLS if c in cleaned_header] + money_columns(cleaned_header)
+    ))
+    numeric_batches = {col: [] for col in numeric_cols}
+
+    # Large inputs are cut into partitions parsed and validated by the worker processes. Whatever
+    # cannot be cut (see PartitionStream) is streamed through the parser here, after them.
+    partitions = None
+    if CSV_PARTITION_BYTES > 0 and WORKER_PROCESSES > 1 and not in_worker_process():
+        splitter = PartitionStream(stream.rest(), CSV_PARTITION_BYTES, delimiter)
+        partitions = timer.iterate("parse", splitter)
+        first, second = next(partitions, None), next(partitions, None)
+        if second is None:
+            # A single partition, or none: parse it right here
+            stream = TextStream(itertools.chain([first.decode('utf-8')] if first else [], splitter.rest()))
+            partitions = None
         else:
-            duplicated_rows = df.duplicated(subset=key_for_duplicates, keep='first').sum()
+            partitions = itertools.chain([first, second], partitions)
+    if partitions is None:
+        results = _iter_validated_batches(stream, cleaned_header, delimiter, chunksize, counts, engine,
+                                          numeric_cols, timer)
     else:
-        duplicated_rows = df.duplicated(subset=key_for_duplicates, keep='first').sum()
-
-    # Malformed (Content-based): Rows in the DataFrame with critical data issues AFTER cleaning.
-    df_for_content_check = df.copy()
-
-    # Apply cleaning and type coercion for malformed content check
-    for col in critical_numeric_cols:
-        if col in df_for_content_check.columns:
-            df_for_content_check[col] = df_for_content_check[col].astype(str).str.replace('"', '', regex=False)
-            df_for_content_check[col] = df_for_content_check[col].str.replace(r'[\n\r]', '', regex=True)
-            df_for_content_check[col] = df_for_content_check[col].str.replace(r'[^\d.]', '', regex=True)
-            df_for_content_check[col] = pd.to_numeric(df_for_content_check[col], errors='coerce')
-        # else: print(f"Warning: Critical numeric column '{col}' not found for malformed content check.")
-
-    for col in critical_text_cols:
-        if col in df_for_content_check.columns:
-            df_for_content_check[col] = df_for_content_check[col].astype(str).str.replace(r'[^\x00-\x7F]+', '', regex=True).str.strip()
-        # else: print(f"Warning: Critical text column '{col}' not found for malformed content check.")
-    
-    good_content_mask = pd.Series(True, index=df_for_content_check.index)
-
-    if 'order_id' in df_for_content_check.columns:
-        good_content_mask &= (df_for_content_check['order_id'].notna()) & (df_for_content_check['order_id'] != '')
-    if 'sku' in df_for_content_check.columns:
-        good_content_mask &= (df_for_content_check['sku'].notna()) & (df_for_content_check['sku'] != '')
-    if 'item_price' in df_for_content_check.columns:
-        good_content_mask &= (df_for_content_check['item_price'].notna())
-    if 'item_tax' in df_for_content_check.columns:
-        good_content_mask &= (df_for_content_check['item_tax'].notna())
-
-    malformed_content_rows = (~good_content_mask).sum()
+        results = itertools.chain(
+            _iter_partition_results(partitions, cleaned_header, delimiter, chunksize, counts, engine,
+                                    numeric_cols, timer),
+            _iter_validated_batches(TextStream(splitter.rest()), cleaned_header, delimiter, chunksize, counts,
+                                    engine, numeric_cols, timer),
+        )
+
+    for batch, malformed, numeric in results:
+        malformed_content_rows += malformed
+        for col, values in numeric.items():
+            numeric_batches[col].append(values)
+        if dedup is not None:
+            with timer.stage("dedupe"):
+                # Only the first occurrence of a key is kept
+                duplicate_masks.append(dedup.add(batch))
+        batches.append(batch)
+
+    if batches:
+        with timer.stage("parse"):
+            df = pd.concat(batches, ignore_index=True) if len(batches) > 1 else batches[0]
+            numeric = {col: pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+                       for col, parts in numeric_batches.items()}
+    else:
+        df = pd.DataFrame(columns=cleaned_header)
+        numeric = {}
+    duplicates = np.concatenate(duplicate_masks) if duplicate_masks else np.zeros(len(df), dtype=bool)
+    duplicated_rows = dedup.duplicated - duplicated_before if dedup is not None else 0
+
+    total_data_lines_in_file = counts.total
+    blank_rows = counts.blank
+
+    # sanitised: Rows that were successfully parsed and are not blank.
+    sanitised_rows = len(df)
 
     valid_rows = sanitised_rows - malformed_content_rows
     usable_rows = max(0, valid_rows - duplicated_rows) 
@@ -175,7 +437,7 @@ def _perform_detailed_analysis(raw_text: str, delimiter: str = ',') -> tuple[dic
             "total": int(total_data_lines_in_file),
             "blank": int(blank_rows),
             "malformed": int(malformed_content_rows),
-            "encoding_errors": 0, # This function assumes raw_text is already decoded
+            "encoding_errors": 0, # Filled in by the caller, which owns decoding
             "duplicated": int(duplicated_rows),
             "sanitised": int(sanitised_rows),
             "valid": int(valid_rows),
@@ -186,77 +448,529 @@ def _perform_detailed_analysis(raw_text: str, delimiter: str = ',') -> tuple[dic
             "rejected": int(rejected_rows)
         }
     }
-    
+
     # Return the full DataFrame as well, as it's needed by metrics_calculator
-    return output_data, df 
+    return output_data, df, numeric, duplicates
 
 
-def download_and_clean_csv(url: str, chunksize: int = 100_000) -> tuple[str, pd.DataFrame, dict]:
+def _perform_detailed_analysis(raw_text: str, delimiter: str = ',', chunksize: int = 100_000,
+                               engine: str = CSV_PARSER_ENGINE) -> tuple[dict, pd.DataFrame]:
     """
-    Downloads CSV, and performs detailed analysis.
-    Returns (file_id, cleaned DataFrame, summary dict).
+    Performs detailed analysis on the raw text content of a CSV file.
+    Calculates total, blank, malformed (content), encoding errors, duplicates,
+    sanitised, valid, usable, accepted, and rejected rows.
+    Returns the summary dictionary and the cleaned DataFrame.
     """
+    summary, df, _, _ = _analyse_text([raw_text], delimiter, chunksize, engine)
+    return summary, df
 
-    download_start = datetime.utcnow()
-    try:
-        resp = requests.get(url)
-        resp.raise_for_status()
-    except Exception as e:
-        raise ValueError(f"Error downloading file: {e}")
-    download_end = datetime.utcnow()
-    download_secs = (download_end - download_start).total_seconds()
-
-    # Decode to string. Assuming utf-8 is preferred, handle errors.
-    raw_text = ""
-    encoding_errors_during_decode = 0
-    encodings_to_try = ['utf-8', 'latin1', 'ISO-8859-1', 'cp1252']
-    
-    file_decoded_successfully = False
-    for encoding in encodings_to_try:
-        try:
-            raw_text = resp.content.decode(encoding, errors='strict')
-            file_decoded_successfully = True
-            break
-        except UnicodeDecodeError:
-            encoding_errors_during_decode += 1
-            continue
-        except Exception: # Catch any other error during decoding
-            encoding_errors_during_decode += 1
-            continue
-            
-    if not file_decoded_successfully:
-        raise ValueError(f"Could not decode file with any of the attempted encodings. Total encoding errors encountered: {encoding_errors_during_decode}")
-    
-      # Now, use our detailed analysis function which processes raw_text
-    summary_data, df_cleaned = _perform_detailed_analysis(raw_text)
-    
-    # Add durations to the summary
-    summary_data["uploaded_at"] = datetime.utcnow().isoformat() + "Z"
 
-   # Note: `_perform_detailed_analysis` does not explicitly measure its own processing time.
-    # For now, processing_seconds is set to 0. You might want to wrap _perform_detailed_analysis
-    # with a timer if you need that metric.
-    processing_secs = 0 
-    summary_data["durations"] = {
-        "download_seconds": int(download_secs),
-        "processing_seconds": int(processing_secs), 
-        "total_seconds": int(download_secs + processing_secs),
+class _CountedChunks:
+    """Wraps a byte-chunk iterator, timing the waits for the source and counting bytes."""
+
+    def __init__(self, chunks, timer: StageTimer):
+        self._chunks = timer.iterate("download", chunks)
+        self.nbytes = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        chunk = next(self._chunks)
+        self.nbytes += len(chunk)
+        return chunk
+
+
+def _durations(timer: StageTimer, elapsed: float, nbytes: int, rows: int,
+               decompressor: Decompressor | None = None) -> dict:
+    """
+    The `durations` block of the summary. Download and parsing overlap, so
+    time spent waiting on the source counts as download and the rest of
+    the wall time as processing. `stages` breaks the time down per stage.
+    `compression` is the detected input compression (None if plain).
+    """
+    compression = decompressor.compression if decompressor else None
+    download_secs = timer.seconds.get("download", 0.0)
+    processing_secs = max(0.0, elapsed - download_secs)
+    return {
+        "download_seconds": round(download_secs, 6),
+        "processing_seconds": round(processing_secs, 6),
+        "total_seconds": round(elapsed, 6),
+        "stages": {stage: round(timer.seconds.get(stage, 0.0), 6) for stage in PIPELINE_STAGES},
+        "bytes_downloaded": nbytes,
+        "compression": compression,
+        "bytes_decompressed": decompressor.nbytes if compression else nbytes,
+        "rows_per_second": round(rows / elapsed, 1) if elapsed > 0 else None,
+        "peak_rss_growth_bytes": timer.peak_rss_growth_bytes,
         "formatted": {
             "download": str(pd.to_timedelta(download_secs, unit="s")),
             "processing": str(pd.to_timedelta(processing_secs, unit="s"))
         }
     }
-  
 
-     # Update summary with encoding errors from the download phase
-    summary_data["rows"]["encoding_errors"] = encoding_errors_during_decode
 
+def _process_stream(byte_chunks, chunksize: int = 100_000, charset: str | None = None,
+                    base: dict | None = None) -> dict:
+    """
+    Decompresses (gzip, zstd or zip, if so), decodes, parses and analyses
+    a stream of CSV byte chunks. The full body is never held in memory.
+    `charset` is the encoding declared by the source, if any. CPU-bound:
+    async callers run it in an executor (or a worker process).
+    With `base` (a stored entry), rows whose key it already holds count as
+    duplicates and only the other ones are typed, aggregated and merged
+    into it (see _merge_entry).
+    Returns the storage entry: the frames and the summary.
+    """
+    timer = StageTimer()
+    counted_chunks = _CountedChunks(byte_chunks, timer)
+    decompressor = Decompressor(counted_chunks, timer)
+    decoder = _StreamDecoder(charset)
 
-    # Store and return
-    file_id = str(uuid.uuid4())
-    file_storage[file_id] = {
+    started = time.perf_counter()
+    dedup = None
+    if base is not None:
+        with timer.stage("dedupe"):
+            dedup = _seeded_dedup(base["data"])
+    summary_data, df_cleaned, numeric, duplicates = _analyse_text(_iter_text(decompressor, decoder, timer),
+                                                                  chunksize=chunksize, timer=timer, dedup=dedup)
+    # Update summary with encoding errors from the decoding stage
+    # Only scanned for when the decoder actually had to replace bytes
+    with timer.stage("decode"):
+        summary_data["rows"]["encoding_errors"] = _count_replaced_rows(df_cleaned) if decoder.replaced else 0
+    # Optionally keep only the first occurrence of each key, so metrics count every item once;
+    # rows already stored are never appended again
+    if (DROP_DUPLICATES or base is not None) and duplicates.any():
+        with timer.stage("dedupe"):
+            df_cleaned = df_cleaned[~duplicates].reset_index(drop=True)
+            numeric = {col: values[~duplicates].reset_index(drop=True) for col, values in numeric.items()}
+    added = None
+    if base is not None:
+        with timer.stage("validate"):
+            added = _added_row_counts(df_cleaned, decoder.replaced)
+    # Typed columns for metrics (money columns reused from validation), so requests skip the string coercion
+    with timer.stage("typing"):
+        df_typed = build_typed_frame(df_cleaned, numeric)
+    # Per-day aggregates the month/year metrics are rolled up from
+    with timer.stage("aggregate"):
+        daily, daily_skus = build_daily_aggregates(df_typed)
+    entry = {
+        "status": JOB_DONE,
+        "revision": uuid.uuid4().hex, # Changes whenever the stored data does
         "data": df_cleaned,
-        "summary": summary_data # Use the fully calculated summary_data
+        "typed": df_typed,
+        "daily": daily,
+        "daily_skus": daily_skus,
+    }
+    if base is not None:
+        entry = _merge_entry(base, entry, timer)
+    elapsed = time.perf_counter() - started
+
+    # Add durations to the summary
+    summary_data["uploaded_at"] = datetime.utcnow().isoformat() + "Z"
+    summary_data["durations"] = _durations(timer, elapsed, counted_chunks.nbytes, summary_data["rows"]["total"],
+                                           decompressor)
+    entry["summary"] = summary_data if base is None else _merge_summaries(base["summary"], summary_data, added)
+    return entry
+
+
+def _added_row_counts(df: pd.DataFrame, replaced: bool) -> dict:
+    """
+    The `rows` and `outcome` counts of rows `df` appends to a stored file:
+    all were parsed and are new, so only content errors set some apart.
+    """
+    malformed, _ = _validate_content(df, [col for col in CRITICAL_NUMERIC_COLS if col in df.columns])
+    usable = len(df) - malformed
+    return {
+        "rows": {
+            "total": len(df), "blank": 0, "malformed": malformed,
+            "encoding_errors": _count_replaced_rows(df) if replaced else 0,
+            "duplicated": 0, "sanitised": len(df), "valid": usable, "usable": usable,
+        },
+        "outcome": {"accepted": usable, "rejected": malformed},
+    }
+
+
+def _seeded_dedup(df: pd.DataFrame) -> DedupIndex | None:
+    """A DedupIndex holding the keys of stored rows, or None if they have no dedupe key."""
+    key_cols = _duplicate_key(df.columns.tolist())
+    if key_cols is None:
+        return None
+    dedup = DedupIndex(key_cols)
+    dedup.add(df)
+    return dedup
+
+
+def _merge_entry(base: dict, delta: dict, timer: StageTimer) -> dict:
+    """
+    The storage entry of `base` extended with the rows of `delta` (same
+    columns): frames are concatenated and the per-day aggregates merged,
+    so nothing already stored is parsed, typed or aggregated again. Frames
+    `base` lacks are dropped; metrics then fall back to the raw frame.
+    """
+    if delta["data"].columns.tolist() != base["data"].columns.tolist():
+        raise ValueError("Appended file must have the same columns as the stored one.")
+    merged = dict(delta)
+    if not len(delta["data"]):
+        # Nothing new: the stored data (and its revision) stay as they are
+        return {**merged, **{key: base.get(key) for key in ("revision", "data", "typed", "daily", "daily_skus")}}
+    with timer.stage("typing"):
+        merged["data"] = pd.concat([base["data"], delta["data"]], ignore_index=True)
+        merged["typed"] = (append_typed_frame(base["typed"], delta["typed"])
+                           if base.get("typed") is not None else None)
+    with timer.stage("aggregate"):
+        merged["daily"], merged["daily_skus"] = None, None
+        if base.get("daily") is not None and delta["daily"] is not None:
+            merged["daily"], merged["daily_skus"] = merge_daily_aggregates(
+                base["daily"], base["daily_skus"], delta["daily"], delta["daily_skus"], offset=len(base["data"])
+            )
+    return merged
+
+
+def _merge_summaries(base: dict, delta: dict, added: dict) -> dict:
+    """
+    Summary of a stored file after an append. `rows` and `outcome` keep
+    describing the stored rows: those of `base` plus the `added` counts
+    (see _added_row_counts), so rows sent again are not counted twice.
+    `uploaded_at` and `durations` are the latest upload's, whose own counts
+    are kept in `last_append` with the number of rows it `added`. An upload
+    that added nothing leaves `uploaded_at` as it was, as the data it dates are.
+    """
+    rows_added = added["rows"]["total"]
+    return {
+        "rows": {key: base["rows"][key] + added["rows"][key] for key in base["rows"]},
+        "outcome": {key: base["outcome"][key] + added["outcome"][key] for key in base["outcome"]},
+        "uploaded_at": delta["uploaded_at"] if rows_added else base["uploaded_at"],
+        "durations": delta["durations"],
+        "appends": base.get("appends", 0) + 1,
+        "last_append": {
+            "status": JOB_DONE,
+            "uploaded_at": delta["uploaded_at"],
+            "rows": delta["rows"],
+            "outcome": delta["outcome"],
+            "added": rows_added,
+        },
+    }
+
+
+def _store_entry(file_id: str, entry: dict) -> None:
+    file_storage[file_id] = entry
+    record_ingest(entry["summary"])
+
+
+def _ingest_stream(byte_chunks, chunksize: int = 100_000, file_id: str | None = None,
+                   charset: str | None = None) -> tuple[str, pd.DataFrame, dict]:
+    """
+    Processes a stream of CSV byte chunks (see _process_stream) and stores
+    the result under `file_id` (a new id if None).
+    Returns (file_id, cleaned DataFrame, summary dict).
+    """
+    entry = _process_stream(byte_chunks, chunksize, charset)
+    file_id = file_id or str(uuid.uuid4())
+    _store_entry(file_id, entry)
+    return file_id, entry["data"], entry["summary"]
+
+
+def _append_stream(byte_chunks, file_id: str, chunksize: int = 100_000,
+                   charset: str | None = None) -> tuple[str, pd.DataFrame, dict]:
+    """
+    Appends the rows of a stream of CSV byte chunks that stored file
+    `file_id` does not hold yet (by the dedupe key), updating its frames,
+    aggregates and summary incrementally (see _process_stream).
+    Returns (file_id, cleaned DataFrame of all rows, summary dict).
+    """
+    # Appends to one file run one at a time (across processes, on a shared backend),
+    # each on top of the previous one
+    with file_storage.lock(file_id):
+        base = file_storage.get(file_id)
+        if base is None or base.get("status", JOB_DONE) != JOB_DONE or base.get("data") is None:
+            raise ValueError("File ID has no processed data to append to.")
+        entry = _process_stream(byte_chunks, chunksize, charset, base=base)
+        if entry["summary"]["last_append"]["added"]:
+            file_storage[file_id] = entry
+        else:
+            # The frames are unchanged: only rewrite the summary
+            file_storage.update_fields(file_id, summary=entry["summary"])
+    summary = entry["summary"]
+    record_ingest({"rows": summary["last_append"]["rows"], "durations": summary["durations"]})
+    return file_id, entry["data"], summary
+
+
+def _iter_response_chunks(resp: requests.Response):
+    """Yields the body of a streamed requests response, mapping read errors to ValueError."""
+    try:
+        yield from resp.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES)
+    except requests.RequestException as e:
+        raise ValueError(f"Error downloading file: {e}")
+
+
+async def _anext(aiterator):
+    return await aiterator.__anext__()
+
+
+def _iter_async_chunks(aiterator, loop: asyncio.AbstractEventLoop):
+    """
+    Pulls chunks of an async byte iterator from a worker thread, one at a
+    time, by scheduling each read on the event loop that owns the response.
+    """
+    while True:
+        try:
+            yield asyncio.run_coroutine_threadsafe(_anext(aiterator), loop).result()
+        except StopAsyncIteration:
+            return
+        except httpx.HTTPError as e:
+            raise ValueError(f"Error downloading file: {e}")
+
+
+def _open_download(url: str) -> requests.Response:
+    try:
+        resp = requests.get(url, stream=True, timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT))
+        resp.raise_for_status()
+    except Exception as e:
+        raise ValueError(f"Error downloading file: {e}")
+    return resp
+
+
+def process_url(url: str, chunksize: int = 100_000) -> dict:
+    """
+    Downloads and processes a CSV without storing it, returning the storage
+    entry. Self-contained and picklable, so it can run in a worker process.
+    """
+    with closing(_open_download(url)) as resp:
+        charset = charset_from_content_type(getattr(resp, "headers", {}).get("content-type"))
+        return _process_stream(_iter_response_chunks(resp), chunksize, charset=charset)
+
+
+def download_and_clean_csv(url: str, chunksize: int = 100_000) -> tuple[str, pd.DataFrame, dict]:
+    """
+    Downloads CSV, and performs detailed analysis.
+    The body is streamed and parsed in batches of `chunksize` rows.
+    Returns (file_id, cleaned DataFrame, summary dict).
+    """
+    entry = process_url(url, chunksize)
+    file_id = str(uuid.uuid4())
+    _store_entry(file_id, entry)
+    return file_id, entry["data"], entry["summary"]
+
+
+async def download_and_clean_csv_async(url: str, chunksize: int = 100_000,
+                                       client: httpx.AsyncClient | None = None,
+                                       file_id: str | None = None,
+                                       on_status: Callable[[str], None] | None = None,
+                                       append: bool = False) -> tuple[str, pd.DataFrame, dict]:
+    """
+    Non-blocking variant of download_and_clean_csv for use inside the event loop.
+    The download goes through the pooled AsyncClient and is streamed into
+    the parser, which runs in the default executor so other requests keep
+    being served. `on_status` is told when downloading and parsing start.
+    With `append`, the new rows are added to stored file `file_id` (see
+    _append_stream) instead of replacing it.
+    Returns (file_id, cleaned DataFrame, summary dict).
+    """
+    client = client or get_async_client()
+    loop = asyncio.get_running_loop()
+    on_status = on_status or (lambda status: None)
+
+    try:
+        on_status(JOB_DOWNLOADING)
+        async with client.stream("GET", url) as resp:
+            try:
+                resp.raise_for_status()
+            except Exception as e:
+                raise ValueError(f"Error downloading file: {e}")
+            # The rest of the body is parsed as it streams in
+            on_status(JOB_PARSING)
+            chunks = _iter_async_chunks(resp.aiter_bytes(DOWNLOAD_CHUNK_BYTES), loop)
+            charset = charset_from_content_type(resp.headers.get("content-type"))
+            if append:
+                ingest = partial(_append_stream, chunks, file_id, chunksize, charset)
+            else:
+                ingest = partial(_ingest_stream, chunks, chunksize, file_id, charset)
+            return await loop.run_in_executor(None, ingest)
+    except httpx.HTTPError as e:
+        raise ValueError(f"Error downloading file: {e}")
+
+
+def _set_job_status(file_id: str, status: str, error: str | None = None) -> None:
+    entry = dict(file_storage.get(file_id) or {"data": None, "summary": None})
+    entry["status"] = status
+    if error is not None:
+        entry["error"] = error
+    file_storage[file_id] = entry
+
+
+def fail_interrupted_jobs() -> int:
+    """
+    Marks uploads a previous run left queued, downloading or parsing as
+    failed: their jobs died with it, so they would otherwise never finish.
+    Only entries of processes that have all exited are looked at (see
+    StorageBackend.left_over_keys). Returns how many were marked.
+    """
+    interrupted = 0
+    for file_id in file_storage.left_over_keys():
+        fields = file_storage.fields(file_id)
+        if fields and fields.get("status") in (JOB_QUEUED, JOB_DOWNLOADING, JOB_PARSING):
+            interrupted += file_storage.update_fields(file_id, status=JOB_FAILED, error="Interrupted by restart.")
+    return interrupted
+
+
+def register_upload() -> str:
+    """Reserves a new file_id in the "queued" state and returns it."""
+    file_id = str(uuid.uuid4())
+    _set_job_status(file_id, JOB_QUEUED)
+    return file_id
+
+
+async def run_upload_job(file_id: str, url: str, chunksize: int = 100_000) -> None:
+    """
+    Background job body for a registered upload: downloads and cleans the
+    CSV, recording progress in the file's status. Failures are recorded as
+    "failed" with the error message rather than raised.
+    """
+    try:
+        await download_and_clean_csv_async(
+            url, chunksize, file_id=file_id,
+            on_status=partial(_set_job_status, file_id),
+        )
+    except Exception as e:
+        ingest_files.labels(status=JOB_FAILED).inc()
+        _set_job_status(file_id, JOB_FAILED, error=str(e))
+
+
+def _set_append_failed(file_id: str, error: str) -> None:
+    # The stored data stay as they were; only the summary tells of the failed append
+    with file_storage.lock(file_id):
+        entry = file_storage.get(file_id)
+        if entry is None or not entry.get("summary"):
+            return
+        summary = {**entry["summary"], "last_append": {
+            "status": JOB_FAILED, "uploaded_at": datetime.utcnow().isoformat() + "Z", "error": error,
+        }}
+        file_storage.update_fields(file_id, summary=summary)
+
+
+async def run_append_job(file_id: str, url: str, chunksize: int = 100_000) -> None:
+    """
+    Background job body for an append to processed file `file_id`: only
+    the downloaded rows it does not hold yet are added. The file keeps
+    serving its current data meanwhile; the outcome is recorded in its
+    summary's `last_append` (with the error if it failed).
+    """
+    try:
+        await download_and_clean_csv_async(url, chunksize, file_id=file_id, append=True)
+    except Exception as e:
+        ingest_files.labels(status=JOB_FAILED).inc()
+        _set_append_failed(file_id, str(e) or type(e).__name__)
+
+
+async def run_body_upload(file_id: str, body_chunks, charset: str | None = None,
+                          chunksize: int = 100_000) -> dict:
+    """
+    Ingests a CSV pushed by the client instead of downloaded, for a
+    registered upload: the async iterator of byte chunks (e.g. a request
+    body) is parsed as it arrives, in the default executor, with the same
+    pipeline as URL uploads. Returns the summary; failures are recorded as
+    "failed" and re-raised.
+    """
+    loop = asyncio.get_running_loop()
+    _set_job_status(file_id, JOB_PARSING)
+    try:
+        chunks = _iter_async_chunks(body_chunks.__aiter__(), loop)
+        _, _, summary = await loop.run_in_executor(None, partial(_ingest_stream, chunks, chunksize, file_id, charset))
+        return summary
+    except BaseException as e:
+        ingest_files.labels(status=JOB_FAILED).inc()
+        _set_job_status(file_id, JOB_FAILED, error=str(e) or type(e).__name__)
+        raise
+
+
+def register_batch(urls: list[str]) -> tuple[str, list[str]]:
+    """
+    Reserves a batch id and one "queued" file_id per URL.
+    Returns (batch_id, file_ids), file_ids in the order of `urls`.
+    """
+    batch_id = str(uuid.uuid4())
+    file_ids = [register_upload() for _ in urls]
+    batch_storage[batch_id] = {
+        "status": JOB_QUEUED,
+        "file_ids": file_ids,
+        "csv_urls": list(urls),
+        "created_at": datetime.utcnow().isoformat() + "Z",
     }
+    return batch_id, file_ids
+
 
-    return file_id, df_cleaned, summary_data,
\ No newline at end of file
+def _update_batch(batch_id: str, **fields) -> None:
+    batch = batch_storage.get(batch_id)
+    if batch is not None:
+        batch_storage[batch_id] = {**batch, **fields}
+
+
+async def run_batch_job(batch_id: str, chunksize: int = 100_000, executor=None) -> None:
+    """
+    Background job body for a registered batch: every file is downloaded
+    and processed concurrently in `executor` (the shared process pool by
+    default), so parsing uses one core per file up to the pool size. Each
+    result is stored under its file_id as soon as it is ready; failures
+    are recorded per file.
+    """
+    batch = batch_storage.get(batch_id)
+    loop = asyncio.get_running_loop()
+    executor = executor or get_process_pool()
+    started = time.perf_counter()
+    _update_batch(batch_id, status=JOB_PARSING)
+
+    async def ingest(file_id: str, url: str) -> None:
+        # Download and parsing overlap inside the worker
+        _set_job_status(file_id, JOB_DOWNLOADING)
+        try:
+            entry = await loop.run_in_executor(executor, partial(process_url, url, chunksize))
+            _store_entry(file_id, entry)
+        except Exception as e:
+            ingest_files.labels(status=JOB_FAILED).inc()
+            _set_job_status(file_id, JOB_FAILED, error=str(e) or type(e).__name__)
+
+    await asyncio.gather(*(ingest(file_id, url) for file_id, url in zip(batch["file_ids"], batch["csv_urls"])))
+    _update_batch(batch_id, status=JOB_DONE, total_seconds=round(time.perf_counter() - started, 6))
+
+
+def batch_stats(batch_id: str) -> dict | None:
+    """
+    Processing stats of a batch: each file's status and the rows/outcome
+    counts summed over the files processed so far. None if unknown.
+    """
+    batch = batch_storage.get(batch_id)
+    if batch is None:
+        return None
+    files = []
+    rows, outcome = {}, {}
+    processing_seconds = 0.0
+    for file_id, url in zip(batch["file_ids"], batch["csv_urls"]):
+        entry = file_storage.get(file_id) or {"status": "expired" if file_storage.is_expired(file_id) else "missing"}
+        item = {"file_id": file_id, "csv_url": url, "status": entry.get("status", JOB_DONE)}
+        if entry.get("error"):
+            item["error"] = entry["error"]
+        summary = entry.get("summary")
+        if item["status"] == JOB_DONE and summary:
+            for key, value in summary["rows"].items():
+                rows[key] = rows.get(key, 0) + value
+            for key, value in summary["outcome"].items():
+                outcome[key] = outcome.get(key, 0) + value
+            processing_seconds += summary["durations"]["total_seconds"]
+        files.append(item)
+
+    total_seconds = batch.get("total_seconds")
+    return {
+        "batch_id": batch_id,
+        "status": batch["status"],
+        "created_at": batch["created_at"],
+        "files": files,
+        "durations": {
+            "total_seconds": total_seconds,
+            # Summed per-file time over wall time: how many files were processed at once on average
+            "files_total_seconds": round(processing_seconds, 6),
+            "parallelism": round(processing_seconds / total_seconds, 2) if total_seconds else None,
+            "rows_per_second": round(rows.get("total", 0) / total_seconds, 1) if total_seconds else None,
+        },
+        "rows": rows,
+        "outcome": outcome,
+    }
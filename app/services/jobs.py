@@ -0,0 +1,130 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Awaitable, Callable
+
+# Upload concurrency, overridable via environment
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", "100"))
+# Worker processes for batch uploads and partitioned parsing (0: one per CPU)
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0")) or os.cpu_count() or 1
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class JobQueue:
+    """
+    Bounded background queue for upload jobs.
+    Jobs are coroutines run on a dedicated event loop thread, at most
+    `max_workers` at a time; at most `max_queued` more may wait for a slot.
+    """
+
+    def __init__(self, max_workers: int = UPLOAD_WORKERS, max_queued: int = UPLOAD_QUEUE_SIZE):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0  # queued + running
+        self._loop = None
+        self._thread = None
+        self._slots = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._slots = asyncio.Semaphore(self.max_workers)
+                self._thread = threading.Thread(target=self._loop.run_forever, name="upload-jobs", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def submit(self, job: Callable[[], Awaitable]) -> Future:
+        """
+        Schedules `job()` on the queue's loop and returns its future.
+        Raises QueueFullError if max_workers + max_queued jobs are pending.
+        """
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queued:
+                raise QueueFullError("Upload queue is full, retry later.")
+            self._pending += 1
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._run(job), loop)
+
+    async def _run(self, job: Callable[[], Awaitable]):
+        try:
+            async with self._slots:
+                return await job()
+        finally:
+            with self._idle:
+                self._pending -= 1
+                self._idle.notify_all()
+
+    def drain(self, timeout: float | None = None) -> bool:
+        """Blocks until no job is pending. Returns False on timeout."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def shutdown(self, cleanup: Callable[[], Awaitable] | None = None, timeout: float | None = 5) -> None:
+        """Runs `cleanup()` on the queue's loop, then stops the loop thread."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = self._slots = None
+        if loop is None:
+            return
+        if cleanup is not None:
+            asyncio.run_coroutine_threadsafe(cleanup(), loop).result(timeout)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        loop.close()
+
+
+# Shared queue used by the upload endpoints
+upload_queue = JobQueue()
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+# Set in the pool's worker processes only (not in other children, e.g. server workers)
+_in_pool_worker = False
+
+
+def _mark_pool_worker() -> None:
+    global _in_pool_worker
+    _in_pool_worker = True
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    The shared pool of worker processes for CPU-bound ingestion, started on
+    first use. Workers are spawned (not forked) as the parent runs threads.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=WORKER_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_mark_pool_worker,
+            )
+        return _process_pool
+
+
+def in_worker_process() -> bool:
+    """True inside a worker process of the pool (which must not start a pool of its own)."""
+    return _in_pool_worker
+
+
+def shutdown_process_pool() -> None:
+    """Stops the worker processes, if they were started."""
+    global _process_pool
+    with _process_pool_lock:
+        pool, _process_pool = _process_pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
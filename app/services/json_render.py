@@ -0,0 +1,110 @@
+import gzip
+import json
+import os
+from contextvars import ContextVar
+
+from fastapi.encoders import jsonable_encoder
+from starlette.requests import HTTPConnection
+
+# Optional fast paths: orjson for serialization, brotli for compression
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised only without orjson
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+FORMAT_PRETTY = "pretty"
+FORMAT_COMPACT = "compact"
+
+# Compact bodies smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.getenv("JSON_COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+
+# (format, content encoding) negotiated for the request being served
+negotiated = ContextVar("negotiated", default=(FORMAT_PRETTY, None))
+
+
+def negotiate(query_params, headers) -> tuple[str, str | None]:
+    """
+    Picks the JSON rendering for a request. Pretty is the default; compact is
+    chosen by `?format=compact` or `Accept: application/json; format=compact`
+    (the query parameter wins). Compact responses are compressed with brotli
+    or gzip when the client's Accept-Encoding allows it.
+    """
+    fmt = query_params.get("format")
+    if fmt not in (FORMAT_PRETTY, FORMAT_COMPACT):
+        fmt = FORMAT_COMPACT if _accepts_compact(headers.get("accept", "")) else FORMAT_PRETTY
+    encoding = _pick_encoding(headers.get("accept-encoding", "")) if fmt == FORMAT_COMPACT else None
+    return fmt, encoding
+
+
+def _accepts_compact(accept: str) -> bool:
+    for media_range in accept.split(","):
+        media_type, *params = [part.strip().lower() for part in media_range.split(";")]
+        if media_type == "application/json" and "format=compact" in [p.replace(" ", "") for p in params]:
+            return True
+    return False
+
+
+def _pick_encoding(accept_encoding: str) -> str | None:
+    accepted = set()
+    for item in accept_encoding.split(","):
+        coding, *params = [part.strip().lower() for part in item.split(";")]
+        if any(p.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000") for p in params):
+            continue
+        accepted.add(coding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def render_json(content, fmt: str = FORMAT_PRETTY) -> bytes:
+    """
+    Serializes a response payload. Pretty: jsonable_encoder, then json.dumps
+    with 4-space indents. Compact: the payload is serialized directly
+    (orjson if installed) and only goes through jsonable_encoder if it holds
+    non-primitive values.
+    """
+    if fmt != FORMAT_COMPACT:
+        return json.dumps(jsonable_encoder(content), indent=4, ensure_ascii=False).encode("utf-8")
+    try:
+        return _dumps_compact(content)
+    except TypeError:
+        return _dumps_compact(jsonable_encoder(content))
+
+
+def _dumps_compact(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def compress(body: bytes, encoding: str | None) -> tuple[bytes, str | None]:
+    """Compresses `body` with `encoding`; small bodies are returned as-is."""
+    if encoding is None or len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    if encoding == "br":
+        return brotli.compress(body), "br"
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), "gzip"
+
+
+class NegotiateJSONMiddleware:
+    """ASGI middleware recording each request's negotiated JSON rendering in `negotiated`."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        connection = HTTPConnection(scope)
+        token = negotiated.set(negotiate(connection.query_params, connection.headers))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            negotiated.reset(token)
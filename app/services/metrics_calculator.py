@@ -1,7 +1,19 @@
+import numpy as np
 import pandas as pd
 import unicodedata
 import re
-from collections import Counter
+from datetime import date
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype, union_categoricals
+
+# Column-name keywords summed into gross sales, tax and discount
+MONEY_KEYWORDS = ("price", "tax", "discount")
+CATEGORICAL_COLUMNS = ("sku", "order_id")
+# Summed columns of the per-period and per-day tables
+AGGREGATE_SUMS = ["total_orders", "gross_sales", "net_sales", "grand_total"]
+# Columns of a (keys..., sku) count table, after its key columns
+SKU_TABLE_COLUMNS = ["sku", "count", "first_pos"]
+# Periods metrics can be grouped by
+GROUPBY_PERIODS = ("month", "year")
 
 def sanitize_columns(columns):
     def clean(name):
@@ -13,92 +25,257 @@ def sanitize_columns(columns):
         return text.strip("_").lower()
     return [clean(col) for col in columns]
 
-def generate_metrics(df: pd.DataFrame, groupby: str):
-    # 1) Sanitize headers
-    df.columns = sanitize_columns(df.columns.tolist())
+def money_columns(columns: list[str]) -> list[str]:
+    """Columns summed into gross sales, tax or discount (matched on sanitized names)."""
+    return [col for name, col in zip(sanitize_columns(columns), columns)
+            if any(keyword in name for keyword in MONEY_KEYWORDS)]
+
+def build_typed_frame(df: pd.DataFrame, numeric: dict | None = None) -> pd.DataFrame:
+    """
+    Typed copy of the columns generate_metrics needs, built once at ingest:
+    float64 money columns, datetime64 purchased_date and categorical
+    sku/order_id (categories in order of first appearance). `numeric` may
+    hold money columns already parsed (to_numeric, coerce) by the caller.
+    """
+    numeric = numeric or {}
+    typed = {}
+    for name, col in zip(sanitize_columns(df.columns.tolist()), df.columns):
+        if any(keyword in name for keyword in MONEY_KEYWORDS):
+            values = numeric.get(col)
+            if values is None:
+                values = pd.to_numeric(df[col], errors="coerce").astype("float64")
+            typed[name] = values
+        elif name == "purchased_date":
+            typed[name] = pd.to_datetime(df[col], errors="coerce")
+        elif name in CATEGORICAL_COLUMNS:
+            typed[name] = pd.Categorical(df[col], categories=pd.unique(df[col]))
+    return pd.DataFrame(typed, index=df.index)
+
+def _count_skus(keys: pd.DataFrame, sku: pd.Series) -> pd.DataFrame:
+    """
+    Single grouped pass over the rows: occurrences per (keys..., sku) and the
+    position of the first such row, which the popularity tie rules need.
+    Works for both object and categorical (typed) sku columns.
+    """
+    table = keys.assign(sku=sku.astype(object).to_numpy(), pos=range(len(keys))).dropna(subset=["sku"])
+    return table.groupby(list(keys.columns) + ["sku"], sort=False).agg(
+        count=("pos", "size"), first_pos=("pos", "min")
+    ).reset_index()
+
+def _empty_sku_table(keys: list[str]) -> pd.DataFrame:
+    return pd.DataFrame({name: pd.Series(dtype=object) for name in keys + SKU_TABLE_COLUMNS})
+
+def _roll_up_skus(sku_table: pd.DataFrame, by: list[str]) -> pd.DataFrame:
+    return sku_table.groupby(by + ["sku"], sort=False).agg(
+        count=("count", "sum"), first_pos=("first_pos", "min")
+    ).reset_index()
+
+def _grand_popular_skus(sku_table: pd.DataFrame):
+    """
+    (most, least) popular SKU overall. Most is the smallest label among the
+    most frequent (as Series.mode() picks); least ties go to the first to appear.
+    """
+    totals = _roll_up_skus(sku_table, [])
+    if not len(totals):
+        return None, None
+    most = min(totals["sku"][totals["count"] == totals["count"].max()])
+    least = totals.sort_values(["count", "first_pos"])["sku"].iloc[0]
+    return most, least
+
+def _period_popular_skus(sku_table: pd.DataFrame):
+    """(most, least) popular SKU per period; ties go to the first to appear."""
+    totals = _roll_up_skus(sku_table, ["period"])
+    most = totals.sort_values(["period", "count", "first_pos"], ascending=[True, False, True])
+    least = totals.sort_values(["period", "count", "first_pos"])
+    return (most.drop_duplicates("period").set_index("period")["sku"],
+            least.drop_duplicates("period").set_index("period")["sku"])
+
+def _money_total(df: pd.DataFrame, positions: list[int], valid: np.ndarray) -> np.ndarray:
+    # Row sums of the given columns over the dated rows, non-numeric values as 0
+    total = np.zeros(int(valid.sum()))
+    for pos in positions:
+        col = df.iloc[:, pos]
+        if not is_numeric_dtype(col):
+            col = pd.to_numeric(col, errors="coerce")
+        total += np.nan_to_num(col.to_numpy(dtype="float64")[valid], nan=0.0)
+    return total
+
+def _sales_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Steps shared by generate_metrics and the aggregate cube: a new, narrow
+    frame of the dated rows with order_date, sales totals and sku. `df` is
+    only read (never copied or mutated), and only the columns needed.
+    """
+    # 1) Sanitize headers (matched by position, the frame keeps its own names)
+    names = sanitize_columns(df.columns.tolist())
 
     # 2) Parse date
-    if "purchased_date" not in df.columns:
+    if "purchased_date" not in names:
         raise ValueError("Missing required column 'purchased_date'")
-    df["order_date"] = pd.to_datetime(df["purchased_date"], errors="coerce")
-    df = df.dropna(subset=["order_date"])
+    dates = df.iloc[:, names.index("purchased_date")]
+    if not is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, errors="coerce")
+    valid = dates.notna().to_numpy()
 
     # 3) Compute sales columns
-    # Identify columns
-    price_cols    = [c for c in df.columns if "price" in c]
-    tax_cols      = [c for c in df.columns if "tax" in c]
-    discount_cols = [c for c in df.columns if "discount" in c]
-
-    # Coerce numeric
-    df[price_cols]    = df[price_cols].apply(pd.to_numeric, errors="coerce").fillna(0.0)
-    df[tax_cols]      = df[tax_cols].apply(pd.to_numeric, errors="coerce").fillna(0.0)
-    df[discount_cols] = df[discount_cols].apply(pd.to_numeric, errors="coerce").fillna(0.0)
-
-    # Calculate
-    df["gross_sales"]   = df[price_cols].sum(axis=1)
-    df["tax_total"]     = df[tax_cols].sum(axis=1)
-    df["discount_total"]= df[discount_cols].sum(axis=1)
-    df["net_sales"]     = df["gross_sales"] + df["tax_total"]
-    df["grand_total"]   = df["net_sales"] - df["discount_total"]
+    gross = _money_total(df, [i for i, c in enumerate(names) if "price" in c], valid)
+    tax = _money_total(df, [i for i, c in enumerate(names) if "tax" in c], valid)
+    discount = _money_total(df, [i for i, c in enumerate(names) if "discount" in c], valid)
+    net = gross + tax
+
+    sales = {
+        "order_date":  dates[valid],
+        "gross_sales": gross,
+        "net_sales":   net,
+        "grand_total": net - discount,
+    }
+    if "sku" in names:
+        sales["sku"] = df.iloc[:, names.index("sku")][valid]
+    return pd.DataFrame(sales, index=dates.index[valid])
+
+def generate_metrics(df: pd.DataFrame, groupby: str, start: date | None = None, end: date | None = None):
+    df = _sales_frame(df)
+    # Optional date range, both ends included (a full scan; the aggregates path binary-searches)
+    if start is not None or end is not None:
+        days = df["order_date"].dt.normalize()
+        in_range = np.ones(len(df), dtype=bool)
+        if start is not None:
+            in_range &= (days >= pd.Timestamp(start)).to_numpy()
+        if end is not None:
+            in_range &= (days <= pd.Timestamp(end)).to_numpy()
+        df = df[in_range]
 
     # 4) Grouping key
+    period = _period_key(df["order_date"], groupby)
+
+    # 5) Per-period sums and one (period, sku) count pass
+    grp = df.groupby(period.rename("period"), sort=True)
+    per_period = grp[AGGREGATE_SUMS[1:]].sum()
+    per_period.insert(0, "total_orders", grp.size())
+    keys = period.rename("period").to_frame()
+    sku_table = _count_skus(keys, df["sku"]) if "sku" in df.columns else _empty_sku_table(["period"])
+
+    # 6) Grand totals and per-period metrics
+    grand_sums = df[AGGREGATE_SUMS[1:]].sum()
+    grand_sums["total_orders"] = len(df)
+    grand_totals, metrics = _metrics_response(grand_sums, per_period, sku_table)
+
+    start_date = df["order_date"].min().date().isoformat() if len(df) else None
+    end_date   = df["order_date"].max().date().isoformat() if len(df) else None
+    return grand_totals, metrics, start_date, end_date
+
+def _period_key(dates: pd.Series, groupby: str) -> pd.Series:
     if groupby == "month":
-        df["period"] = df["order_date"].dt.to_period("M").astype(str)
-    elif groupby == "year":
-        df["period"] = df["order_date"].dt.to_period("Y").astype(str)
-    else:
-        raise ValueError("Invalid groupby value")
+        return dates.dt.to_period("M").astype(str)
+    if groupby == "year":
+        return dates.dt.to_period("Y").astype(str)
+    raise ValueError("Invalid groupby value")
 
-    # 5) Grand totals
+def _metrics_response(grand_sums: pd.Series, per_period: pd.DataFrame, sku_table: pd.DataFrame):
+    """
+    Builds grand_totals and the per-period list from summed columns and a
+    (period, sku, count, first_pos) table, without iterating over rows.
+    """
+    most, least = _grand_popular_skus(sku_table)
     grand_totals = {
-        #"total_orders":         int(len(df)),
-         "total_orders": int(df.shape[0]),
-        "gross_sales":          float(df["gross_sales"].sum()),
-        "net_sales":            float(df["net_sales"].sum()),
-        "grand_total":          float(df["grand_total"].sum()),
-       # "most_popular_product_sku": df["sku"].mode().iloc[0] if "sku" in df.columns else None,
-       # "least_popular_product_sku": df["sku"].value_counts().idxmin() if "sku" in df.columns else None
-      "most_popular_product_sku": (
-       df["sku"].mode().iloc[0] if "sku" in df.columns and not df["sku"].mode().empty else None),
-        "least_popular_product_sku": (
-            df["sku"].value_counts().idxmin() if "sku" in df.columns and not df["sku"].value_counts().empty else None
-        )
-
+        "total_orders":         int(grand_sums["total_orders"]),
+        "gross_sales":          float(grand_sums["gross_sales"]),
+        "net_sales":            float(grand_sums["net_sales"]),
+        "grand_total":          float(grand_sums["grand_total"]),
+        "most_popular_product_sku": most,
+        "least_popular_product_sku": least,
     }
 
-    # 6) Per-period metrics
-   # grouped = df.groupby("period").agg(
-       # total_orders=("order_id", "count"),
-       # gross_sales=("gross_sales", "sum"),
-        #net_sales=("net_sales", "sum"),
-        #grand_total=("grand_total", "sum")
-    #).reset_index()
-
-    # 6) Per-period metrics
-    grp = df.groupby("period")
-    metrics_df = grp.agg(
-        gross_sales=("gross_sales", "sum"),
-        net_sales   =("net_sales",   "sum"),
-        grand_total =("grand_total", "sum")
-    )
-    metrics_df["total_orders"] = grp.size()
-    metrics_df = metrics_df.reset_index() 
-
-    metrics = []
-   # for _, row in grouped.iterrows():
-    for _, row in metrics_df.iterrows():
-        period_df = df[df["period"] == row["period"]]
-        sku_counts = period_df["sku"].value_counts() if "sku" in df.columns else Counter()
-        metrics.append({
-            "period": row["period"],
-            "total_orders":      int(row["total_orders"]),
-            "gross_sales":       float(row["gross_sales"]),
-            "net_sales":         float(row["net_sales"]),
-            "grand_total":       float(row["grand_total"]),
-            "most_popular_product_sku": sku_counts.idxmax() if len(sku_counts) else None,
-            "least_popular_product_sku": sku_counts.idxmin() if len(sku_counts) else None
-        })
-
-    start_date = df["order_date"].min().date().isoformat()
-    end_date   = df["order_date"].max().date().isoformat()
+    most_by_period, least_by_period = _period_popular_skus(sku_table)
+    metrics = [
+        {
+            "period": key,
+            "total_orders":      int(row.total_orders),
+            "gross_sales":       float(row.gross_sales),
+            "net_sales":         float(row.net_sales),
+            "grand_total":       float(row.grand_total),
+            "most_popular_product_sku": most_by_period.get(key),
+            "least_popular_product_sku": least_by_period.get(key),
+        }
+        for key, row in zip(per_period.index, per_period.itertuples(index=False))
+    ]
+    return grand_totals, metrics
+
+def build_daily_aggregates(df: pd.DataFrame):
+    """
+    Compact per-day tables built once at upload, from which month and year
+    metrics are rolled up without touching the rows again:
+      daily      -- day, total_orders, gross_sales, net_sales, grand_total
+      daily_skus -- day, sku, count, first_pos (row of first appearance, for ties)
+    Returns (daily, daily_skus), or (None, None) without a purchased_date column.
+    """
+    if "purchased_date" not in sanitize_columns(df.columns.tolist()):
+        return None, None
+    df = _sales_frame(df)
+    day = df["order_date"].dt.normalize().rename("day")
+
+    grp = df.groupby(day, sort=True)
+    daily = grp[AGGREGATE_SUMS[1:]].sum()
+    daily.insert(0, "total_orders", grp.size())
+    daily = daily.reset_index()
+
+    if "sku" in df.columns:
+        daily_skus = _count_skus(day.to_frame(), df["sku"]).sort_values(["day", "sku"], ignore_index=True)
+    else:
+        daily_skus = _empty_sku_table(["day"]).astype({"day": "datetime64[ns]"})
+    return daily, daily_skus
+
+def append_typed_frame(typed: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """
+    build_typed_frame's result for the rows of `typed` followed by those of
+    `new` (typed the same way), without retyping: categorical columns keep
+    their categories in order of first appearance across both.
+    """
+    columns = {}
+    for col in typed.columns:
+        if isinstance(typed[col].dtype, pd.CategoricalDtype):
+            columns[col] = union_categoricals([typed[col], new[col]])
+        else:
+            columns[col] = pd.concat([typed[col], new[col]], ignore_index=True)
+    return pd.DataFrame(columns)
+
+def merge_daily_aggregates(daily: pd.DataFrame, daily_skus: pd.DataFrame,
+                           new_daily: pd.DataFrame, new_daily_skus: pd.DataFrame, offset: int):
+    """
+    build_daily_aggregates' tables for a frame extended with more rows,
+    from the tables of both parts; `offset` is the row count of the first
+    part, where the second one's first_pos positions start.
+    """
+    daily = pd.concat([daily, new_daily], ignore_index=True).groupby("day", sort=True)[AGGREGATE_SUMS].sum().reset_index()
+    daily_skus = pd.concat(
+        [daily_skus, new_daily_skus.assign(first_pos=new_daily_skus["first_pos"] + offset)], ignore_index=True
+    ).groupby(["day", "sku"], sort=True).agg(count=("count", "sum"), first_pos=("first_pos", "min")).reset_index()
+    return daily, daily_skus
+
+def _day_range(days: pd.Series, start: date | None, end: date | None) -> slice:
+    """Positions of the days from `start` to `end` (included) in sorted `days`, by binary search."""
+    values = days.to_numpy()
+    lo = np.searchsorted(values, pd.Timestamp(start).to_datetime64(), side="left") if start is not None else 0
+    hi = np.searchsorted(values, pd.Timestamp(end).to_datetime64(), side="right") if end is not None else len(values)
+    return slice(int(lo), int(max(lo, hi)))
+
+def metrics_from_aggregates(daily: pd.DataFrame, daily_skus: pd.DataFrame, groupby: str,
+                            start: date | None = None, end: date | None = None):
+    """
+    Same result as generate_metrics, rolled up from build_daily_aggregates'
+    tables. Cost depends on the number of distinct days and SKUs, not rows.
+    With `start`/`end`, only the days in that range (both included) are
+    rolled up; both tables are sorted by day, so the range is found by
+    binary search and the cost follows the size of the range.
+    """
+    if start is not None or end is not None:
+        daily = daily.iloc[_day_range(daily["day"], start, end)]
+        daily_skus = daily_skus.iloc[_day_range(daily_skus["day"], start, end)]
+    period = _period_key(daily["day"], groupby)
+    per_period = daily.groupby(period.rename("period"), sort=True)[AGGREGATE_SUMS].sum()
+    sku_table = daily_skus.assign(period=_period_key(daily_skus["day"], groupby))
+    grand_totals, metrics = _metrics_response(daily[AGGREGATE_SUMS].sum(), per_period, sku_table)
+
+    start_date = daily["day"].min().date().isoformat() if len(daily) else None
+    end_date   = daily["day"].max().date().isoformat() if len(daily) else None
     return grand_totals, metrics, start_date, end_date
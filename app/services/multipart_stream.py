@@ -0,0 +1,108 @@
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+
+class MultipartFileReader:
+    """
+    Push parser extracting one file field from a multipart/form-data body
+    as it streams in, so the upload is never spooled to memory or disk.
+    `feed(chunk)` returns the bytes of the field found in that chunk;
+    `charset` is the part's declared charset once its headers were read.
+    Other fields are skipped.
+    """
+
+    def __init__(self, content_type: str, field_name: str = "file"):
+        _, params = parse_options_header(content_type)
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise ValueError("Missing multipart boundary.")
+        self.field_name = field_name
+        self.found = False
+        self.charset = None
+        self._in_field = False
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+        self._output = []
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def feed(self, chunk: bytes) -> list[bytes]:
+        try:
+            self._parser.write(chunk)
+        except Exception as e:
+            raise ValueError(f"Invalid multipart body: {e}")
+        output, self._output = self._output, []
+        return output
+
+    def finalize(self) -> None:
+        self._parser.finalize()
+        if not self.found:
+            raise ValueError(f"Multipart body has no '{self.field_name}' field.")
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("latin-1")
+        # Only the first field with the expected name is read
+        self._in_field = name == self.field_name and not self.found
+        if self._in_field:
+            self.found = True
+            _, type_options = parse_options_header(self._headers.get(b"content-type", b""))
+            charset = type_options.get(b"charset")
+            self.charset = charset.decode("latin-1") if charset else None
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_field:
+            self._output.append(bytes(data[start:end]))
+
+    def _on_part_end(self) -> None:
+        self._in_field = False
+
+
+async def _iter_field(body_chunks, reader: MultipartFileReader, pending: list[bytes]):
+    for data in pending:
+        yield data
+    async for chunk in body_chunks:
+        for data in reader.feed(chunk):
+            if data:
+                yield data
+    reader.finalize()
+
+
+async def open_multipart_file(body_chunks, content_type: str, field_name: str = "file"):
+    """
+    Reads an async iterator of multipart body chunks up to the start of the
+    `field_name` file field. Returns (declared charset, async iterator of
+    the field's bytes); only the chunk holding the field's headers is
+    buffered. Raises ValueError if the body has no such field.
+    """
+    reader = MultipartFileReader(content_type, field_name)
+    body_chunks = body_chunks.__aiter__()
+    pending = []
+    while not reader.found:
+        try:
+            chunk = await body_chunks.__anext__()
+        except StopAsyncIteration:
+            reader.finalize()
+            break
+        pending = [data for data in reader.feed(chunk) if data]
+    return reader.charset, _iter_field(body_chunks, reader, pending)
@@ -0,0 +1,117 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+# Memory budget for rendered response bodies, overridable via environment (0 disables caching)
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 << 20)))
+
+
+class ResponseCache:
+    """
+    Bounded LRU of rendered response bodies and their Content-Encoding
+    (None when uncompressed). Keys are tuples starting with
+    (file_id, revision, ...); the revision changes whenever a file_id's data
+    is replaced, so a stale body is never served even if another process
+    replaced it. `invalidate(file_id)` frees a file's bodies right away.
+    """
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._bodies = OrderedDict()  # key -> (bytes, content encoding), oldest access first
+        self._by_file = {}            # file_id -> set of keys
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> tuple[bytes, str | None] | None:
+        with self._lock:
+            item = self._bodies.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._bodies.move_to_end(key)
+            self.hits += 1
+            return item
+
+    def put(self, key: tuple, body: bytes, content_encoding: str | None = None) -> None:
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._bodies[key] = (body, content_encoding)
+            self._by_file.setdefault(key[0], set()).add(key)
+            self._nbytes += len(body)
+            while self._nbytes > self.max_bytes:
+                self._discard(next(iter(self._bodies)))
+
+    def invalidate(self, file_id: str) -> None:
+        """Drops every cached body of file_id."""
+        with self._lock:
+            for key in list(self._by_file.get(file_id, ())):
+                self._discard(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._bodies.clear()
+            self._by_file.clear()
+            self._nbytes = 0
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._bodies),
+                "bytes": self._nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _discard(self, key: tuple) -> None:
+        item = self._bodies.pop(key, None)
+        if item is None:
+            return
+        self._nbytes -= len(item[0])
+        keys = self._by_file.get(key[0])
+        keys.discard(key)
+        if not keys:
+            del self._by_file[key[0]]
+
+
+def make_etag(key: tuple) -> str:
+    """Strong ETag derived from the cache key, so a 304 needs no rendering."""
+    return '"' + hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:24] + '"'
+
+
+def http_date(iso_timestamp: str) -> str:
+    """Formats an ISO-8601 UTC timestamp (as in `uploaded_at`) as an HTTP date."""
+    moment = datetime.fromisoformat(iso_timestamp.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return format_datetime(moment.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
+
+
+def is_not_modified(headers, etag: str, last_modified: str) -> bool:
+    """
+    Conditional GET check: If-None-Match takes precedence over
+    If-Modified-Since, as in RFC 9110.
+    """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+# Shared cache of rendered metrics responses
+metrics_cache = ResponseCache()
@@ -0,0 +1,514 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow as pa
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows: DiskStorage locks then only hold within a process
+    fcntl = None
+
+# Storage backend and limits, overridable via environment (0 disables a limit)
+FILE_STORAGE_BACKEND = os.getenv("FILE_STORAGE_BACKEND", "memory")
+FILE_STORAGE_DIR = os.getenv("FILE_STORAGE_DIR", "file_storage")
+FILE_STORAGE_MAX_BYTES = int(os.getenv("FILE_STORAGE_MAX_BYTES", str(1 << 30)))
+FILE_STORAGE_TTL_SECONDS = float(os.getenv("FILE_STORAGE_TTL_SECONDS", str(24 * 3600)))
+
+# How many evicted file_ids are remembered so lookups can report them as expired
+MAX_EXPIRED_IDS = 10_000
+
+
+def write_frame(path: str, df: pd.DataFrame) -> None:
+    """
+    Writes `df` (index dropped) as an uncompressed Arrow IPC file, atomically,
+    so it can be memory-mapped back by read_frame.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(path + ".tmp", "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(path + ".tmp", path)
+
+
+def _arrow_strings(data_type: pa.DataType):
+    # Strings stay in the mapped Arrow buffers instead of becoming Python objects
+    if pa.types.is_string(data_type) or pa.types.is_large_string(data_type):
+        return pd.ArrowDtype(data_type)
+    return None
+
+
+def read_frame(path: str) -> pd.DataFrame:
+    """
+    Reads a frame written by write_frame through a memory map: nothing is
+    read up front, numeric and datetime columns wrap the mapped buffers
+    without copying, and string columns become Arrow-backed (ArrowDtype)
+    rather than object columns. Pages are loaded lazily by the OS and
+    shared between processes.
+    """
+    table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    return table.to_pandas(split_blocks=True, types_mapper=_arrow_strings)
+
+
+def entry_nbytes(entry: dict) -> int:
+    """Estimated memory held by an entry: the deep memory usage of its DataFrames."""
+    return int(sum(
+        value.memory_usage(index=True, deep=True).sum()
+        for value in entry.values()
+        if isinstance(value, pd.DataFrame)
+    ))
+
+
+class StorageBackend:
+    """
+    Interface of the file_storage backends. Entries are dicts keyed by
+    file_id; backends that leave the process store DataFrame values as
+    columnar files and everything else as JSON.
+    """
+
+    def __init__(self):
+        self._discard_callbacks = []
+        self._evict_callbacks = []
+        self._locks = weakref.WeakValueDictionary()  # file_id -> threading.Lock, while in use
+        self._locks_guard = threading.Lock()
+
+    def on_discard(self, callback) -> None:
+        """Registers callback(file_id), called when an entry is evicted, popped or replaced."""
+        self._discard_callbacks.append(callback)
+
+    def _notify_discard(self, file_id: str) -> None:
+        for callback in self._discard_callbacks:
+            callback(file_id)
+
+    def on_evict(self, callback) -> None:
+        """Registers callback(file_id, reason), called once per entry evicted ("lru" or "ttl")."""
+        self._evict_callbacks.append(callback)
+
+    def _notify_evict(self, file_id: str, reason: str) -> None:
+        for callback in self._evict_callbacks:
+            callback(file_id, reason)
+
+    def get(self, file_id: str, default=None):
+        raise NotImplementedError
+
+    def __setitem__(self, file_id: str, entry: dict) -> None:
+        raise NotImplementedError
+
+    def left_over_keys(self) -> list[str]:
+        """
+        The file_ids stored by processes that had all exited when this one
+        opened the storage (e.g. before a restart); empty if another process
+        had it open, or if entries do not outlive their process.
+        """
+        return []
+
+    def fields(self, file_id: str) -> dict | None:
+        """The non-DataFrame values of a stored entry, or None if file_id is not stored."""
+        entry = self.get(file_id)
+        if entry is None:
+            return None
+        return {key: value for key, value in entry.items() if not isinstance(value, pd.DataFrame)}
+
+    def update_fields(self, file_id: str, **fields) -> bool:
+        """
+        Replaces non-DataFrame values of a stored entry, leaving its frames
+        as they are. Returns False if file_id is not stored.
+        """
+        raise NotImplementedError
+
+    @contextmanager
+    def lock(self, file_id: str):
+        """Exclusive lock on file_id, for read-modify-write updates of its entry."""
+        with self._locks_guard:
+            lock = self._locks.get(file_id)
+            if lock is None:
+                lock = self._locks[file_id] = threading.Lock()
+        with lock:
+            yield
+
+    def pop(self, file_id: str, default=None):
+        raise NotImplementedError
+
+    def keys(self) -> list[str]:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def is_expired(self, file_id: str) -> bool:
+        """True if file_id was stored once but has since been evicted."""
+        return False
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+    def __getitem__(self, file_id: str):
+        entry = self.get(file_id)
+        if entry is None:
+            raise KeyError(file_id)
+        return entry
+
+    def __contains__(self, file_id: str) -> bool:
+        return self.get(file_id) is not None
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+
+class FileStorage(StorageBackend):
+    """
+    Default in-process backend: a dict-like store bounded by a memory budget.
+    Entries are evicted least-recently-used first once the budget is
+    exceeded, and unconditionally `ttl_seconds` after they were stored.
+    Evicted file_ids are remembered so lookups can tell "expired" apart
+    from "never existed".
+    """
+
+    def __init__(self, max_bytes: int = FILE_STORAGE_MAX_BYTES, ttl_seconds: float = FILE_STORAGE_TTL_SECONDS):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()  # file_id -> (entry, nbytes, stored_at), oldest access first
+        self._expired = OrderedDict()  # file_id -> eviction reason
+        self._nbytes = 0
+        self.evictions = {"lru": 0, "ttl": 0}
+
+    def get(self, file_id: str, default=None):
+        with self._lock:
+            self._evict_expired()
+            item = self._entries.get(file_id)
+            if item is None:
+                return default
+            self._entries.move_to_end(file_id)
+            return item[0]
+
+    def __setitem__(self, file_id: str, entry: dict) -> None:
+        nbytes = entry_nbytes(entry)
+        with self._lock:
+            self._discard(file_id)
+            self._entries[file_id] = (entry, nbytes, time.monotonic())
+            self._nbytes += nbytes
+            self._expired.pop(file_id, None)
+            self._evict_expired()
+            self._evict_over_budget(keep=file_id)
+
+    def update_fields(self, file_id: str, **fields) -> bool:
+        with self._lock:
+            item = self._entries.get(file_id)
+            if item is None:
+                return False
+            entry, nbytes, stored_at = item
+            self._entries[file_id] = ({**entry, **fields}, nbytes, stored_at)
+            return True
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._evict_expired()
+            return len(self._entries)
+
+    def keys(self) -> list[str]:
+        with self._lock:
+            self._evict_expired()
+            return list(self._entries)
+
+    def pop(self, file_id: str, default=None):
+        with self._lock:
+            item = self._discard(file_id)
+            return default if item is None else item[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            for file_id in list(self._entries):
+                self._discard(file_id)
+            self._expired.clear()
+            self.evictions = {"lru": 0, "ttl": 0}
+
+    def is_expired(self, file_id: str) -> bool:
+        with self._lock:
+            self._evict_expired()
+            return file_id in self._expired
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._nbytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "evictions": dict(self.evictions),
+            }
+
+    def _discard(self, file_id: str):
+        item = self._entries.pop(file_id, None)
+        if item is not None:
+            self._nbytes -= item[1]
+            self._notify_discard(file_id)
+        return item
+
+    def _evict(self, file_id: str, reason: str) -> None:
+        self._discard(file_id)
+        self.evictions[reason] += 1
+        self._expired[file_id] = reason
+        while len(self._expired) > MAX_EXPIRED_IDS:
+            self._expired.popitem(last=False)
+        self._notify_evict(file_id, reason)
+
+    def _evict_expired(self) -> None:
+        if not self.ttl_seconds:
+            return
+        cutoff = time.monotonic() - self.ttl_seconds
+        for file_id in [fid for fid, (_, _, stored_at) in self._entries.items() if stored_at < cutoff]:
+            self._evict(file_id, "ttl")
+
+    def _evict_over_budget(self, keep: str) -> None:
+        if not self.max_bytes:
+            return
+        for file_id in list(self._entries):
+            if self._nbytes <= self.max_bytes:
+                break
+            if file_id != keep:
+                self._evict(file_id, "lru")
+
+
+class DiskStorage(StorageBackend):
+    """
+    Backend shared by every process on the host, and persistent across
+    restarts: an SQLite index holds the JSON part of each entry and its
+    DataFrames are written once, as Arrow IPC files under `root`, and
+    memory-mapped back (see read_frame) so a cold file_id is served without
+    parsing anything. Mapped frames are cached per process in a FileStorage
+    and revalidated against the index version on every lookup; the JSON
+    part is always read from the index. Locks (see lock) hold across
+    processes through an flock on a per-file_id file under `root/locks`.
+    Every instance holds a shared flock on the store while open, which
+    tells whether others had it open first (see left_over_keys).
+    """
+
+    def __init__(self, root: str = FILE_STORAGE_DIR, ttl_seconds: float = FILE_STORAGE_TTL_SECONDS,
+                 cache_max_bytes: int = FILE_STORAGE_MAX_BYTES):
+        super().__init__()
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self._cache = FileStorage(max_bytes=cache_max_bytes, ttl_seconds=0)
+        os.makedirs(os.path.join(root, "locks"), exist_ok=True)
+        self._store_lock = None
+        self._opened_at = time.time()
+        self._first_open = self._open_store_lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " file_id TEXT PRIMARY KEY, fields TEXT NOT NULL, frames TEXT NOT NULL,"
+                " version TEXT NOT NULL, nbytes INTEGER NOT NULL, stored_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS expired (file_id TEXT PRIMARY KEY, reason TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS evictions (reason TEXT PRIMARY KEY, count INTEGER NOT NULL)")
+
+    @contextmanager
+    def _connect(self):
+        # A short-lived connection per operation is safe across threads and processes
+        conn = sqlite3.connect(os.path.join(self.root, "index.sqlite"), timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _frame_path(self, file_id: str, key: str, version: str) -> str:
+        return os.path.join(self.root, file_id, f"{key}.{version}.arrow")
+
+    def _lock_path(self, file_id: str) -> str:
+        return os.path.join(self.root, "locks", f"{file_id}.lock")
+
+    def _open_store_lock(self) -> bool:
+        # Without flock other processes cannot be told apart: assume some may be running
+        if fcntl is None:
+            return False
+        self._store_lock = open(os.path.join(self.root, "locks", "store.lock"), "a")
+        try:
+            fcntl.flock(self._store_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            first = True
+        except BlockingIOError:
+            first = False
+        # Lets other instances open the store, and tells them it is in use
+        fcntl.flock(self._store_lock, fcntl.LOCK_SH)
+        return first
+
+    def close(self) -> None:
+        """Releases this instance's hold on the store."""
+        if self._store_lock is not None:
+            self._store_lock.close()
+            self._store_lock = None
+
+    @contextmanager
+    def lock(self, file_id: str):
+        with super().lock(file_id):
+            if fcntl is None:
+                yield
+                return
+            with open(self._lock_path(file_id), "a") as handle:
+                # Released when the handle is closed
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                yield
+
+    def _load(self, file_id: str):
+        with self._connect() as conn:
+            row = conn.execute("SELECT fields, frames, version FROM entries WHERE file_id = ?", (file_id,)).fetchone()
+        if row is None:
+            self._cache.pop(file_id)
+            return None
+        fields, frames, version = row
+
+        cached = self._cache.get(file_id)
+        if cached is not None and cached["_version"] == version:
+            frames = {key: value for key, value in cached.items() if key != "_version"}
+        else:
+            frames = {key: read_frame(self._frame_path(file_id, key, version)) for key in json.loads(frames)}
+            self._cache[file_id] = {"_version": version, **frames}
+        return {**json.loads(fields), **frames}
+
+    def get(self, file_id: str, default=None):
+        self._evict_expired()
+        try:
+            entry = self._load(file_id)
+        except FileNotFoundError:
+            # Replaced by another process between the index read and the file read
+            entry = self._load(file_id)
+        return default if entry is None else entry
+
+    def __setitem__(self, file_id: str, entry: dict) -> None:
+        version = uuid.uuid4().hex
+        fields, frames = {}, []
+        os.makedirs(os.path.join(self.root, file_id), exist_ok=True)
+        for key, value in entry.items():
+            if isinstance(value, pd.DataFrame):
+                write_frame(self._frame_path(file_id, key, version), value)
+                frames.append(key)
+            else:
+                fields[key] = value
+
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            old = conn.execute("SELECT frames, version FROM entries WHERE file_id = ?", (file_id,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (file_id, fields, frames, version, nbytes, stored_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (file_id, json.dumps(fields), json.dumps(frames), version, entry_nbytes(entry), time.time()),
+            )
+            conn.execute("DELETE FROM expired WHERE file_id = ?", (file_id,))
+            conn.execute("COMMIT")
+        if old is not None:
+            self._notify_discard(file_id)
+            for key in json.loads(old[0]):
+                try:
+                    # Readers that still map the old file keep their pages until they let go
+                    os.remove(self._frame_path(file_id, key, old[1]))
+                except FileNotFoundError:
+                    pass
+        self._evict_expired()
+
+    def left_over_keys(self) -> list[str]:
+        if not self._first_open:
+            return []
+        with self._connect() as conn:
+            # Entries stored since were stored by live processes
+            rows = conn.execute("SELECT file_id FROM entries WHERE stored_at < ?", (self._opened_at,)).fetchall()
+        return [row[0] for row in rows]
+
+    def fields(self, file_id: str) -> dict | None:
+        with self._connect() as conn:
+            row = conn.execute("SELECT fields FROM entries WHERE file_id = ?", (file_id,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def update_fields(self, file_id: str, **fields) -> bool:
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT fields FROM entries WHERE file_id = ?", (file_id,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE entries SET fields = ? WHERE file_id = ?",
+                             (json.dumps({**json.loads(row[0]), **fields}), file_id))
+            conn.execute("COMMIT")
+        return row is not None
+
+    def _delete(self, conn: sqlite3.Connection, file_id: str) -> bool:
+        deleted = conn.execute("DELETE FROM entries WHERE file_id = ?", (file_id,)).rowcount > 0
+        self._cache.pop(file_id)
+        if deleted:
+            self._notify_discard(file_id)
+        shutil.rmtree(os.path.join(self.root, file_id), ignore_errors=True)
+        try:
+            os.remove(self._lock_path(file_id))
+        except FileNotFoundError:
+            pass
+        return deleted
+
+    def pop(self, file_id: str, default=None):
+        entry = self.get(file_id)
+        with self._connect() as conn:
+            self._delete(conn, file_id)
+        return default if entry is None else entry
+
+    def keys(self) -> list[str]:
+        self._evict_expired()
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute("SELECT file_id FROM entries ORDER BY stored_at")]
+
+    def clear(self) -> None:
+        with self._connect() as conn:
+            for (file_id,) in conn.execute("SELECT file_id FROM entries").fetchall():
+                self._delete(conn, file_id)
+            conn.execute("DELETE FROM expired")
+            conn.execute("DELETE FROM evictions")
+        self._cache.clear()
+
+    def is_expired(self, file_id: str) -> bool:
+        self._evict_expired()
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM expired WHERE file_id = ?", (file_id,)).fetchone() is not None
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            entries, nbytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM entries").fetchone()
+            evictions = dict(conn.execute("SELECT reason, count FROM evictions").fetchall())
+        return {
+            "entries": entries,
+            "bytes": nbytes,
+            "ttl_seconds": self.ttl_seconds,
+            "evictions": {"ttl": evictions.get("ttl", 0)},
+        }
+
+    def _evict_expired(self) -> None:
+        if not self.ttl_seconds:
+            return
+        cutoff = time.time() - self.ttl_seconds
+        with self._connect() as conn:
+            expired = conn.execute("SELECT file_id FROM entries WHERE stored_at < ?", (cutoff,)).fetchall()
+            for (file_id,) in expired:
+                # Only the process that actually deletes the row counts the eviction
+                if self._delete(conn, file_id):
+                    conn.execute("INSERT OR REPLACE INTO expired (file_id, reason) VALUES (?, 'ttl')", (file_id,))
+                    conn.execute(
+                        "INSERT INTO evictions (reason, count) VALUES ('ttl', 1)"
+                        " ON CONFLICT(reason) DO UPDATE SET count = count + 1"
+                    )
+                    self._notify_evict(file_id, "ttl")
+
+
+def create_storage(backend: str = FILE_STORAGE_BACKEND, root: str = FILE_STORAGE_DIR) -> StorageBackend:
+    """Builds the configured file_storage backend ("memory" or "disk", under `root`)."""
+    if backend == "memory":
+        return FileStorage()
+    if backend == "disk":
+        return DiskStorage(root=root)
+    raise ValueError(f"Unknown file storage backend: {backend}")
@@ -0,0 +1,141 @@
+import os
+import time
+
+import prometheus_client
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+
+# Histogram buckets: request latency (seconds) and response size (bytes)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+# Route label of requests that matched no route, so unknown paths cannot blow up label cardinality
+UNMATCHED_ROUTE = "unmatched"
+
+# With several worker processes (uvicorn --workers N), each writes its metrics to files in this
+# directory and a scrape of any worker aggregates them all (prometheus_client's multiprocess mode)
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Counters are exposed as *_total only, without their *_created timestamps
+prometheus_client.disable_created_metrics()
+
+# Registry exposed by GET /metrics (in multiprocess mode, the values come from the shared files)
+registry = CollectorRegistry()
+_collectors = []
+
+# HTTP requests, labelled by route template (e.g. /api/v1/order-items/uploads/{file_id}/metrics)
+http_requests = Counter(
+    "http_requests_total", "HTTP requests served.", ("method", "route", "status"), registry=registry)
+http_request_seconds = Histogram(
+    "http_request_duration_seconds", "HTTP request latency in seconds.", ("method", "route"),
+    buckets=LATENCY_BUCKETS, registry=registry)
+http_response_bytes = Histogram(
+    "http_response_size_bytes", "HTTP response body size in bytes.", ("method", "route"),
+    buckets=SIZE_BUCKETS, registry=registry)
+http_in_flight = Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served.", ("method",),
+    multiprocess_mode="livesum", registry=registry)
+
+# CSV ingestion, fed by the download/parse pipeline
+ingest_files = Counter(
+    "ingest_files_total", "CSV files ingested, by final job status.", ("status",), registry=registry)
+ingest_bytes = Counter(
+    "ingest_bytes_total", "Raw CSV bytes downloaded and ingested.", registry=registry)
+ingest_rows = Counter(
+    "ingest_rows_total", "CSV data rows ingested (rows.total of each summary).", registry=registry)
+ingest_seconds = Counter(
+    "ingest_seconds_total", "Wall time spent ingesting CSV files, by pipeline stage.", ("stage",),
+    registry=registry)
+
+# Storage and caches: sizes refreshed at scrape time, events counted as they happen. The storage
+# is shared by the workers with the disk backend, so the latest value read is the one exposed.
+storage_entries = Gauge(
+    "file_storage_entries", "Files held by file_storage.", multiprocess_mode="mostrecent", registry=registry)
+storage_bytes = Gauge(
+    "file_storage_bytes", "Estimated bytes held by file_storage.", multiprocess_mode="mostrecent",
+    registry=registry)
+storage_evictions = Counter(
+    "file_storage_evictions_total", "Files evicted from file_storage by this process, by reason.", ("reason",),
+    registry=registry)
+response_cache_bytes = Gauge(
+    "metrics_response_cache_bytes", "Bytes of cached metrics responses.", multiprocess_mode="livesum",
+    registry=registry)
+response_cache_lookups = Counter(
+    "metrics_response_cache_lookups_total", "Metrics response cache lookups, by result.", ("result",),
+    registry=registry)
+
+
+def on_collect(callback) -> None:
+    """Registers callback(), called before every render to refresh gauges read from elsewhere."""
+    _collectors.append(callback)
+
+
+def render() -> bytes:
+    """The metrics in the Prometheus text format, from every worker process in multiprocess mode."""
+    for callback in _collectors:
+        callback()
+    if PROMETHEUS_MULTIPROC_DIR:
+        collected = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collected, path=PROMETHEUS_MULTIPROC_DIR)
+        return prometheus_client.generate_latest(collected)
+    return prometheus_client.generate_latest(registry)
+
+
+def mark_process_dead() -> None:
+    """Drops this process's live gauges (in-flight requests, cache size) from multiprocess scrapes."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid(), PROMETHEUS_MULTIPROC_DIR)
+
+
+def record_ingest(summary: dict) -> None:
+    """Adds a finished upload's byte, row and per-stage time counts to the ingest counters."""
+    durations = summary["durations"]
+    ingest_files.labels(status="done").inc()
+    ingest_bytes.inc(durations["bytes_downloaded"])
+    ingest_rows.inc(summary["rows"]["total"])
+    for stage, seconds in durations["stages"].items():
+        ingest_seconds.labels(stage=stage).inc(seconds)
+
+
+class TelemetryMiddleware:
+    """
+    ASGI middleware recording, per request: the latency and response body
+    size histograms and the request counter (labelled by the matched
+    route's path template), plus the in-flight gauge.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        method = scope["method"]
+        status = 500
+        nbytes = 0
+
+        async def send_wrapper(message):
+            nonlocal status, nbytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                nbytes += len(message.get("body", b""))
+            await send(message)
+
+        in_flight = http_in_flight.labels(method=method)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_flight.dec()
+            route = _route_template(scope)
+            http_requests.labels(method=method, route=route, status=status).inc()
+            http_request_seconds.labels(method=method, route=route).observe(elapsed)
+            http_response_bytes.labels(method=method, route=route).observe(nbytes)
+
+
+def _route_template(scope) -> str:
+    # The router stores the matched route in the (shared) scope
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ROUTE
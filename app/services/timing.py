@@ -0,0 +1,89 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss_bytes() -> int | None:
+    """
+    Resident set size of this process, or its high-water mark where the
+    current value cannot be read cheaply. None if unavailable.
+    """
+    try:
+        with open("/proc/self/statm", "rb") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, KiB elsewhere
+
+
+class StageTimer:
+    """
+    Accumulates high-resolution wall time per named pipeline stage.
+    Stages nest: while an inner stage runs, the enclosing one is paused, so
+    each stage reports exclusive time. Stacks are per thread; stages run
+    concurrently on other threads (e.g. the arrow reader's read-ahead)
+    overlap with the main thread's stages instead. The process RSS is
+    sampled whenever a stage ends and its peak kept in `peak_rss_bytes`;
+    `peak_rss_growth_bytes` is how far it rose over the RSS at creation.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.start_rss_bytes = current_rss_bytes()
+        self.peak_rss_bytes = self.start_rss_bytes
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _charge(self, name: str, since: float, now: float) -> None:
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + (now - since)
+
+    @contextmanager
+    def stage(self, name: str):
+        stack = self._local.__dict__.setdefault("stack", [])  # [name, started] frames
+        now = time.perf_counter()
+        if stack:
+            self._charge(stack[-1][0], stack[-1][1], now)
+        stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self._charge(name, stack.pop()[1], now)
+            if stack:
+                stack[-1][1] = now
+            self._sample_rss()
+
+    def iterate(self, name: str, iterable):
+        """Yields from `iterable`, timing each step under stage `name`."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    @property
+    def peak_rss_growth_bytes(self) -> int | None:
+        if self.start_rss_bytes is None or self.peak_rss_bytes is None:
+            return None
+        return self.peak_rss_bytes - self.start_rss_bytes
+
+    def _sample_rss(self) -> None:
+        rss = current_rss_bytes()
+        if rss is not None and (self.peak_rss_bytes is None or rss > self.peak_rss_bytes):
+            self.peak_rss_bytes = rss
@@ -0,0 +1,47 @@
+import gzip
+import io
+import zipfile
+import pytest
+from app.services.decompress import Decompressor, detect_compression
+
+DATA = b"order_id,sku\n" + b"".join(b"%d,SKU%d\n" % (i, i % 7) for i in range(5000))
+
+def chunks(blob, size=100):
+    return [blob[i:i + size] for i in range(0, len(blob), size)]
+
+def test_plain_input_passes_through():
+    decompressor = Decompressor(chunks(DATA))
+    assert b"".join(decompressor) == DATA
+    assert decompressor.compression is None
+
+def test_multi_member_gzip():
+    blob = gzip.compress(DATA[:1000]) + gzip.compress(DATA[1000:])
+    decompressor = Decompressor(chunks(blob, 7))
+    assert b"".join(decompressor) == DATA
+    assert decompressor.compression == "gzip"
+    assert decompressor.nbytes == len(DATA)
+
+@pytest.mark.parametrize("method", [zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED])
+def test_zip_first_file_member(method):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", method) as archive:
+        archive.writestr("export/", "")
+        archive.writestr("export/orders.csv", DATA)
+        archive.writestr("other.csv", b"ignored")
+    assert b"".join(Decompressor(chunks(buffer.getvalue(), 33))) == DATA
+
+def test_zstd_frames():
+    zstandard = pytest.importorskip("zstandard")
+    blob = zstandard.ZstdCompressor().compress(DATA[:10]) + zstandard.ZstdCompressor().compress(DATA[10:])
+    decompressor = Decompressor(chunks(blob))
+    assert b"".join(decompressor) == DATA
+    assert decompressor.compression == "zstd"
+
+def test_truncated_input_raises_value_error():
+    with pytest.raises(ValueError, match="truncated"):
+        b"".join(Decompressor([gzip.compress(DATA)[:200]]))
+
+def test_detect_compression():
+    assert detect_compression(b"\x1f\x8b\x08") == "gzip"
+    assert detect_compression(b"PK\x03\x04") == "zip"
+    assert detect_compression(b"order_id") is None
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+from app.services.dedup import DedupIndex
+
+def _reference_mask(frame, key_cols):
+    seen, mask = set(), []
+    for key in zip(*(frame[col].tolist() for col in key_cols)):
+        mask.append(key in seen)
+        seen.add(key)
+    return np.array(mask, dtype=bool)
+
+def _feed(index, frame, size):
+    return np.concatenate([index.add(frame.iloc[i:i + size]) for i in range(0, len(frame), size)])
+
+def test_matches_set_of_seen_keys_across_batches():
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame({
+        "order_item_id": [f"item{i}" for i in rng.integers(0, 300, 1000)],
+        "order_id": [f"ord{i}" for i in rng.integers(0, 40, 1000)],
+        "sku": [f"S{i}" for i in rng.integers(0, 10, 1000)],
+    })
+    for key_cols in (["order_item_id"], ["order_id", "sku"]):
+        expected = _reference_mask(frame, key_cols)
+        for size in (1, 7, 250, 1000):
+            index = DedupIndex(key_cols)
+            np.testing.assert_array_equal(_feed(index, frame, size), expected)
+            assert index.duplicated == int(expected.sum())
+            assert len(index) == len(frame) - index.duplicated
+
+def test_composite_key_columns_do_not_run_together():
+    frame = pd.DataFrame({"order_id": ["1", "11", "1"], "sku": ["12", "2", "12"]})
+    assert DedupIndex(["order_id", "sku"]).add(frame).tolist() == [False, False, True]
+
+def test_hash_collisions_are_not_counted_as_duplicates(mocker):
+    frame = pd.DataFrame({"order_item_id": ["a", "b", "a", "c", "b", "c", "d"]})
+    index = DedupIndex(["order_item_id"])
+    # Every key hashes alike: only the key comparison tells them apart
+    mocker.patch.object(index, "_hash", side_effect=lambda keys: np.zeros(len(keys[0]), dtype=np.uint64))
+    mask = _feed(index, frame, 3)
+    np.testing.assert_array_equal(mask, _reference_mask(frame, ["order_item_id"]))
+    assert index.duplicated == 3
+    assert len(index) == 4
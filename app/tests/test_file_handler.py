@@ -1,10 +1,13 @@
+import asyncio
 import pytest
+import httpx
 import requests
 import pandas as pd
 from datetime import datetime
 from io import StringIO
 from unittest.mock import MagicMock
-from app.services.file_handler import download_and_clean_csv, _perform_detailed_analysis, file_storage
+from app.services.file_handler import download_and_clean_csv, download_and_clean_csv_async, _perform_detailed_analysis, _ingest_stream, file_storage
+from app.services.file_handler import _validate_content, detect_encoding
 
 # Mock responses for requests.get
 class MockResponse:
@@ -17,6 +20,13 @@ class MockResponse:
     def content(self):
         return self._content
 
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self._content), chunk_size):
+            yield self._content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
     def raise_for_status(self):
         if self.status_code != 200:
             raise requests.exceptions.HTTPError(f"HTTP Error {self.status_code}")
@@ -205,47 +215,36 @@ def test_download_and_clean_csv_download_failure(mocker):
     with pytest.raises(ValueError, match="Error downloading file"):
         download_and_clean_csv(mock_url)
 
-def test_download_and_clean_csv_encoding_failure(mocker):
-    # Simulate a file that cannot be decoded by common encodings
-    mock_url = "http://example.com/bad_encoding.csv"
-    
-    # Create content that will fail utf-8, latin1, ISO-8859-1, cp1252 strict decode
-    # A simple way is to force an invalid byte sequence for common text encodings
-    # For example, using bytes that are not valid UTF-8
-    bad_bytes = b'\xc3\x28' # This is not valid UTF-8 (missing continuation byte)
-    
-    # We want to test that the `encoding_errors` count increases and eventually fails if no encoding works.
-    # To do this, we'll patch `requests.Response.content.decode` directly to simulate errors.
-    
-    # First, let requests.get return some bytes
-    mock_response_instance = MockResponse(content="some data", encoding='utf-8')
-    mocker.patch('requests.get', return_value=mock_response_instance)
-
-    # Now, patch the decode method of the response to always raise UnicodeDecodeError
-    # for specific encodings if we need to control the exact count.
-    # For simplicity, here we'll simulate a failure to decode with *any* of the tries
-    # by making the initial decode to `raw_text` itself fail.
-    
-    # The current `download_and_clean_csv` tries multiple decodings.
-    # If all fail, it raises a ValueError. The encoding_errors count will be the number of failed attempts.
-    
-    # Let's ensure our MockResponse returns content that will fail all attempts.
-    # A simple way is to use a byte string directly and specify no 'encoding' argument
-    # so `decode` isn't called initially by MockResponse but by `download_and_clean_csv`
-    class ReallyBadMockResponse:
-        def __init__(self, raw_bytes):
+def test_download_and_clean_csv_counts_rows_with_encoding_errors(mocker):
+    # Valid UTF-8 except for a stray byte in one row: the row is kept and counted, not the codecs tried
+    class BytesMockResponse:
+        def __init__(self, raw_bytes, headers=None):
             self._content = raw_bytes
             self.status_code = 200
-        @property
-        def content(self):
-            return self._content
+            self.headers = headers or {}
+        def iter_content(self, chunk_size=1):
+            yield self._content
+        def close(self):
+            pass
         def raise_for_status(self):
             pass # No HTTP error
 
-    mocker.patch('requests.get', return_value=ReallyBadMockResponse(raw_bytes=b'\xff\xfe\x00\x00')) # Bytes that will fail common text decoders
+    good_rows = "".join(f"{i},Ä{i},10.0,1.0\n" for i in range(5000)) # Beyond the sampled prefix
+    data = ("order_id,sku,item_price,item_tax\n" + good_rows).encode() + b"5000,B\xff2,20.0,2.0\n"
+    mocker.patch('requests.get', return_value=BytesMockResponse(data))
 
-    with pytest.raises(ValueError, match="Could not decode file with any of the attempted encodings. Total encoding errors:"):
-        download_and_clean_csv(mock_url)
+    file_id, df_cleaned, summary = download_and_clean_csv("http://example.com/bad_encoding.csv")
+    assert summary["rows"]["encoding_errors"] == 1
+    assert summary["rows"]["usable"] == 5001
+    assert df_cleaned.loc[0, "sku"] == "Ä0"
+    assert df_cleaned.loc[5000, "sku"] == "B\ufffd2"
+
+    # A declared charset is used for the whole body
+    latin1 = "order_id,sku,item_price,item_tax\n1,Ä1,10.0,1.0\n".encode('latin1')
+    mocker.patch('requests.get', return_value=BytesMockResponse(latin1, {"content-type": "text/csv; charset=ISO-8859-1"}))
+    _, df_cleaned, summary = download_and_clean_csv("http://example.com/latin1.csv")
+    assert summary["rows"]["encoding_errors"] == 0
+    assert df_cleaned.loc[0, "sku"] == "Ä1"
 
 def test_download_and_clean_csv_empty_file_after_download(mocker):
     mock_url = "http://example.com/empty.csv"
@@ -255,4 +254,225 @@ def test_download_and_clean_csv_empty_file_after_download(mocker):
     assert summary["rows"]["total"] == 0
     assert summary["rows"]["usable"] == 0
     assert df_cleaned.empty
-    assert file_id in file_storage
\ No newline at end of file
+    assert file_id in file_storage
+
+# --- Tests for download_and_clean_csv_async function ---
+def _mock_async_client(content, status_code=200):
+    transport = httpx.MockTransport(lambda request: httpx.Response(status_code, content=content))
+    return httpx.AsyncClient(transport=transport)
+
+def test_download_and_clean_csv_async_success():
+    mock_csv_content = b"""order_id,sku,item_price,item_tax
+1,A1,10.0,1.0
+2,B2,20.0,2.0"""
+
+    async def run():
+        async with _mock_async_client(mock_csv_content) as client:
+            return await download_and_clean_csv_async("http://example.com/test.csv", client=client)
+
+    file_id, df_cleaned, summary = asyncio.run(run())
+    assert file_id in file_storage
+    assert len(df_cleaned) == 2
+    assert summary["rows"]["usable"] == 2
+
+def test_download_and_clean_csv_async_download_failure():
+    async def run():
+        async with _mock_async_client(b"", status_code=404) as client:
+            return await download_and_clean_csv_async("http://example.com/missing.csv", client=client)
+
+    with pytest.raises(ValueError, match="Error downloading file"):
+        asyncio.run(run())
+
+
+# --- Tests for the streaming ingestion pipeline ---
+STREAM_CSV = "order_id,sku,item_price,item_tax,order_item_id\r\n" \
+             "1,A1,10.0,1.0,item1\r\n" \
+             ",,,,\r\n" \
+             "2,Bé,invalid,2.0,item2\r\n" \
+             "1,A1,10.0,1.0,item1\r\n" \
+             "3,C3,30.0\r\n" \
+             "4,D4,40.0,4.0,item4\r\n"
+
+def _byte_chunks(data: bytes, size: int):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+def test_ingest_stream_matches_whole_text_analysis():
+    expected_summary, expected_df = _perform_detailed_analysis(STREAM_CSV)
+
+    # Tiny chunks split multi-byte characters and "\r\n" pairs across reads
+    for size in (1, 2, 3, 7, 1024):
+        file_id, df, summary = _ingest_stream(_byte_chunks(STREAM_CSV.encode('utf-8'), size), chunksize=2)
+        assert summary["rows"] == expected_summary["rows"]
+        assert summary["outcome"] == expected_summary["outcome"]
+        pd.testing.assert_frame_equal(df, expected_df)
+
+def test_detailed_analysis_quoted_newlines_stay_in_one_row():
+    raw_text = 'order_id,sku,item_price,item_tax\n1,"A\nB",10.0,1.0\n2,C2,20.0,2.0\n'
+    summary, df = _perform_detailed_analysis(raw_text)
+    assert summary["rows"]["total"] == 2
+    assert summary["rows"]["sanitised"] == 2
+    assert df.loc[0, "sku"] == "A\nB"
+
+def test_ingest_stream_detects_single_byte_encoding():
+    data = "order_id,sku,item_price,item_tax\n1,ÅB,10.0,1.0\n2,\u201cQ\u201d,5.0,1.0\n".encode('cp1252')
+    file_id, df, summary = _ingest_stream(_byte_chunks(data, 4))
+    assert summary["rows"]["encoding_errors"] == 0 # Picked up front from the sample, nothing re-decoded
+    assert df.loc[0, "sku"] == "ÅB"
+    assert df.loc[1, "sku"] == "\u201cQ\u201d" # cp1252 smart quotes, not latin1 control characters
+
+@pytest.mark.parametrize("encoding,bom", [("utf-8", b"\xef\xbb\xbf"), ("utf-16-le", b"\xff\xfe"), ("utf-16-be", b"\xfe\xff")])
+def test_detect_encoding_from_bom(encoding, bom):
+    assert detect_encoding(bom + "a,b\n".encode(encoding)) == (encoding, len(bom))
+    data = bom + "order_id,sku,item_price,item_tax\n1,Ä1,10.0,1.0\n".encode(encoding)
+    _, df, summary = _ingest_stream(_byte_chunks(data, 3))
+    assert list(df.columns) == ["order_id", "sku", "item_price", "item_tax"]
+    assert df.loc[0, "sku"] == "Ä1"
+
+def test_ingest_stream_stores_typed_frame():
+    data = b"order_id,sku,item_price,item_tax,purchased_date\n1,A1,10.0,1.0,2024-01-01\n2,B2,bad,2.0,2024-01-02\n"
+    file_id, df, summary = _ingest_stream([data])
+
+    typed = file_storage.get(file_id)["typed"]
+    assert typed["item_price"].dtype == "float64"
+    assert pd.isna(typed.loc[1, "item_price"])
+    assert pd.api.types.is_datetime64_any_dtype(typed["purchased_date"])
+    assert isinstance(typed["sku"].dtype, pd.CategoricalDtype)
+    # The raw frame is kept alongside
+    assert file_storage.get(file_id)["data"] is df
+
+def _reference_malformed_mask(df):
+    # The original multi-pass check: quotes, newlines and non-[digit/dot] stripped, then to_numeric
+    checked = df.copy()
+    for col in ['item_price', 'item_tax']:
+        checked[col] = checked[col].astype(str).str.replace('"', '', regex=False)
+        checked[col] = checked[col].str.replace(r'[\n\r]', '', regex=True)
+        checked[col] = checked[col].str.replace(r'[^\d.]', '', regex=True)
+        checked[col] = pd.to_numeric(checked[col], errors='coerce')
+    for col in ['order_id', 'sku']:
+        checked[col] = checked[col].astype(str).str.replace(r'[^\x00-\x7F]+', '', regex=True).str.strip()
+    good = (checked['order_id'] != '') & (checked['sku'] != '') & checked['item_price'].notna() & checked['item_tax'].notna()
+    return ~good
+
+def test_validate_content_matches_reference_check():
+    prices = ['10.5', '-3', '1e5', ' 7 ', '$1,234.50', 'abc', '', '.', '1.2.3', 'inf', '-inf', 'nan', '"4"', '5\n', '٣']
+    texts = ['A1', ' ', 'é', ' é ', 'éx', '\x1f', '\t', 'ok ', '']
+    rows = [(texts[i % len(texts)], texts[(i * 5) % len(texts)], prices[i % len(prices)], prices[(i * 7) % len(prices)])
+            for i in range(len(prices) * len(texts))]
+    df = pd.DataFrame(rows, columns=['order_id', 'sku', 'item_price', 'item_tax'])
+
+    malformed, numeric = _validate_content(df, ['item_price', 'item_tax'])
+    assert malformed == int(_reference_malformed_mask(df).sum())
+    # Parsed values are exactly what the typed frame would hold
+    pd.testing.assert_series_equal(numeric['item_price'], pd.to_numeric(df['item_price'], errors='coerce').astype('float64'))
+
+
+def test_ingest_stream_reports_stage_durations():
+    data = b"order_id,sku,item_price,item_tax,purchased_date\n1,A1,10.0,1.0,2024-01-01\n2,B2,20.0,2.0,2024-01-02\n"
+    _, _, summary = _ingest_stream(_byte_chunks(data, 16))
+
+    durations = summary["durations"]
+    assert set(durations["stages"]) == {"download", "decompress", "decode", "parse", "validate", "dedupe", "typing", "aggregate"}
+    assert durations["bytes_downloaded"] == len(data)
+    assert isinstance(durations["total_seconds"], float) and durations["total_seconds"] > 0
+    assert sum(durations["stages"].values()) <= durations["total_seconds"] + 1e-3
+    assert durations["rows_per_second"] > 0
+
+def test_multipart_file_reader_streams_field_across_chunks():
+    import asyncio
+    from app.services.multipart_stream import open_multipart_file
+
+    body = (
+        b'--XyZ\r\nContent-Disposition: form-data; name="note"\r\n\r\nhello\r\n'
+        b'--XyZ\r\nContent-Disposition: form-data; name="file"; filename="a.csv"\r\n'
+        b'Content-Type: text/csv; charset=cp1252\r\n\r\nsku\r\ncaf\xe9\r\n--XyZ--\r\n'
+    )
+
+    async def chunks():
+        for i in range(0, len(body), 7):
+            yield body[i:i + 7]
+
+    async def read():
+        charset, field = await open_multipart_file(chunks(), "multipart/form-data; boundary=XyZ")
+        return charset, b"".join([data async for data in field])
+
+    assert asyncio.run(read()) == ("cp1252", b"sku\r\ncaf\xe9")
+
+def test_ingest_stream_decompresses_gzip_input():
+    import gzip
+    data = b"order_id,sku,item_price,item_tax,purchased_date\n1,A1,10.0,1.0,2024-01-01\n2,B2,20.0,2.0,2024-01-02\n"
+    compressed = gzip.compress(data)
+    _, df, summary = _ingest_stream(_byte_chunks(compressed, 8))
+
+    _, plain_df, plain_summary = _ingest_stream([data])
+    assert summary["rows"] == plain_summary["rows"]
+    pd.testing.assert_frame_equal(df, plain_df)
+    assert summary["durations"]["compression"] == "gzip"
+    assert summary["durations"]["bytes_downloaded"] == len(compressed)
+    assert summary["durations"]["bytes_decompressed"] == len(data)
+
+def test_ingest_stream_can_drop_duplicates_from_stored_frame(mocker):
+    data = (b"order_item_id,order_id,sku,item_price,item_tax\n"
+            b"item1,1,A1,10.0,1.0\nitem2,2,B2,20.0,2.0\nitem1,1,A1,10.0,1.0\nitem3,3,C3,bad,3.0\n")
+    _, kept_df, kept_summary = _ingest_stream([data])
+
+    mocker.patch('app.services.file_handler.DROP_DUPLICATES', True)
+    file_id, df, summary = _ingest_stream([data])
+    assert summary["rows"] == kept_summary["rows"] # Counted the same either way
+    assert summary["rows"]["duplicated"] == 1
+    assert len(kept_df) == 4
+    assert df["order_item_id"].tolist() == ["item1", "item2", "item3"]
+    typed = file_storage.get(file_id)["typed"]
+    assert typed["item_price"].tolist()[:2] == [10.0, 20.0] and pd.isna(typed["item_price"].iloc[2])
+
+def test_append_stream_matches_ingesting_all_rows_at_once():
+    from app.services.file_handler import _append_stream
+    from app.services.metrics_calculator import metrics_from_aggregates
+    header = b"order_item_id,order_id,sku,item_price,item_tax,purchased_date\n"
+    first = b"item1,1,A1,10.0,1.0,2024-01-01\nitem2,2,B2,20.0,2.0,2024-01-02\n"
+    later = b"item3,3,C3,30.0,3.0,2024-01-02\nitem4,4,A1,bad,4.0,2024-02-01\nitem5,5,D4,5.0,0.5,2024-03-01\n"
+
+    file_id, _, _ = _ingest_stream([header + first])
+    _, df, summary = _append_stream(_byte_chunks(header + first + later + first, 16), file_id)
+    entry = file_storage[file_id]
+    _, _, reference_summary = _ingest_stream([header + first + later], file_id="reference")
+    reference = file_storage["reference"]
+
+    pd.testing.assert_frame_equal(df, reference["data"])
+    pd.testing.assert_frame_equal(entry["typed"], reference["typed"])
+    pd.testing.assert_frame_equal(entry["daily"], reference["daily"])
+    pd.testing.assert_frame_equal(entry["daily_skus"], reference["daily_skus"])
+    assert metrics_from_aggregates(entry["daily"], entry["daily_skus"], "month") == \
+        metrics_from_aggregates(reference["daily"], reference["daily_skus"], "month")
+    assert summary["last_append"]["added"] == 3
+    assert summary["last_append"]["rows"]["duplicated"] == 4
+    # The stored rows, as if uploaded at once: rows sent again are not counted twice
+    assert summary["rows"] == reference_summary["rows"]
+    assert summary["outcome"] == reference_summary["outcome"]
+    assert summary["appends"] == 1
+
+def test_append_stream_rejects_different_columns():
+    from app.services.file_handler import _append_stream
+    file_id, _, _ = _ingest_stream([b"order_item_id,order_id,sku,item_price,item_tax\nitem1,1,A1,10.0,1.0\n"])
+    with pytest.raises(ValueError):
+        _append_stream([b"order_item_id,order_id,sku,item_price\nitem2,2,B2,20.0\n"], file_id)
+    assert len(file_storage[file_id]["data"]) == 1
+
+def test_fail_interrupted_jobs_after_restart(tmp_path, mocker):
+    from app.services.file_handler import fail_interrupted_jobs
+    from app.services.storage import DiskStorage
+    before = DiskStorage(root=str(tmp_path), ttl_seconds=0)
+    _ingest_stream([b"order_id,sku,item_price,item_tax\n1,A1,10.0,1.0\n"], file_id="done")
+    mocker.patch('app.services.file_handler.file_storage', before)
+    for status in ("queued", "downloading", "parsing"):
+        before[status] = {"status": status, "data": None, "summary": None}
+    before["done"] = file_storage["done"]
+    assert fail_interrupted_jobs() == 0 # Jobs of a running process are left alone
+    before.close()
+
+    restarted = DiskStorage(root=str(tmp_path), ttl_seconds=0)
+    mocker.patch('app.services.file_handler.file_storage', restarted)
+    assert fail_interrupted_jobs() == 3
+    assert restarted["parsing"]["status"] == "failed"
+    assert restarted["parsing"]["error"] == "Interrupted by restart."
+    assert restarted["done"]["status"] == "done"
+    assert len(restarted["done"]["data"]) == 1
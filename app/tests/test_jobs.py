@@ -0,0 +1,60 @@
+import asyncio
+import threading
+import time
+import pytest
+from app.services.jobs import JobQueue, QueueFullError
+
+@pytest.fixture
+def queue():
+    q = JobQueue(max_workers=2, max_queued=1)
+    yield q
+    q.shutdown()
+
+def test_job_queue_runs_jobs(queue):
+    async def job():
+        await asyncio.sleep(0)
+        return "ok"
+
+    future = queue.submit(job)
+    assert future.result(timeout=5) == "ok"
+    assert queue.drain(timeout=5)
+    assert queue.pending == 0
+
+def test_job_queue_limits_concurrency_and_capacity(queue):
+    release = threading.Event()
+    running = []
+    peak = []
+
+    async def job():
+        running.append(1)
+        peak.append(len(running))
+        while not release.is_set():
+            await asyncio.sleep(0.01)
+        running.pop()
+
+    futures = [queue.submit(job) for _ in range(3)] # 2 running + 1 queued
+    with pytest.raises(QueueFullError):
+        queue.submit(job)
+
+    deadline = time.monotonic() + 5
+    while len(running) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert max(peak) == 2
+
+    # Capacity is released once jobs finish
+    queue.submit(job).result(timeout=5)
+
+def test_only_pool_workers_count_as_worker_processes():
+    import multiprocessing
+    from app.services.jobs import get_process_pool, in_worker_process, shutdown_process_pool
+    assert not in_worker_process()
+    # Other spawned children, e.g. uvicorn --workers processes, are not pool workers
+    with multiprocessing.get_context("spawn").Pool(1) as other:
+        assert other.apply(in_worker_process) is False
+    try:
+        assert get_process_pool().submit(in_worker_process).result(timeout=60) is True
+    finally:
+        shutdown_process_pool()
@@ -0,0 +1,30 @@
+import gzip
+import json
+from datetime import date
+from app.services import json_render
+from app.services.json_render import compress, negotiate, render_json
+
+def test_negotiate_format_and_encoding():
+    assert negotiate({}, {"accept": "text/html,*/*;q=0.8", "accept-encoding": "gzip"}) == ("pretty", None)
+    assert negotiate({"format": "compact"}, {"accept-encoding": "gzip, deflate"}) == ("compact", "gzip")
+    assert negotiate({}, {"accept": "application/json; format=compact"}) == ("compact", None)
+    # The query parameter wins over the Accept header
+    assert negotiate({"format": "pretty"}, {"accept": "application/json;format=compact"}) == ("pretty", None)
+    assert negotiate({"format": "compact"}, {"accept-encoding": "gzip;q=0"}) == ("compact", None)
+
+def test_render_json_compact_and_pretty():
+    payload = {"period": "2024-01", "total": 1.5, "skus": ["A", None]}
+    compact = render_json(payload, "compact")
+    assert b" " not in compact and b"\n" not in compact
+    assert json.loads(compact) == payload
+    assert render_json(payload, "pretty") == json.dumps(payload, indent=4).encode()
+
+    # Non-primitive values fall back to jsonable_encoder
+    assert json.loads(render_json({"day": date(2024, 1, 2)}, "compact")) == {"day": "2024-01-02"}
+
+def test_compress_skips_small_bodies(mocker):
+    mocker.patch.object(json_render, "COMPRESS_MIN_BYTES", 16)
+    assert compress(b"{}", "gzip") == (b"{}", None)
+    body, encoding = compress(b"[" + b"1," * 100 + b"1]", "gzip")
+    assert encoding == "gzip"
+    assert gzip.decompress(body) == b"[" + b"1," * 100 + b"1]"
@@ -2,8 +2,11 @@ from datetime import datetime
 from unittest.mock import MagicMock
 import pytest
 from fastapi.testclient import TestClient
-import requests
+import httpx
 from app.services.file_handler import file_storage
+from app.services.jobs import upload_queue, QueueFullError
+from app.services.storage import DiskStorage
+from app.services.response_cache import metrics_cache
 from main import app # Import your FastAPI app instance
 
 # Create a TestClient instance
@@ -29,57 +32,96 @@ MOCK_CSV_CONTENT_INVALID_DATA = """order_id,sku,item_price,item_tax,purchased_da
 2,SKU002,20.0,bad_tax,2024-01-02
 """
 
+# A later cumulative export: the rows above plus new ones
+MOCK_CSV_CONTENT_CUMULATIVE = MOCK_CSV_CONTENT_VALID + """4,SKU003,30.0,3.0,2024-02-02,item4
+5,SKU002,25.0,2.5,2024-03-01,item5
+"""
+
 MOCK_CSV_URL = "http://example.com/test_valid.csv"
+MOCK_CSV_URL_CUMULATIVE = "http://example.com/test_cumulative.csv"
 MOCK_CSV_URL_INVALID = "http://example.com/test_invalid.csv"
 MOCK_CSV_URL_404 = "http://example.com/not_found.csv"
 
 
-# Mock requests.get for file_handler's download_and_clean_csv
+# Mock the CSV host behind the pooled async download client
 @pytest.fixture(autouse=True)
-def mock_requests_get(mocker):
-    def mock_get_side_effect(url, *args, **kwargs):
+def mock_csv_host(mocker):
+    def handler(request):
+        url = str(request.url)
         if url == MOCK_CSV_URL:
-            # MockResponse expects content as a string, then encodes it
-            mock_response = MagicMock()
-            mock_response.status_code = 200
-            mock_response.content = MOCK_CSV_CONTENT_VALID.encode('utf-8')
-            mock_response.raise_for_status.return_value = None
-            return mock_response
+            return httpx.Response(200, content=MOCK_CSV_CONTENT_VALID.encode('utf-8'))
+        elif url == MOCK_CSV_URL_CUMULATIVE:
+            return httpx.Response(200, content=MOCK_CSV_CONTENT_CUMULATIVE.encode('utf-8'))
         elif url == MOCK_CSV_URL_INVALID:
-            mock_response = MagicMock()
-            mock_response.status_code = 200
-            mock_response.content = MOCK_CSV_CONTENT_INVALID_DATA.encode('utf-8')
-            mock_response.raise_for_status.return_value = None
-            return mock_response
+            return httpx.Response(200, content=MOCK_CSV_CONTENT_INVALID_DATA.encode('utf-8'))
         elif url == MOCK_CSV_URL_404:
-            mock_response = MagicMock()
-            mock_response.status_code = 404
-            mock_response.raise_for_status.side_effect = requests.exceptions.HTTPError("Not Found")
-            return mock_response
+            return httpx.Response(404, text="Not Found")
         else:
             # Fallback for unexpected URLs, can raise an error or return default
             raise ValueError(f"Unexpected URL: {url}")
 
-    mocker.patch('requests.get', side_effect=mock_get_side_effect)
+    mocker.patch(
+        'app.services.file_handler.get_async_client',
+        side_effect=lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
     # Ensure datetime.utcnow() is consistent for testing uploaded_at
     fixed_time = datetime(2025, 7, 2, 0, 0, 0, 0)
-    mocker.patch('datetime.utcnow', return_value=fixed_time)
+    mock_datetime = mocker.patch('app.services.file_handler.datetime')
+    mock_datetime.utcnow.return_value = fixed_time
+
+
+# Uploads are processed in the background; wait for the queue to empty
+def upload_and_wait(csv_url):
+    response = client.post("/upload", data={"csv_url": csv_url})
+    assert upload_queue.drain(timeout=10)
+    return response
 
 
 # --- Tests for /upload endpoint ---
 def test_upload_csv_url_success():
-    response = client.post("/upload", data={"csv_url": MOCK_CSV_URL})
-    assert response.status_code == 200
+    response = upload_and_wait(MOCK_CSV_URL)
+    assert response.status_code == 202
     assert "file_id" in response.json()
-    assert response.json()["message"] == "File processed successfully"
+    assert response.json()["message"] == "File accepted for processing"
     # Verify file_id is stored
     assert response.json()["file_id"] in file_storage
 
 def test_upload_csv_url_invalid_url():
-    response = client.post("/upload", data={"csv_url": MOCK_CSV_URL_404})
+    response = upload_and_wait(MOCK_CSV_URL_404)
+    assert response.status_code == 202
+    file_id = response.json()["file_id"]
+
+    stats = client.get(f"/api/v1/order-items/uploads/{file_id}/processing-stats").json()
+    assert stats["status"] == "failed"
+    assert "Error downloading file" in stats["error"]
+
+    metrics_response = client.get(f"/api/v1/order-items/uploads/{file_id}/metrics?groupby=month")
+    assert metrics_response.status_code == 400
+    assert "Error downloading file" in metrics_response.json()["detail"]
+
+def test_upload_csv_url_unsupported_scheme():
+    response = client.post("/upload", data={"csv_url": "ftp://example.com/data.csv"})
     assert response.status_code == 400
-    assert "detail" in response.json()
-    assert "Error downloading file" in response.json()["detail"]
+    assert not file_storage
+
+def test_upload_reports_processing_state(mocker):
+    # Hold the job so its intermediate state can be observed
+    mocker.patch.object(upload_queue, 'submit')
+    response = upload_and_wait(MOCK_CSV_URL)
+    file_id = response.json()["file_id"]
+
+    stats = client.get(f"/api/v1/order-items/uploads/{file_id}/processing-stats").json()
+    assert stats == {"status": "queued"}
+
+    metrics_response = client.get(f"/api/v1/order-items/uploads/{file_id}/metrics?groupby=month")
+    assert metrics_response.status_code == 409
+    assert metrics_response.json()["detail"] == "File is still being processed."
+
+def test_upload_queue_full_returns_503(mocker):
+    mocker.patch.object(upload_queue, 'submit', side_effect=QueueFullError("Upload queue is full, retry later."))
+    response = client.post("/upload", data={"csv_url": MOCK_CSV_URL})
+    assert response.status_code == 503
+    assert not file_storage
 
 def test_upload_csv_url_empty_url():
     response = client.post("/upload", data={"csv_url": ""})
@@ -89,7 +131,7 @@ def test_upload_csv_url_empty_url():
 # --- Tests for /api/v1/order-items/uploads/{file_id}/processing-stats endpoint ---
 def test_get_processing_stats_success():
     # First, upload a file to get a file_id
-    upload_response = client.post("/upload", data={"csv_url": MOCK_CSV_URL})
+    upload_response = upload_and_wait(MOCK_CSV_URL)
     file_id = upload_response.json()["file_id"]
 
     response = client.get(f"/api/v1/order-items/uploads/{file_id}/processing-stats")
@@ -120,7 +162,7 @@ def test_get_processing_stats_non_existent_file_id():
 # --- Tests for /api/v1/order-items/uploads/{file_id}/metrics endpoint ---
 def test_get_metrics_groupby_month_success():
     # First, upload a file
-    upload_response = client.post("/upload", data={"csv_url": MOCK_CSV_URL})
+    upload_response = upload_and_wait(MOCK_CSV_URL)
     file_id = upload_response.json()["file_id"]
 
     response = client.get(f"/api/v1/order-items/uploads/{file_id}/metrics?groupby=month")
@@ -143,7 +185,7 @@ def test_get_metrics_groupby_month_success():
     
 def test_get_metrics_groupby_year_success():
     # First, upload a file
-    upload_response = client.post("/upload", data={"csv_url": MOCK_CSV_URL})
+    upload_response = upload_and_wait(MOCK_CSV_URL)
     file_id = upload_response.json()["file_id"]
 
     response = client.get(f"/api/v1/order-items/uploads/{file_id}/metrics?groupby=year")
@@ -156,7 +198,7 @@ def test_get_metrics_groupby_year_success():
 
 def test_get_metrics_invalid_groupby():
     # First, upload a file
-    upload_response = client.post("/upload", data={"csv_url": MOCK_CSV_URL})
+    upload_response = upload_and_wait(MOCK_CSV_URL)
     file_id = upload_response.json()["file_id"]
 
     response = client.get(f"/api/v1/order-items/uploads/{file_id}/metrics?groupby=invalid")
@@ -175,7 +217,7 @@ def test_get_metrics_invalid_file_id_format():
 
 def test_get_metrics_on_file_with_malformed_content():
     # Test that generate_metrics still runs on the DF, even if it had content malformed rows
-    upload_response = client.post("/upload", data={"csv_url": MOCK_CSV_URL_INVALID})
+    upload_response = upload_and_wait(MOCK_CSV_URL_INVALID)
     file_id = upload_response.json()["file_id"]
 
     # The processing-stats for this should show malformed rows
@@ -194,4 +236,280 @@ def test_get_metrics_on_file_with_malformed_content():
     assert abs(metrics_data["grand_totals"]["grand_total"] - 0.0) < 0.01
     assert metrics_data["metrics"][0]["period"] == "2024-01"
     assert metrics_data["metrics"][0]["total_orders"] == 2
-    assert abs(metrics_data["metrics"][0]["gross_sales"] - 0.0) < 0.01
\ No newline at end of file
+    assert abs(metrics_data["metrics"][0]["gross_sales"] - 0.0) < 0.01
+
+def test_evicted_file_id_reports_expired():
+    upload_response = upload_and_wait(MOCK_CSV_URL)
+    file_id = upload_response.json()["file_id"]
+    file_storage._evict(file_id, "ttl")
+
+    response = client.get(f"/api/v1/order-items/uploads/{file_id}/processing-stats")
+    assert response.status_code == 410
+    assert response.json()["detail"] == "File ID has expired."
+
+    response = client.get(f"/api/v1/order-items/uploads/{file_id}/metrics?groupby=month")
+    assert response.status_code == 410
+
+def test_upload_and_metrics_with_disk_storage(tmp_path, mocker):
+    disk_storage = DiskStorage(root=str(tmp_path), ttl_seconds=0)
+    mocker.patch('main.file_storage', disk_storage)
+    mocker.patch('app.services.file_handler.file_storage', disk_storage)
+
+    file_id = upload_and_wait(MOCK_CSV_URL).json()["file_id"]
+    # A second instance stands in for another worker process
+    mocker.patch('main.file_storage', DiskStorage(root=str(tmp_path), ttl_seconds=0))
+
+    stats = client.get(f"/api/v1/order-items/uploads/{file_id}/processing-stats").json()
+    assert stats["status"] == "done"
+    assert stats["rows"]["total"] == 4
+    response = client.get(f"/api/v1/order-items/uploads/{file_id}/metrics?groupby=year")
+    assert response.status_code == 200
+    assert len(response.json()["metrics"]) == 1
+
+def test_get_metrics_cached_with_conditional_get(mocker):
+    file_id = upload_and_wait(MOCK_CSV_URL).json()["file_id"]
+    url = f"/api/v1/order-items/uploads/{file_id}/metrics?groupby=month"
+
+    first = client.get(url)
+    assert first.status_code == 200
+    assert first.headers["last-modified"] == "Wed, 02 Jul 2025 00:00:00 GMT"
+    etag = first.headers["etag"]
+    assert client.get(url.replace("month", "year"), headers={"If-None-Match": etag}).status_code == 200
+
+    # Served from the byte cache: nothing is recomputed
+    compute = mocker.patch('main.metrics_from_aggregates')
+    second = client.get(url)
+    assert second.content == first.content
+    assert second.headers["etag"] == etag
+    compute.assert_not_called()
+
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(url, headers={"If-Modified-Since": first.headers["last-modified"]}).status_code == 304
+
+def test_get_metrics_conditional_request_validates_params_first():
+    file_id = upload_and_wait(MOCK_CSV_URL).json()["file_id"]
+    url = f"/api/v1/order-items/uploads/{file_id}/metrics?groupby=month"
+    first = client.get(url)
+    since = {"If-Modified-Since": first.headers["last-modified"]}
+
+    assert client.get(url.replace("month", "week"), headers=since).status_code == 400
+    assert client.get(url + "&from=2024-03-01&to=2024-01-01", headers=since).status_code == 400
+    not_modified = client.get(url, headers=since)
+    assert not_modified.status_code == 304
+    assert not_modified.headers["vary"] == first.headers["vary"] == "Accept, Accept-Encoding"
+
+def test_evicted_file_id_drops_cached_metrics():
+    file_id = upload_and_wait(MOCK_CSV_URL).json()["file_id"]
+    client.get(f"/api/v1/order-items/uploads/{file_id}/metrics?groupby=month")
+    assert metrics_cache.stats()["entries"] >= 1
+
+    file_storage._evict(file_id, "ttl")
+    assert not any(key[0] == file_id for key in metrics_cache._bodies)
+
+def test_get_metrics_compact_and_gzip(mocker):
+    mocker.patch('app.services.json_render.COMPRESS_MIN_BYTES', 0)
+    file_id = upload_and_wait(MOCK_CSV_URL).json()["file_id"]
+    url = f"/api/v1/order-items/uploads/{file_id}/metrics?groupby=month"
+    pretty = client.get(url)
+
+    for _ in range(2): # Rendered, then served from the cache
+        compact = client.get(url + "&format=compact", headers={"Accept-Encoding": "gzip"})
+        assert compact.status_code == 200
+        assert compact.headers["content-encoding"] == "gzip"
+        assert compact.headers["etag"] != pretty.headers["etag"]
+        assert compact.json() == pretty.json()
+        assert b"\n" not in compact.content
+
+def test_metrics_endpoint_exposes_route_latency_and_ingest_counters():
+    file_id = upload_and_wait(MOCK_CSV_URL).json()["file_id"]
+    client.get(f"/api/v1/order-items/uploads/{file_id}/metrics?groupby=month")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    route = "/api/v1/order-items/uploads/{file_id}/metrics"
+    assert f'http_request_duration_seconds_count{{method="GET",route="{route}"}}' in text
+    assert f'http_requests_total{{method="POST",route="/upload",status="202"}}' in text
+    assert 'http_response_size_bytes_bucket{le="+Inf",method="GET",route="%s"}' % route in text
+    assert 'ingest_files_total{status="done"}' in text
+    assert "file_storage_entries 1.0" in text
+
+def test_metrics_endpoint_counts_response_cache_lookups():
+    from app.services import telemetry
+    file_id = upload_and_wait(MOCK_CSV_URL).json()["file_id"]
+    def lookups(result):
+        return telemetry.registry.get_sample_value("metrics_response_cache_lookups_total", {"result": result}) or 0
+
+    hits, misses = lookups("hit"), lookups("miss")
+    for _ in range(3): # Rendered, then served from the cache
+        client.get(f"/api/v1/order-items/uploads/{file_id}/metrics?groupby=year")
+
+    assert lookups("miss") == misses + 1
+    assert lookups("hit") == hits + 2
+    text = client.get("/metrics").text
+    assert "# TYPE metrics_response_cache_lookups_total counter" in text
+    assert "# TYPE file_storage_evictions_total counter" in text
+
+# --- Tests for /upload/file (direct upload) ---
+def test_upload_file_raw_body():
+    response = client.post("/upload/file", content=MOCK_CSV_CONTENT_VALID.encode("utf-8"),
+                           headers={"Content-Type": "text/csv; charset=utf-8"})
+    assert response.status_code == 201
+    body = response.json()
+    assert body["status"] == "done"
+    assert body["rows"]["total"] == 4
+    assert body["rows"]["sanitised"] == 4
+
+    stats = client.get(f"/api/v1/order-items/uploads/{body['file_id']}/processing-stats").json()
+    assert stats["rows"] == body["rows"]
+    metrics = client.get(f"/api/v1/order-items/uploads/{body['file_id']}/metrics?groupby=year")
+    assert metrics.status_code == 200
+
+def test_upload_file_multipart():
+    response = client.post("/upload/file", data={"note": "nightly"},
+                           files={"file": ("orders.csv", MOCK_CSV_CONTENT_VALID.encode("utf-8"), "text/csv")})
+    assert response.status_code == 201
+    assert response.json()["rows"]["total"] == 4
+    assert response.json()["file_id"] in file_storage
+
+def test_upload_file_multipart_without_file_field():
+    response = client.post("/upload/file", files={"other": ("orders.csv", b"a,b\n1,2\n", "text/csv")})
+    assert response.status_code == 400
+    assert "'file'" in response.json()["detail"]
+    assert not file_storage
+
+# --- Tests for /upload/batch ---
+def test_upload_batch_processes_each_url(mocker):
+    from concurrent.futures import ThreadPoolExecutor
+    from app.services.file_handler import batch_storage
+
+    class BodyResponse:
+        def __init__(self, body):
+            self.body, self.headers = body, {"content-type": "text/csv"}
+        def raise_for_status(self):
+            pass
+        def iter_content(self, chunk_size):
+            yield self.body
+        def close(self):
+            pass
+
+    def fake_get(url, **kwargs):
+        if url == MOCK_CSV_URL_404:
+            raise requests.HTTPError("404 Not Found")
+        return BodyResponse({MOCK_CSV_URL: MOCK_CSV_CONTENT_VALID, MOCK_CSV_URL_INVALID: MOCK_CSV_CONTENT_INVALID_DATA}[url].encode())
+
+    import requests
+    mocker.patch('app.services.file_handler.requests.get', side_effect=fake_get)
+    with ThreadPoolExecutor(2) as pool: # Stands in for the process pool
+        mocker.patch('app.services.file_handler.get_process_pool', return_value=pool)
+        response = client.post("/upload/batch", data={"csv_url": [MOCK_CSV_URL, MOCK_CSV_URL_INVALID, MOCK_CSV_URL_404]})
+        assert upload_queue.drain(timeout=10)
+    assert response.status_code == 202
+    body = response.json()
+    assert len(body["file_ids"]) == 3
+
+    stats = client.get(f"/api/v1/order-items/batches/{body['batch_id']}/processing-stats").json()
+    assert stats["status"] == "done"
+    assert [f["status"] for f in stats["files"]] == ["done", "done", "failed"]
+    assert "Error downloading file" in stats["files"][2]["error"]
+    assert stats["rows"]["total"] == 4 + 2
+    assert stats["rows"]["malformed"] == 2
+    assert stats["durations"]["total_seconds"] > 0
+
+    metrics = client.get(f"/api/v1/order-items/uploads/{body['file_ids'][0]}/metrics?groupby=year")
+    assert metrics.status_code == 200
+    batch_storage.clear()
+
+def test_upload_batch_rejects_invalid_url():
+    response = client.post("/upload/batch", data={"csv_url": [MOCK_CSV_URL, "ftp://example.com/a.csv"]})
+    assert response.status_code == 400
+    assert not file_storage
+
+def test_upload_append_adds_only_new_rows():
+    file_id = upload_and_wait(MOCK_CSV_URL).json()["file_id"]
+    before = client.get(f"/api/v1/order-items/uploads/{file_id}/metrics?groupby=month").json()
+
+    response = client.post("/upload", data={"csv_url": MOCK_CSV_URL_CUMULATIVE, "file_id": file_id})
+    assert upload_queue.drain(timeout=10)
+    assert response.status_code == 202
+    assert response.json() == {"message": "File accepted for appending", "file_id": file_id, "status": "queued"}
+
+    stats = client.get(f"/api/v1/order-items/uploads/{file_id}/processing-stats").json()
+    assert stats["appends"] == 1
+    assert stats["last_append"]["status"] == "done"
+    assert stats["last_append"]["added"] == 2
+    assert stats["last_append"]["rows"]["total"] == 6
+    assert stats["last_append"]["rows"]["duplicated"] == 4 # Already stored, or repeated
+    assert stats["rows"]["total"] == 6 # Stored rows only, not those sent again
+    assert stats["rows"]["sanitised"] == len(file_storage[file_id]["data"])
+    assert len(file_storage[file_id]["data"]) == 6
+
+    # Same metrics as uploading the cumulative file at once, minus the duplicate stored the first time
+    after = client.get(f"/api/v1/order-items/uploads/{file_id}/metrics?groupby=month").json()
+    assert after["end_date"] == "2024-03-01"
+    assert after["grand_totals"]["total_orders"] == before["grand_totals"]["total_orders"] + 2
+    assert len(after["metrics"]) == 3
+
+def test_upload_append_to_unknown_or_unprocessed_file(mocker):
+    response = client.post("/upload", data={"csv_url": MOCK_CSV_URL, "file_id": "00000000-missing"})
+    assert response.status_code == 404
+
+    mocker.patch.object(upload_queue, 'submit')
+    file_id = client.post("/upload", data={"csv_url": MOCK_CSV_URL}).json()["file_id"]
+    response = client.post("/upload", data={"csv_url": MOCK_CSV_URL, "file_id": file_id})
+    assert response.status_code == 409
+
+def test_upload_append_without_new_rows_keeps_etag():
+    file_id = upload_and_wait(MOCK_CSV_URL).json()["file_id"]
+    url = f"/api/v1/order-items/uploads/{file_id}/metrics?groupby=month"
+    first = client.get(url)
+
+    client.post("/upload", data={"csv_url": MOCK_CSV_URL, "file_id": file_id})
+    assert upload_queue.drain(timeout=10)
+    stats = client.get(f"/api/v1/order-items/uploads/{file_id}/processing-stats").json()
+    assert stats["last_append"]["added"] == 0
+    assert stats["uploaded_at"] == first.json()["uploaded_at"]
+
+    response = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+    assert response.status_code == 304
+
+def test_upload_append_failure_keeps_stored_data():
+    file_id = upload_and_wait(MOCK_CSV_URL).json()["file_id"]
+    client.post("/upload", data={"csv_url": MOCK_CSV_URL_404, "file_id": file_id})
+    assert upload_queue.drain(timeout=10)
+
+    stats = client.get(f"/api/v1/order-items/uploads/{file_id}/processing-stats").json()
+    assert stats["status"] == "done"
+    assert stats["rows"]["total"] == 4
+    assert stats["last_append"]["status"] == "failed"
+    assert "Error downloading file" in stats["last_append"]["error"]
+
+def test_get_metrics_date_range():
+    file_id = upload_and_wait(MOCK_CSV_URL).json()["file_id"]
+    url = f"/api/v1/order-items/uploads/{file_id}/metrics?groupby=month"
+
+    response = client.get(url + "&from=2024-01-02&to=2024-02-29")
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["start_date"], body["end_date"]) == ("2024-01-02", "2024-02-01")
+    assert body["grand_totals"]["total_orders"] == 2
+    assert [m["period"] for m in body["metrics"]] == ["2024-01", "2024-02"]
+    # Each range is cached (and tagged) on its own
+    assert response.headers["ETag"] != client.get(url).headers["ETag"]
+    assert client.get(url + "&from=2024-02-01").json()["grand_totals"]["total_orders"] == 1
+
+    assert client.get(url + "&from=2024-03-01&to=2024-01-01").status_code == 400
+    assert client.get(url + "&from=March").status_code == 422
+
+def test_upload_and_metrics_without_sku_column(mocker):
+    csv_without_sku = "order_id,item_price,item_tax,purchased_date\n1,10.0,1.0,2024-01-01\n2,20.0,2.0,2024-02-01\n"
+    response = client.post("/upload/file", content=csv_without_sku.encode("utf-8"), headers={"Content-Type": "text/csv"})
+    assert response.status_code == 201
+    file_id = response.json()["file_id"]
+    assert client.get(f"/api/v1/order-items/uploads/{file_id}/processing-stats").json()["status"] == "done"
+
+    metrics = client.get(f"/api/v1/order-items/uploads/{file_id}/metrics?groupby=month").json()
+    assert metrics["grand_totals"]["total_orders"] == 2
+    assert metrics["grand_totals"]["most_popular_product_sku"] is None
+    assert [m["period"] for m in metrics["metrics"]] == ["2024-01", "2024-02"]
@@ -1,6 +1,7 @@
 import pytest
 import pandas as pd
-from app.services.metrics_calculator import generate_metrics, sanitize_columns
+from app.services.metrics_calculator import generate_metrics, sanitize_columns, build_typed_frame
+from app.services.metrics_calculator import build_daily_aggregates, metrics_from_aggregates
 
 # Fixture for a sample DataFrame
 @pytest.fixture
@@ -144,4 +145,105 @@ def test_generate_metrics_with_non_numeric_prices(sample_dataframe):
 
     assert abs(grand_totals["gross_sales"] - expected_gross_sales_calculated) < 0.01
     assert abs(grand_totals["net_sales"] - expected_net_sales_calculated) < 0.01
-    assert abs(grand_totals["grand_total"] - expected_grand_total_calculated) < 0.01
\ No newline at end of file
+    assert abs(grand_totals["grand_total"] - expected_grand_total_calculated) < 0.01
+# Test the frame typed at ingest
+def test_build_typed_frame_dtypes(sample_dataframe):
+    raw = sample_dataframe.astype(str) # As parsed from CSV
+    typed = build_typed_frame(raw)
+
+    assert typed["item_price"].dtype == "float64"
+    assert typed["item_tax"].dtype == "float64"
+    assert typed["item_discount"].dtype == "float64"
+    assert pd.api.types.is_datetime64_any_dtype(typed["purchased_date"])
+    assert isinstance(typed["sku"].dtype, pd.CategoricalDtype)
+    assert isinstance(typed["order_id"].dtype, pd.CategoricalDtype)
+    assert list(typed["sku"].cat.categories[:3]) == ["SKU001", "SKU002", "SKU003"] # First appearance order
+
+@pytest.mark.parametrize("groupby", ["month", "year"])
+def test_generate_metrics_typed_frame_matches_raw(sample_dataframe, groupby):
+    raw = sample_dataframe.astype(str)
+    raw.loc[3, "purchased_date"] = "not a date" # Dropped rows leave unused categories behind
+    raw.loc[4, "item_price"] = "abc"
+
+    expected = generate_metrics(raw.copy(), groupby)
+    result = generate_metrics(build_typed_frame(raw), groupby)
+    assert result == expected
+
+# Test the per-day aggregate cube
+def _approx_metrics(result):
+    grand_totals, metrics, start_date, end_date = result
+    approx = lambda d: {k: pytest.approx(v) if isinstance(v, float) else v for k, v in d.items()}
+    return approx(grand_totals), [approx(m) for m in metrics], start_date, end_date
+
+@pytest.mark.parametrize("groupby", ["month", "year"])
+def test_metrics_from_aggregates_matches_generate_metrics(sample_dataframe, groupby):
+    raw = sample_dataframe.astype(str)
+    raw.loc[3, "purchased_date"] = "not a date"
+    raw.loc[9, "purchased_date"] = "2024-05-01" # Two orders on one day
+    raw.loc[6, "sku"] = "SKU006" # Ties within a period and overall
+
+    expected = generate_metrics(raw.copy(), groupby)
+    daily, daily_skus = build_daily_aggregates(build_typed_frame(raw))
+    assert len(daily) == 8
+    assert metrics_from_aggregates(daily, daily_skus, groupby) == _approx_metrics(expected)
+
+@pytest.mark.parametrize("start,end", [
+    ("2024-02-01", "2024-03-31"), ("2024-02-02", "2024-03-09"), (None, "2024-01-20"),
+    ("2024-05-01", None), ("2023-01-01", "2023-12-31"), ("2024-03-10", "2024-03-10"),
+])
+def test_metrics_from_aggregates_date_range_matches_filtered_rows(sample_dataframe, start, end):
+    from datetime import date
+    start = date.fromisoformat(start) if start else None
+    end = date.fromisoformat(end) if end else None
+    dates = pd.to_datetime(sample_dataframe["purchased_date"])
+    in_range = (dates >= pd.Timestamp(start or date.min)) & (dates <= pd.Timestamp(end or "2262-01-01"))
+
+    expected = generate_metrics(sample_dataframe[in_range].reset_index(drop=True), "month")
+    assert generate_metrics(sample_dataframe, "month", start, end) == expected
+    daily, daily_skus = build_daily_aggregates(build_typed_frame(sample_dataframe))
+    assert metrics_from_aggregates(daily, daily_skus, "month", start, end) == _approx_metrics(expected)
+
+def test_build_daily_aggregates_without_dates(sample_dataframe):
+    assert build_daily_aggregates(sample_dataframe.drop(columns=["purchased_date"])) == (None, None)
+
+def test_metrics_from_aggregates_empty_and_invalid(empty_dataframe):
+    daily, daily_skus = build_daily_aggregates(build_typed_frame(empty_dataframe))
+    grand_totals, metrics, start_date, end_date = metrics_from_aggregates(daily, daily_skus, "month")
+    assert grand_totals["total_orders"] == 0
+    assert grand_totals["most_popular_product_sku"] is None
+    assert metrics == []
+    assert start_date is None and end_date is None
+    with pytest.raises(ValueError, match="Invalid groupby value"):
+        metrics_from_aggregates(daily, daily_skus, "week")
+
+# Test per-period SKU picks against a per-slice reference over many periods
+def test_generate_metrics_period_skus_match_per_slice_reference():
+    n = 600
+    df = pd.DataFrame({
+        "order_id": [f"ord{i}" for i in range(n)],
+        "sku": [f"SKU{(i * 7) % 11:03d}" for i in range(n)],
+        "item_price": [float(i % 13) for i in range(n)],
+        "purchased_date": [f"{2020 + (i % 36) // 12}-{(i % 12) + 1:02d}-{(i % 28) + 1:02d}" for i in range(n)],
+    })
+    _, metrics, _, _ = generate_metrics(df.copy(), "month")
+    assert len(metrics) == 36
+
+    period = pd.to_datetime(df["purchased_date"]).dt.to_period("M").astype(str)
+    for entry in metrics:
+        counts = df.loc[period == entry["period"], "sku"].value_counts(sort=False)
+        counts = counts.reindex(pd.unique(df.loc[period == entry["period"], "sku"]))
+        counts = counts.sort_values(ascending=False, kind="stable")
+        assert entry["most_popular_product_sku"] == counts.idxmax()
+        assert entry["least_popular_product_sku"] == counts.idxmin()
+
+# Test that the stored frame is only read
+def test_generate_metrics_does_not_mutate_input(sample_dataframe):
+    raw = sample_dataframe.astype(str).rename(columns={"item_price": "Item Price"})
+    typed = build_typed_frame(raw)
+    raw_before, typed_before = raw.copy(), typed.copy()
+
+    generate_metrics(raw, "month")
+    generate_metrics(typed, "year")
+    build_daily_aggregates(typed)
+    pd.testing.assert_frame_equal(raw, raw_before)
+    pd.testing.assert_frame_equal(typed, typed_before)
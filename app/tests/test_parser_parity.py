@@ -0,0 +1,204 @@
+import pytest
+import pandas as pd
+from app.services.csv_parser import ParseCounts, PartitionStream, TextStream, find_record_boundary, iter_batches
+from app.services.file_handler import _perform_detailed_analysis
+
+# Inputs from test_file_handler.py plus edge cases the two engines must agree on
+PARITY_FIXTURES = {
+    "empty": "",
+    "only_header": "col1,col2,col3",
+    "valid_data": """order_id,sku,item_price,item_tax,colX
+1,A1,10.0,1.0,data1
+2,B2,20.0,2.0,data2
+3,C3,30.0,3.0,data3""",
+    "blank_rows": """order_id,sku,item_price,item_tax
+1,A1,10.0,1.0
+,,,-
+2,B2,20.0,2.0
+,,,
+3,C3,30.0,3.0""",
+    "structural_malformed": """order_id,sku,item_price,item_tax
+1,A1,10.0,1.0
+2,B2,20.0
+3,C3,30.0,3.0,extra
+4,D4,40.0,4.0""",
+    "content_malformed": """order_id,sku,item_price,item_tax
+1,A1,10.0,1.0
+2,B2,invalid_sku,bad_price,2.0 # Malformed sku, bad_price
+3,C3,30.0,3.0
+4,,40.0,4.0 # Blank order_id
+5,E5,50.0,invalid_tax # Malformed item_tax
+""",
+    "duplicates": """order_id,sku,item_price,item_tax,order_item_id
+1,A1,10.0,1.0,item1
+2,B2,20.0,2.0,item2
+1,A1,10.0,1.0,item1 # Duplicate of item1
+3,C3,30.0,3.0,item3
+2,B2,20.0,2.0,item2 # Duplicate of item2
+""",
+    "duplicates_without_order_item_id": """order_id,sku,item_price,item_tax
+1,A1,10.0,1.0
+2,B2,20.0,2.0
+1,A1,10.0,1.0 # Duplicate based on order_id+sku
+3,C3,30.0,3.0
+2,B2,20.0,2.0 # Duplicate based on order_id+sku
+""",
+    "mixed_issues": """order_id,sku,item_price,item_tax,order_item_id
+1,A1,10.0,1.0,item1
+,,,,, # Blank
+2,B2,invalid_price,2.0,item2 # Content malformed
+1,A1,10.0,1.0,item1 # Duplicate
+3,C3,30.0 # Structural malformed
+4,D4,40.0,4.0,item4
+""",
+    "empty_and_whitespace_lines": "order_id,sku,item_price,item_tax\n\n1,A1,10.0,1.0\n   \n\t,  ,,\n2,B2,20.0,2.0\n\n",
+    "crlf_and_quotes": 'order_id,sku,item_price,item_tax\r\n1,"A,1",10.0,1.0\r\n2,"B ""quoted""",20.0,2.0\r\n',
+    "quoted_newlines": 'order_id,sku,item_price,item_tax\n1,"A\nB",10.0,1.0\n2,"C\r\nD",20.0,2.0\n3,C3,30.0\n',
+    "non_ascii": "order_id,sku,item_price,item_tax\n1,Ünï,10.0,1.0\n2,B2,€20,2.0\n",
+    "single_column": "order_id\n1\n\n2\n \n",
+    "duplicate_header_names": "order_id,sku,,sku,item_price\n1,A1,x,y,10.0\n",
+}
+
+@pytest.mark.parametrize("name", sorted(PARITY_FIXTURES))
+def test_arrow_engine_matches_python_engine(name):
+    raw_text = PARITY_FIXTURES[name]
+    expected_summary, expected_df = _perform_detailed_analysis(raw_text, engine="python")
+    summary, df = _perform_detailed_analysis(raw_text, engine="arrow")
+
+    assert summary == expected_summary
+    pd.testing.assert_frame_equal(df.reset_index(drop=True), expected_df.reset_index(drop=True))
+
+def test_arrow_engine_matches_python_engine_across_blocks(mocker):
+    mocker.patch('app.services.csv_parser.ARROW_BLOCK_BYTES', 256)
+    lines = ["order_id,sku,item_price,item_tax,order_item_id"]
+    for i in range(500):
+        if i % 37 == 0:
+            lines.append("")
+        elif i % 41 == 0:
+            lines.append(f"{i},S{i % 7},1.0")
+        elif i % 43 == 0:
+            lines.append(f'{i},"S\n{i % 7}",x,1.0,item{i}')
+        else:
+            lines.append(f"{i},S{i % 7},{i}.5,1.0,item{i % 450}")
+    raw_text = "\n".join(lines)
+
+    expected_summary, expected_df = _perform_detailed_analysis(raw_text, engine="python", chunksize=64)
+    summary, df = _perform_detailed_analysis(raw_text, engine="arrow")
+    assert summary == expected_summary
+    pd.testing.assert_frame_equal(df, expected_df)
+
+@pytest.mark.parametrize("engine", ["python", "arrow"])
+def test_batches_hold_at_most_chunksize_rows(engine):
+    text = "".join(f"{i},S{i}\n" for i in range(250))
+    batches = list(iter_batches(TextStream([text]), ["order_id", "sku"], chunksize=64, counts=ParseCounts(),
+                                engine=engine))
+    assert [len(batch) for batch in batches] == [64, 64, 64, 58]
+    assert pd.concat(batches)["order_id"].tolist() == [str(i) for i in range(250)]
+
+def test_find_record_boundary():
+    assert find_record_boundary(b'a,b\nc,d') == 4
+    assert find_record_boundary(b'a,b,c') == 0
+    # A lone "\r" ends a record too, once the next byte shows it is not half of "\r\n"
+    assert find_record_boundary(b'a,b\rc,d') == 4
+    assert find_record_boundary(b'a,b\rc,d\r\n') == 9
+    assert find_record_boundary(b'a,b\r') == 0
+    # Newlines inside quoted fields do not end a record
+    assert find_record_boundary(b'1,"x\ny"\n2,"z\n') == 8
+    assert find_record_boundary(b'1,"x ""q"" y"\n2,"a\nb') == 14
+    # A quote inside an unquoted field: the boundary cannot be placed without parsing
+    assert find_record_boundary(b'1,5" pipe\n2,x\n') is None
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n", "\r"])
+def test_partition_stream_ends_on_record_boundaries(newline):
+    text = f'a,"b{newline}c"{newline}' * 20
+    blocks = list(PartitionStream([text[i:i + 7] for i in range(0, len(text), 7)], size=20))
+    assert len(blocks) > 1
+    assert b''.join(blocks) == text.encode()
+    assert all(block.endswith(f'"{newline}'.encode()) for block in blocks)
+
+def test_partition_stream_scans_each_byte_about_once(monkeypatch):
+    import app.services.csv_parser as csv_parser
+    scanned, record_ends = [0], csv_parser._record_ends
+
+    def counting_record_ends(data, start, stop, odd, delimiter):
+        scanned[0] += stop - start # A spy would keep `data`, a view of the buffer, alive
+        return record_ends(data, start, stop, odd, delimiter)
+
+    monkeypatch.setattr(csv_parser, '_record_ends', counting_record_ends)
+    text = "".join(f"{i},S{i}\r" for i in range(20_000))
+    blocks = list(PartitionStream([text[i:i + 100] for i in range(0, len(text), 100)], size=4096))
+    assert b''.join(blocks) == text.encode()
+    assert len(blocks) > 30
+    assert scanned[0] <= 2 * len(text)
+
+def test_partition_stream_hands_back_what_it_cannot_cut():
+    head = "1,A1\n" * 10
+    tail = '2,5" pipe\n' + "3,C3\n" * 10
+    stream = PartitionStream([head, tail[:20], tail[20:]], size=16)
+    blocks = list(stream)
+    rest = "".join(stream.rest())
+    assert len(blocks) > 1
+    assert b''.join(blocks).decode() + rest == head + tail
+    assert rest.endswith(tail) and len(rest) - len(tail) < 16
+
+@pytest.mark.parametrize("name", sorted(PARITY_FIXTURES) + ["stray_quotes"])
+@pytest.mark.parametrize("engine", ["arrow", "python"])
+def test_partitioned_parsing_matches_serial(mocker, name, engine):
+    from concurrent.futures import ThreadPoolExecutor
+    raw_text = PARITY_FIXTURES.get(name, 'order_id,sku,item_price,item_tax\n1,5" pipe,1.0,1.0\n2,B2,2.0,2.0\n' * 3)
+    mocker.patch('app.services.file_handler.CSV_PARTITION_BYTES', 0)
+    expected_summary, expected_df = _perform_detailed_analysis(raw_text, engine=engine)
+
+    mocker.patch('app.services.file_handler.CSV_PARTITION_BYTES', 16)
+    mocker.patch('app.services.file_handler.WORKER_PROCESSES', 2)
+    with ThreadPoolExecutor(2) as pool: # Stands in for the process pool
+        submit = mocker.spy(pool, 'submit')
+        mocker.patch('app.services.file_handler.get_process_pool', return_value=pool)
+        summary, df = _perform_detailed_analysis(raw_text, engine=engine)
+
+    assert summary == expected_summary
+    pd.testing.assert_frame_equal(df, expected_df)
+    if name == "mixed_issues":
+        assert submit.call_count > 1 # Duplicates and malformed rows spread over partitions
+
+@pytest.mark.parametrize("newline", ["\r", "\n"])
+@pytest.mark.parametrize("stray_quote", [False, True])
+def test_partitioned_parsing_of_large_input(mocker, newline, stray_quote):
+    from concurrent.futures import ThreadPoolExecutor
+    lines = ["order_id,sku,item_price,item_tax"] + [f"{i},S{i % 7},{i}.5,1.0" for i in range(2000)]
+    if stray_quote:
+        lines[1500] = '1500,5" pipe,1.0,1.0'
+    raw_text = newline.join(lines)
+    mocker.patch('app.services.file_handler.CSV_PARTITION_BYTES', 0)
+    expected_summary, expected_df = _perform_detailed_analysis(raw_text)
+
+    mocker.patch('app.services.file_handler.CSV_PARTITION_BYTES', 2048)
+    mocker.patch('app.services.file_handler.WORKER_PROCESSES', 2)
+    with ThreadPoolExecutor(2) as pool:
+        submit = mocker.spy(pool, 'submit')
+        mocker.patch('app.services.file_handler.get_process_pool', return_value=pool)
+        summary, df = _perform_detailed_analysis(raw_text)
+
+    assert summary == expected_summary
+    pd.testing.assert_frame_equal(df, expected_df)
+    # Partitions up to the stray quote; the rest is streamed, not sent to a worker as one block
+    blocks = [call.args[1] for call in submit.call_args_list]
+    assert len(blocks) > 10
+    assert max(len(block) for block in blocks) <= 2048
+    assert (b'5" pipe' in b''.join(blocks)) is False
+
+def test_partitioned_parsing_counts_duplicates_across_partitions(mocker):
+    from concurrent.futures import ThreadPoolExecutor
+    lines = ["order_id,sku,item_price,item_tax,order_item_id"]
+    lines += [f'{i},"S\n{i % 7}",{i}.5,1.0,item{i % 150}' for i in range(300)]
+    raw_text = "\n".join(lines)
+
+    mocker.patch('app.services.file_handler.CSV_PARTITION_BYTES', 512)
+    mocker.patch('app.services.file_handler.WORKER_PROCESSES', 2)
+    with ThreadPoolExecutor(2) as pool:
+        mocker.patch('app.services.file_handler.get_process_pool', return_value=pool)
+        summary, df = _perform_detailed_analysis(raw_text)
+
+    assert summary["rows"]["duplicated"] == 150
+    assert summary["rows"]["usable"] == 150
+    assert df["order_id"].tolist() == [str(i) for i in range(300)]
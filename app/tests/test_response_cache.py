@@ -0,0 +1,27 @@
+from app.services.response_cache import ResponseCache, http_date, is_not_modified, make_etag
+
+def test_response_cache_lru_budget_and_invalidate():
+    cache = ResponseCache(max_bytes=10)
+    cache.put(("a", "r1", "month"), b"12345")
+    cache.put(("b", "r1", "month"), b"12345")
+    assert cache.get(("a", "r1", "month")) == (b"12345", None) # "a" is now most recent
+
+    cache.put(("c", "r1", "month"), b"123", "gzip")
+    assert cache.get(("b", "r1", "month")) is None # Least recently used goes first
+    assert cache.stats()["bytes"] == 8
+
+    cache.invalidate("a")
+    assert cache.get(("a", "r1", "month")) is None
+    assert cache.get(("c", "r1", "month")) == (b"123", "gzip")
+
+def test_conditional_get_helpers():
+    etag = make_etag(("a", "r1", "month", "pretty"))
+    assert etag != make_etag(("a", "r2", "month", "pretty"))
+    last_modified = http_date("2025-07-02T10:30:00.123456Z")
+    assert last_modified == "Wed, 02 Jul 2025 10:30:00 GMT"
+
+    assert is_not_modified({"if-none-match": f'"x", {etag}'}, etag, last_modified)
+    assert not is_not_modified({"if-none-match": '"x"', "if-modified-since": last_modified}, etag, last_modified)
+    assert is_not_modified({"if-modified-since": "Wed, 02 Jul 2025 11:00:00 GMT"}, etag, last_modified)
+    assert not is_not_modified({"if-modified-since": "Tue, 01 Jul 2025 00:00:00 GMT"}, etag, last_modified)
+    assert not is_not_modified({"if-modified-since": "garbage"}, etag, last_modified)
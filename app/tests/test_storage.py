@@ -0,0 +1,207 @@
+import threading
+import pandas as pd
+import pytest
+from app.services.storage import FileStorage, DiskStorage, create_storage, entry_nbytes
+
+def make_entry(rows=100):
+    return {"status": "done", "data": pd.DataFrame({"sku": [f"SKU{i:05d}" for i in range(rows)]}), "summary": {}}
+
+@pytest.fixture
+def clock(mocker):
+    now = [1000.0]
+    mocker.patch('app.services.storage.time.monotonic', side_effect=lambda: now[0])
+    return now
+
+def test_storage_get_set_shape():
+    storage = FileStorage(max_bytes=0, ttl_seconds=0)
+    entry = make_entry()
+    storage["file-1"] = entry
+    assert storage.get("file-1") is entry
+    assert storage["file-1"] is entry
+    assert "file-1" in storage
+    assert storage.get("missing") is None
+    assert storage.nbytes == entry_nbytes(entry) > 0
+
+def test_storage_evicts_least_recently_used_over_budget():
+    one_entry = entry_nbytes(make_entry())
+    storage = FileStorage(max_bytes=int(one_entry * 2.5), ttl_seconds=0)
+    storage["a"] = make_entry()
+    storage["b"] = make_entry()
+    storage.get("a") # "b" is now least recently used
+    storage["c"] = make_entry()
+
+    assert storage.keys() == ["a", "c"]
+    assert storage.is_expired("b")
+    assert not storage.is_expired("never-stored")
+    assert storage.stats()["evictions"] == {"lru": 1, "ttl": 0}
+    assert storage.nbytes <= storage.max_bytes
+
+def test_storage_keeps_new_entry_larger_than_budget():
+    storage = FileStorage(max_bytes=1, ttl_seconds=0)
+    storage["a"] = make_entry()
+    storage["b"] = make_entry()
+    assert storage.keys() == ["b"]
+
+def test_storage_ttl_eviction(clock):
+    storage = FileStorage(max_bytes=0, ttl_seconds=60)
+    storage["a"] = make_entry()
+    clock[0] += 30
+    storage["b"] = make_entry()
+    clock[0] += 31
+
+    assert storage.get("a") is None
+    assert storage.is_expired("a")
+    assert storage.get("b") is not None
+    assert storage.stats()["evictions"] == {"lru": 0, "ttl": 1}
+
+def test_storage_restoring_id_clears_expired_flag():
+    storage = FileStorage(max_bytes=1, ttl_seconds=0)
+    storage["a"] = make_entry()
+    storage["b"] = make_entry()
+    assert storage.is_expired("a")
+    storage["a"] = make_entry()
+    assert not storage.is_expired("a")
+
+
+# --- DiskStorage (shared across processes) ---
+def test_disk_storage_round_trip(tmp_path):
+    storage = DiskStorage(root=str(tmp_path), ttl_seconds=0)
+    entry = make_entry(rows=3)
+    entry["summary"] = {"rows": {"total": 3}}
+    storage["file-1"] = entry
+
+    loaded = storage.get("file-1")
+    assert loaded["status"] == "done"
+    assert loaded["summary"] == {"rows": {"total": 3}}
+    # Strings come back Arrow-backed, straight from the memory-mapped file
+    pd.testing.assert_frame_equal(loaded["data"], entry["data"], check_dtype=False)
+    assert isinstance(loaded["data"]["sku"].dtype, pd.ArrowDtype)
+    assert storage.keys() == ["file-1"]
+    assert storage.stats()["entries"] == 1
+
+def test_disk_storage_is_shared_between_instances(tmp_path):
+    writer = DiskStorage(root=str(tmp_path), ttl_seconds=0)
+    reader = DiskStorage(root=str(tmp_path), ttl_seconds=0)
+
+    writer["file-1"] = {"status": "queued", "data": None, "summary": None}
+    assert reader.get("file-1")["status"] == "queued"
+
+    # Updates made by another process invalidate the reader's cached copy
+    writer["file-1"] = make_entry(rows=5)
+    assert reader.get("file-1")["status"] == "done"
+    assert len(reader.get("file-1")["data"]) == 5
+
+    writer.pop("file-1")
+    assert reader.get("file-1") is None
+
+def test_disk_storage_replaces_old_frame_files(tmp_path):
+    storage = DiskStorage(root=str(tmp_path), ttl_seconds=0)
+    storage["file-1"] = make_entry()
+    storage["file-1"] = make_entry()
+    assert len(list((tmp_path / "file-1").iterdir())) == 1
+
+def test_disk_storage_ttl_eviction(tmp_path, mocker):
+    now = [1000.0]
+    mocker.patch('app.services.storage.time.time', side_effect=lambda: now[0])
+    storage = DiskStorage(root=str(tmp_path), ttl_seconds=60)
+    storage["file-1"] = make_entry()
+    now[0] += 61
+
+    assert storage.get("file-1") is None
+    assert storage.is_expired("file-1")
+    assert storage.stats()["evictions"] == {"ttl": 1}
+    assert not (tmp_path / "file-1").exists()
+
+def test_create_storage_backends():
+    assert isinstance(create_storage("memory"), FileStorage)
+    with pytest.raises(ValueError):
+        create_storage("redis")
+
+def test_disk_storage_survives_restart_with_typed_frames(tmp_path):
+    frame = pd.DataFrame({
+        "sku": pd.Categorical(["A", "B", "A"]),
+        "item_price": [1.5, 2.0, None],
+        "purchased_date": pd.to_datetime(["2024-01-01", "2024-01-02", None]),
+    })
+    DiskStorage(root=str(tmp_path), ttl_seconds=0)["file-1"] = {"status": "done", "typed": frame, "summary": {"rows": {}}}
+
+    # A new instance stands in for the restarted process
+    loaded = DiskStorage(root=str(tmp_path), ttl_seconds=0).get("file-1")
+    pd.testing.assert_frame_equal(loaded["typed"], frame)
+    assert list((tmp_path / "file-1").iterdir())[0].suffix == ".arrow"
+
+def test_update_fields_keeps_frames(tmp_path):
+    for storage in (FileStorage(max_bytes=0, ttl_seconds=0), DiskStorage(root=str(tmp_path), ttl_seconds=0)):
+        entry = make_entry(rows=3)
+        storage["file-1"] = entry
+        nbytes = storage.stats()["bytes"]
+
+        assert storage.update_fields("file-1", summary={"rows": {"total": 3}})
+        updated = storage.get("file-1")
+        assert updated["summary"] == {"rows": {"total": 3}}
+        assert updated["status"] == "done"
+        pd.testing.assert_frame_equal(updated["data"], entry["data"], check_dtype=False)
+        assert storage.stats()["bytes"] == nbytes
+        assert not storage.update_fields("missing", summary={})
+
+def test_disk_storage_field_updates_reach_other_instances(tmp_path):
+    writer = DiskStorage(root=str(tmp_path), ttl_seconds=0)
+    reader = DiskStorage(root=str(tmp_path), ttl_seconds=0)
+    writer["file-1"] = make_entry(rows=3)
+    assert reader.get("file-1")["summary"] == {} # Cached by the reader
+
+    writer.update_fields("file-1", summary={"appends": 1})
+    assert reader.get("file-1")["summary"] == {"appends": 1}
+    assert len(list((tmp_path / "file-1").iterdir())) == 1 # Frames not rewritten
+
+def test_disk_storage_lock_holds_across_instances(tmp_path):
+    first = DiskStorage(root=str(tmp_path), ttl_seconds=0)
+    second = DiskStorage(root=str(tmp_path), ttl_seconds=0) # Stands in for another process
+    acquired = threading.Event()
+
+    def take_lock():
+        with second.lock("file-1"):
+            acquired.set()
+
+    with first.lock("file-1"):
+        thread = threading.Thread(target=take_lock)
+        thread.start()
+        assert not acquired.wait(0.2)
+        with second.lock("file-2"): # Other file_ids are not held up
+            pass
+    assert acquired.wait(5)
+    thread.join()
+
+def test_disk_storage_left_over_keys_after_restart(tmp_path):
+    first = DiskStorage(root=str(tmp_path), ttl_seconds=0)
+    first["file-1"] = {"status": "parsing", "data": None, "summary": None}
+    # Opened while another process has the store open: its entries are not left over
+    second = DiskStorage(root=str(tmp_path), ttl_seconds=0)
+    assert second.left_over_keys() == []
+    second.close()
+    first.close()
+
+    restarted = DiskStorage(root=str(tmp_path), ttl_seconds=0)
+    restarted["file-2"] = {"status": "queued", "data": None, "summary": None}
+    assert restarted.left_over_keys() == ["file-1"]
+    assert restarted.fields("file-1") == {"status": "parsing", "data": None, "summary": None}
+    assert FileStorage().left_over_keys() == []
+
+def test_storage_reports_each_eviction(tmp_path, mocker):
+    evicted = []
+    storage = FileStorage(max_bytes=1, ttl_seconds=0)
+    storage.on_evict(lambda file_id, reason: evicted.append((file_id, reason)))
+    storage["a"] = make_entry()
+    storage["b"] = make_entry()
+    storage.pop("b") # Not an eviction
+    assert evicted == [("a", "lru")]
+
+    now = [1000.0]
+    mocker.patch('app.services.storage.time.time', side_effect=lambda: now[0])
+    disk = DiskStorage(root=str(tmp_path), ttl_seconds=60)
+    disk.on_evict(lambda file_id, reason: evicted.append((file_id, reason)))
+    disk["file-1"] = make_entry()
+    now[0] += 61
+    disk.keys()
+    disk.keys() # Already gone: counted once
+    assert evicted == [("a", "lru"), ("file-1", "ttl")]
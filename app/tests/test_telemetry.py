@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.services import telemetry
+
+ROOT = Path(__file__).resolve().parents[2]
+
+def test_middleware_labels_requests_by_route_template():
+    app = FastAPI()
+    app.add_middleware(telemetry.TelemetryMiddleware)
+
+    @app.get("/items/{item_id}")
+    def item(item_id: str):
+        return {"id": item_id}
+
+    client = TestClient(app)
+    labels = {"method": "GET", "route": "/items/{item_id}"}
+    before = telemetry.registry.get_sample_value("http_request_duration_seconds_count", labels) or 0
+    for item_id in ("a", "b"):
+        client.get(f"/items/{item_id}")
+    client.get("/missing")
+
+    registry = telemetry.registry
+    assert registry.get_sample_value("http_request_duration_seconds_count", labels) == before + 2
+    assert registry.get_sample_value("http_requests_total", {**labels, "status": "200"}) >= 2
+    assert registry.get_sample_value(
+        "http_requests_total", {"method": "GET", "route": telemetry.UNMATCHED_ROUTE, "status": "404"}) >= 1
+    assert registry.get_sample_value("http_requests_in_flight", {"method": "GET"}) == 0
+
+    text = telemetry.render().decode()
+    assert 'http_response_size_bytes_bucket{le="+Inf",method="GET",route="/items/{item_id}"}' in text
+
+INCREMENT = "from app.services import telemetry; telemetry.ingest_files.labels(status='done').inc(2)"
+RENDER = "import sys; from app.services import telemetry; sys.stdout.buffer.write(telemetry.render())"
+
+def test_render_sums_counters_across_worker_processes(tmp_path):
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path), "PYTHONPATH": str(ROOT)}
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", INCREMENT], env=env, cwd=ROOT, check=True)
+    scraped = subprocess.run([sys.executable, "-c", RENDER], env=env, cwd=ROOT, check=True,
+                             capture_output=True).stdout.decode()
+    assert 'ingest_files_total{status="done"} 4.0' in scraped.splitlines()
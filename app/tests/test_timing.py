@@ -0,0 +1,40 @@
+import time
+from app.services.timing import StageTimer
+
+def test_stage_timer_reports_exclusive_time_for_nested_stages():
+    timer = StageTimer()
+    with timer.stage("parse"):
+        time.sleep(0.02)
+        with timer.stage("decode"):
+            time.sleep(0.05)
+
+    assert timer.seconds["decode"] >= 0.05
+    assert 0.02 <= timer.seconds["parse"] < timer.seconds["decode"] # The inner stage is not counted twice
+    assert timer.peak_rss_bytes is None or timer.peak_rss_bytes > 0
+    assert timer.peak_rss_growth_bytes is None or timer.peak_rss_growth_bytes >= 0
+
+def test_stage_timer_iterate_times_each_step():
+    def slow_source():
+        for i in range(3):
+            time.sleep(0.01)
+            yield i
+
+    timer = StageTimer()
+    consumed = []
+    started = time.perf_counter()
+    for item in timer.iterate("download", slow_source()):
+        consumed.append(item)
+        time.sleep(0.02) # Consumer time is not charged to the source
+    assert consumed == [0, 1, 2]
+    assert timer.seconds["download"] >= 0.03
+    assert timer.seconds["download"] <= time.perf_counter() - started - 0.06
+
+def test_stage_timer_reports_rss_growth_over_start(mocker):
+    rss = iter([100, 250, 180])
+    mocker.patch('app.services.timing.current_rss_bytes', side_effect=lambda: next(rss))
+    timer = StageTimer()
+    with timer.stage("parse"):
+        pass
+    with timer.stage("typing"):
+        pass
+    assert (timer.start_rss_bytes, timer.peak_rss_bytes, timer.peak_rss_growth_bytes) == (100, 250, 150)
@@ -0,0 +1,259 @@
+"""
+Ingest and metrics hot-path benchmarks on a synthetic order-items CSV.
+
+Times, best of --repeat runs, on one generated file:
+  analysis          _perform_detailed_analysis on the decoded text
+  ingest            the streaming pipeline (decode, parse, validate, typing, aggregates)
+  generate_metrics  month and year metrics from the typed frame
+  rollup            month and year metrics rolled up from the per-day aggregates
+  rollup_range      month metrics of the last quarter only (from/to), from the aggregates
+  http_upload       POST /upload end to end, the CSV served by a local HTTP server
+  http_stats        GET processing-stats
+  http_metrics      GET metrics?groupby=month with the response cache cleared
+
+Each result records seconds, rows/s, MB/s and the peak process RSS seen
+while it ran. The generated row counts are checked against the summary.
+With --baseline, results are compared to a stored JSON file and the exit
+status is 1 if any benchmark is more than --tolerance slower;
+--save-baseline writes the current results there instead.
+
+    python benchmarks/bench_ingest.py [--rows 200000] [--months 24] [--skus 500]
+        [--malformed 0.01] [--duplicates 0.05] [--blank 0.01] [--encoding utf-8]
+        [--repeat 3] [--baseline benchmarks/baseline.json [--save-baseline]]
+"""
+import argparse
+import http.server
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # The app resolves its templates relative to the working directory
+
+import pandas as pd  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.main import app  # noqa: E402
+from app.services.file_handler import _ingest_stream, _perform_detailed_analysis, file_storage  # noqa: E402
+from app.services.jobs import upload_queue  # noqa: E402
+from app.services.metrics_calculator import generate_metrics, metrics_from_aggregates  # noqa: E402
+from app.services.response_cache import metrics_cache  # noqa: E402
+from app.services.timing import current_rss_bytes  # noqa: E402
+from benchmarks.datagen import ENCODINGS, generate_csv  # noqa: E402
+
+CHUNK_BYTES = 1 << 20
+
+# Arguments that shape the workload; a baseline is only comparable if they match
+PARAMS = ("rows", "months", "skus", "malformed", "duplicates", "blank", "encoding", "seed", "repeat")
+
+
+class PeakRSS:
+    """Samples the process RSS on a background thread while the block runs."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+
+    def _sample(self) -> None:
+        rss = current_rss_bytes()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def measure(func, repeat: int, setup=None) -> dict:
+    """Best wall time of `func()` over `repeat` runs (after `setup()`), and the peak RSS."""
+    timings = []
+    with PeakRSS() as rss:
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+    return {"seconds": min(timings), "peak_rss_bytes": rss.peak}
+
+
+class CSVHost:
+    """Local HTTP server standing in for the CSV host; serves one body at /orders.csv."""
+
+    def __init__(self, body: bytes):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/csv")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/orders.csv"
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def check_counts(name: str, rows: dict, expected: dict) -> None:
+    if rows != expected:
+        raise SystemExit(f"{name}: summary rows {rows} differ from the generated counts {expected}")
+
+
+def run(args) -> dict:
+    body, expected = generate_csv(
+        args.rows, months=args.months, skus=args.skus, malformed=args.malformed,
+        duplicates=args.duplicates, blank=args.blank, encoding=args.encoding, seed=args.seed,
+    )
+    text = body.decode(args.encoding)
+    chunks = [body[i:i + CHUNK_BYTES] for i in range(0, len(body), CHUNK_BYTES)]
+    results = {}
+
+    summary, _ = _perform_detailed_analysis(text)
+    check_counts("analysis", summary["rows"], {**expected, "encoding_errors": 0})
+    results["analysis"] = measure(lambda: _perform_detailed_analysis(text), args.repeat)
+
+    file_id, _, summary = _ingest_stream(iter(chunks))
+    check_counts("ingest", summary["rows"], expected)
+    results["ingest"] = measure(lambda: _ingest_stream(iter(chunks), file_id=file_id), args.repeat)
+
+    entry = file_storage[file_id]
+    for groupby in ("month", "year"):
+        results[f"generate_metrics_{groupby}"] = measure(
+            lambda: generate_metrics(entry["typed"], groupby), args.repeat)
+        results[f"rollup_{groupby}"] = measure(
+            lambda: metrics_from_aggregates(entry["daily"], entry["daily_skus"], groupby), args.repeat)
+    last_day = entry["daily"]["day"].max()
+    quarter = ((last_day - pd.DateOffset(months=3)).date(), last_day.date())
+    results["rollup_range"] = measure(
+        lambda: metrics_from_aggregates(entry["daily"], entry["daily_skus"], "month", *quarter), args.repeat)
+    file_storage.pop(file_id)
+
+    client = TestClient(app)
+    with CSVHost(body) as host:
+        uploaded = []
+
+        def upload():
+            uploaded.append(client.post("/upload", data={"csv_url": host.url}).json()["file_id"])
+            if not upload_queue.drain(timeout=600):
+                raise SystemExit("Upload did not finish in time")
+
+        results["http_upload"] = measure(upload, args.repeat)
+
+    stats_url = f"/api/v1/order-items/uploads/{uploaded[-1]}/processing-stats"
+    stats = client.get(stats_url).json()
+    if stats.get("status") != "done":
+        raise SystemExit(f"http_upload: job ended as {stats}")
+    check_counts("http_upload", stats["rows"], expected)
+    results["http_stats"] = measure(lambda: client.get(stats_url), args.repeat)
+    metrics_url = f"/api/v1/order-items/uploads/{uploaded[-1]}/metrics?groupby=month"
+    results["http_metrics"] = measure(lambda: client.get(metrics_url), args.repeat, setup=metrics_cache.clear)
+    for uploaded_id in uploaded:
+        file_storage.pop(uploaded_id)
+
+    for result in results.values():
+        result["rows_per_second"] = round(args.rows / result["seconds"], 1) if result["seconds"] else None
+        result["mb_per_second"] = round(len(body) / 1e6 / result["seconds"], 2) if result["seconds"] else None
+        result["seconds"] = round(result["seconds"], 6)
+    return {
+        "params": {key: value for key, value in vars(args).items() if key in PARAMS},
+        "bytes": len(body),
+        "python": platform.python_version(),
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Names of the benchmarks more than `tolerance` slower than in `baseline`."""
+    if baseline.get("params") != current["params"]:
+        print("warning: baseline was recorded with different parameters", file=sys.stderr)
+    regressions = []
+    for name, result in current["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if before and before["seconds"] and result["seconds"] > before["seconds"] * (1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def report(current: dict, baseline: dict | None) -> None:
+    print(f"{current['params']['rows']} rows, {current['bytes'] / 1e6:.1f} MB ({current['params']['encoding']})")
+    print(f"{'benchmark':<24} {'seconds':>10} {'rows/s':>12} {'MB/s':>8} {'peak RSS MB':>12} {'vs baseline':>12}")
+    for name, result in current["results"].items():
+        before = (baseline or {}).get("results", {}).get(name)
+        change = f"{result['seconds'] / before['seconds'] - 1:+.1%}" if before and before["seconds"] else ""
+        peak = f"{result['peak_rss_bytes'] / 1e6:.0f}" if result["peak_rss_bytes"] else "n/a"
+        print(f"{name:<24} {result['seconds']:>10.4f} {result['rows_per_second'] or 0:>12.0f} "
+              f"{result['mb_per_second'] or 0:>8.2f} {peak:>12} {change:>12}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--skus", type=int, default=500)
+    parser.add_argument("--malformed", type=float, default=0.01)
+    parser.add_argument("--duplicates", type=float, default=0.05)
+    parser.add_argument("--blank", type=float, default=0.01)
+    parser.add_argument("--encoding", choices=ENCODINGS, default="utf-8")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", help="JSON file of stored results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results to --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs the baseline")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+    if args.save_baseline and not args.baseline:
+        parser.error("--save-baseline needs --baseline")
+    if args.baseline and not args.save_baseline and not os.path.exists(args.baseline):
+        parser.error(f"baseline {args.baseline} not found (record one with --save-baseline)")
+
+    current = run(args)
+
+    baseline = None
+    if args.baseline and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if args.json:
+        print(json.dumps(current, indent=4))
+    else:
+        report(current, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(current, f, indent=4)
+        print(f"baseline written to {args.baseline}")
+    elif baseline is not None:
+        regressions = compare(current, baseline, args.tolerance)
+        if regressions:
+            print(f"regressions beyond {args.tolerance:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+How generate_metrics scales with the number of periods.
+
+Times generate_metrics(groupby="month") on a fixed number of rows spread over
+a growing number of months, next to the per-period slice-and-count scan it
+replaced (one full-frame filter plus value_counts per period).
+
+    python benchmarks/bench_metrics.py [--rows 200000] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.metrics_calculator import build_typed_frame, generate_metrics  # noqa: E402
+
+PERIODS = [1, 12, 60, 120, 240]
+
+
+def make_frame(rows: int, months: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2000-01-01")
+    month = rng.integers(0, months, rows)
+    dates = [start + pd.DateOffset(months=int(m)) for m in range(months)]
+    return pd.DataFrame({
+        "order_id": [f"ord{i}" for i in range(rows)],
+        "sku": [f"SKU{n:04d}" for n in rng.integers(0, 500, rows)],
+        "item_price": rng.uniform(1, 100, rows).round(2),
+        "item_tax": rng.uniform(0, 10, rows).round(2),
+        "item_discount": rng.uniform(0, 5, rows).round(2),
+        "purchased_date": pd.DatetimeIndex(dates)[month] + pd.to_timedelta(rng.integers(0, 27, rows), unit="D"),
+    })
+
+
+def per_slice_scan(df: pd.DataFrame) -> None:
+    # The replaced approach: a full-frame filter and value_counts per period
+    period = df["purchased_date"].dt.to_period("M").astype(str)
+    for key in period.unique():
+        counts = df.loc[period == key, "sku"].value_counts()
+        counts.idxmax(), counts.idxmin()
+
+
+def best_of(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'periods':>8} {'generate_metrics (s)':>21} {'per-slice scan (s)':>19}")
+    for months in PERIODS:
+        typed = build_typed_frame(make_frame(args.rows, months))
+        metrics_secs = best_of(lambda: generate_metrics(typed, "month"), args.repeat)
+        scan_secs = best_of(lambda: per_slice_scan(typed), args.repeat)
+        print(f"{months:>8} {metrics_secs:>21.4f} {scan_secs:>19.4f}")
+
+
+if __name__ == "__main__":
+    main()
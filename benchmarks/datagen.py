@@ -0,0 +1,87 @@
+"""
+Synthetic order-items CSV generator for the benchmarks.
+
+Builds a CSV body with a known mix of rows, so benchmarks can check the
+processing summary as well as time it:
+
+    from benchmarks.datagen import generate_csv
+    body, expected = generate_csv(rows=100_000, months=24, skus=500, duplicates=0.05)
+
+`expected` holds the `rows` counts the processing summary must report.
+"""
+import numpy as np
+import pandas as pd
+
+COLUMNS = ["order_item_id", "order_id", "sku", "item_price", "item_tax", "item_discount", "purchased_date"]
+
+# Encodings the generator can write; non-ASCII SKUs only where the encoding can hold them
+ENCODINGS = ["utf-8", "utf-8-sig", "cp1252", "latin-1", "utf-16", "ascii"]
+
+
+def generate_csv(rows: int, months: int = 12, skus: int = 500, malformed: float = 0.0,
+                 duplicates: float = 0.0, blank: float = 0.0, encoding: str = "utf-8",
+                 seed: int = 0) -> tuple[bytes, dict]:
+    """
+    Returns (encoded CSV body, expected summary row counts) for `rows` data
+    lines spread over `months` months and `skus` distinct SKUs. The ratios
+    pick how many lines are blank, have an unparseable item_price
+    (malformed) or repeat an earlier order_item_id (duplicates); the three
+    sets are disjoint. Outside pure ASCII, one SKU in ten gets accented
+    letters, so decoding matters.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unsupported encoding: {encoding}")
+    rng = np.random.default_rng(seed)
+    n_blank = int(round(rows * blank))
+    n_dup = int(round(rows * duplicates))
+    n_malformed = int(round(rows * malformed))
+    if rows and n_blank + n_dup + n_malformed >= rows:
+        raise ValueError("Blank, duplicate and malformed ratios leave no unique rows")
+
+    # Row roles: 0 unique, 1 blank, 2 duplicate, 3 malformed (unique key, bad price)
+    roles = np.zeros(rows, dtype=np.int8)
+    order = rng.permutation(rows)
+    roles[order[:n_blank]] = 1
+    roles[order[n_blank:n_blank + n_dup]] = 2
+    roles[order[n_blank + n_dup:n_blank + n_dup + n_malformed]] = 3
+
+    # Duplicates reuse the key (and every other field) of a random unique-keyed row
+    item_ids = np.arange(rows)
+    keyed = np.flatnonzero((roles == 0) | (roles == 3))
+    dup_rows = np.flatnonzero(roles == 2)
+    item_ids[dup_rows] = rng.choice(keyed, size=len(dup_rows)) if len(keyed) else dup_rows
+
+    sku_names = np.array([f"SKU-{n:05d}" for n in range(skus)], dtype=object)
+    if encoding != "ascii":
+        accented = np.arange(skus) % 10 == 9
+        sku_names[accented] = [f"{name}-éà" for name in sku_names[accented]]
+    sku = sku_names[rng.integers(0, skus, rows)]
+    price = rng.uniform(1, 200, rows).round(2)
+    tax = (price * 0.1).round(2)
+    discount = rng.uniform(0, 5, rows).round(2)
+    start = pd.Timestamp("2020-01-01")
+    month_starts = pd.DatetimeIndex([start + pd.DateOffset(months=m) for m in range(max(months, 1))])
+    dates = (month_starts[rng.integers(0, max(months, 1), rows)]
+             + pd.to_timedelta(rng.integers(0, 28, rows), unit="D")).strftime("%Y-%m-%d")
+
+    lines = [",".join(COLUMNS)]
+    blank_line = "," * (len(COLUMNS) - 1)
+    for i in range(rows):
+        role = roles[i]
+        if role == 1:
+            lines.append(blank_line)
+            continue
+        src = item_ids[i]
+        price_text = "n/a" if role == 3 else f"{price[src]:.2f}"
+        lines.append(
+            f"item{src},ord{src // 3},{sku[src]},{price_text},{tax[src]:.2f},{discount[src]:.2f},{dates[src]}"
+        )
+    body = ("\n".join(lines) + "\n").encode(encoding)
+
+    sanitised = rows - n_blank
+    valid = sanitised - n_malformed
+    expected = {
+        "total": rows, "blank": n_blank, "malformed": n_malformed, "encoding_errors": 0,
+        "duplicated": n_dup, "sanitised": sanitised, "valid": valid, "usable": valid - n_dup,
+    }
+    return body, expected